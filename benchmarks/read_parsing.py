@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""Compare the read parsing speed of FastxParser and Bio.SeqIO
+
+Reports the number of reads per second for the byte-level FastxParser
+used by ReadProcessor and for the Bio.SeqIO based parsing that was
+used before. If no read files are given a FASTQ file with random reads
+is generated.
+
+usage: read_parsing.py [read_file ...]
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import random
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from Bio import SeqIO
+from reademptionlib.fastx import FastxParser
+from reademptionlib.readprocessor import ReadProcessor
+
+
+def main():
+    read_paths = sys.argv[1:]
+    tmp_path = None
+    if not read_paths:
+        tmp_path = _generate_random_fastq(500000, 100)
+        read_paths = [tmp_path]
+    for read_path in read_paths:
+        print(read_path)
+        for name, parse_function in [("FastxParser", _parse_fastx),
+                                     ("Bio.SeqIO", _parse_seqio)]:
+            start_time = time.time()
+            no_of_reads = parse_function(read_path)
+            duration = time.time() - start_time
+            print("  %-12s %10d reads %8.2f s %12.0f reads/s" % (
+                name, no_of_reads, duration, no_of_reads / duration))
+    if tmp_path is not None:
+        os.remove(tmp_path)
+
+
+def _parse_fastx(read_path):
+    no_of_reads = 0
+    with ReadProcessor()._input_fh(read_path) as input_fh:
+        for header, seq, qualities in FastxParser().entries(input_fh):
+            no_of_reads += 1
+    return no_of_reads
+
+
+def _parse_seqio(read_path):
+    no_of_reads = 0
+    # Text mode handling as in the former ReadProcessor code
+    with _text_fh(read_path) as input_fh:
+        fastq = input_fh.read(1) == "@"
+        input_fh.seek(0)
+        if fastq:
+            for seq_record in SeqIO.parse(input_fh, "fastq"):
+                (seq_record.description, str(seq_record.seq),
+                 seq_record.letter_annotations["phred_quality"])
+                no_of_reads += 1
+        else:
+            for seq_record in SeqIO.parse(input_fh, "fasta"):
+                (seq_record.description, str(seq_record.seq), None)
+                no_of_reads += 1
+    return no_of_reads
+
+
+def _text_fh(read_path):
+    if read_path.endswith(".gz"):
+        return gzip.open(read_path, "rt")
+    elif read_path.endswith(".bz2"):
+        return bz2.open(read_path, "rt")
+    elif read_path.endswith(".xz"):
+        return lzma.open(read_path, "rt")
+    return open(read_path)
+
+
+def _generate_random_fastq(no_of_reads, read_length):
+    tmp_fh = tempfile.NamedTemporaryFile(
+        "w", suffix=".fq", delete=False)
+    random.seed(1)
+    for read_no in range(no_of_reads):
+        tmp_fh.write("@read_%s\n%s\n+\n%s\n" % (
+            read_no,
+            "".join(random.choice("ACGT") for _ in range(read_length)),
+            "".join(random.choice("#5?I") for _ in range(read_length))))
+    tmp_fh.close()
+    return tmp_fh.name
+
+
+if __name__ == "__main__":
+    main()
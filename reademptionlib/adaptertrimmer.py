@@ -0,0 +1,219 @@
+class AdapterTrimmer(object):
+    """Find 3' adapters in reads allowing mismatches and indels.
+
+    The reads are searched with Myers' bit-parallel algorithm for
+    approximate string matching. A full adapter occurrence may have up
+    to max_error_rate * adapter length edit operations. At the 3' end
+    of a read a prefix of the adapter with at least min_overlap
+    nucleotides is accepted with the same error rate. The adapter and
+    all nucleotides downstream of it are trimmed off. An N in the
+    adapter matches any nucleotide.
+
+    To avoid aligning the whole read, the adapter is split into one
+    piece more than the number of allowed errors. A full occurrence
+    contains at least one of them unchanged, so only the region around
+    the first exact piece occurrences and the 3' end of the read are
+    searched.
+    """
+
+    def __init__(self, adapters, max_error_rate=0.1, min_overlap=3):
+        self._adapters = [adapter.upper() for adapter in adapters]
+        self._max_error_rate = max_error_rate
+        self._min_overlap = min_overlap
+        self._char_masks = [self._pattern_char_masks(adapter)
+                            for adapter in self._adapters]
+        self._pieces = [self._adapter_pieces(adapter)
+                        for adapter in self._adapters]
+
+    def trim(self, seq):
+        """Return the trimmed sequence and the trimmed adapter.
+
+        If no adapter is found the sequence is returned unchanged
+        together with None. If several adapters are found the one that
+        starts most upstream is trimmed.
+        """
+        upper_seq = seq if seq.isupper() else seq.upper()
+        best_start_pos = None
+        best_adapter = None
+        for adapter, char_masks, pieces in zip(
+                self._adapters, self._char_masks, self._pieces):
+            start_pos = self._adapter_start_pos(
+                upper_seq, adapter, char_masks, pieces)
+            if start_pos is not None and (
+                    best_start_pos is None or start_pos < best_start_pos):
+                best_start_pos = start_pos
+                best_adapter = adapter
+        if best_adapter is None:
+            return seq, None
+        return seq[:best_start_pos], best_adapter
+
+    def _adapter_start_pos(self, seq, adapter, char_masks, pieces):
+        """Return the start position of the adapter in the sequence or
+        None if it is not found.
+        """
+        # Exact full length occurrences are most common and cheap to
+        # find
+        exact_start_pos = seq.find(adapter)
+        if exact_start_pos != -1:
+            return exact_start_pos
+        adapter_len = len(adapter)
+        max_errors = int(self._max_error_rate * adapter_len)
+        match_end_pos, vertical_plus, vertical_minus = self._search(
+            seq, self._search_start_pos(seq, adapter_len, max_errors, pieces),
+            char_masks, adapter_len, max_errors)
+        if match_end_pos is not None:
+            return self._match_start_pos(seq[:match_end_pos], adapter)
+        # Search for a partial adapter at the 3' end of the read. The
+        # vertical deltas of the last column are the edit distances of
+        # the adapter prefixes to the best matching read suffixes.
+        prefix_errors = 0
+        prefix_errors_by_len = [0]
+        for prefix_len in range(1, adapter_len):
+            bit = 1 << (prefix_len - 1)
+            if vertical_plus & bit:
+                prefix_errors += 1
+            elif vertical_minus & bit:
+                prefix_errors -= 1
+            prefix_errors_by_len.append(prefix_errors)
+        # Longer overlaps are preferred
+        for prefix_len in range(min(adapter_len - 1, len(seq)),
+                                self._min_overlap - 1, -1):
+            if prefix_errors_by_len[prefix_len] <= int(
+                    self._max_error_rate * prefix_len):
+                return self._match_start_pos(seq, adapter[:prefix_len])
+        return None
+
+    def _search_start_pos(self, seq, adapter_len, max_errors, pieces):
+        """Return the most upstream position at which an adapter
+        occurrence or a partial adapter at the 3' end can start.
+        """
+        # A partial adapter can span at most the adapter length minus
+        # one plus the allowed errors
+        start_pos = len(seq) - adapter_len + 1 - max_errors
+        if pieces is None:
+            return 0
+        for piece, offset in pieces:
+            piece_pos = seq.find(piece)
+            if piece_pos != -1:
+                start_pos = min(start_pos, piece_pos - offset - max_errors)
+        return max(0, start_pos)
+
+    def _search(self, seq, start_pos, char_masks, pattern_len, max_errors):
+        """Return the first end position of a pattern occurrence with at
+        most max_errors edit operations.
+
+        The pattern may start at any position of the sequence from the
+        start position on. Returns
+        a tuple of the end position (or None) and the vertical delta
+        bit vectors of the last processed column.
+        """
+        all_bits = (1 << pattern_len) - 1
+        last_bit = 1 << (pattern_len - 1)
+        vertical_plus = all_bits
+        vertical_minus = 0
+        score = pattern_len
+        match_end_pos = None
+        for pos in range(start_pos, len(seq)):
+            equal = char_masks.get(seq[pos], 0)
+            x_vertical = equal | vertical_minus
+            x_horizontal = (((equal & vertical_plus) + vertical_plus) ^
+                            vertical_plus) | equal
+            horizontal_plus = vertical_minus | (
+                ~(x_horizontal | vertical_plus) & all_bits)
+            horizontal_minus = vertical_plus & x_horizontal
+            if horizontal_plus & last_bit:
+                score += 1
+            elif horizontal_minus & last_bit:
+                score -= 1
+            # The first row is zero since a match can start anywhere
+            horizontal_plus = (horizontal_plus << 1) & all_bits
+            horizontal_minus = (horizontal_minus << 1) & all_bits
+            vertical_plus = horizontal_minus | (
+                ~(x_vertical | horizontal_plus) & all_bits)
+            vertical_minus = horizontal_plus & x_vertical
+            if match_end_pos is not None:
+                # Extend the match as long as the score improves
+                if score < best_score:
+                    match_end_pos = pos + 1
+                    best_score = score
+                else:
+                    break
+            elif score <= max_errors:
+                match_end_pos = pos + 1
+                best_score = score
+        return match_end_pos, vertical_plus, vertical_minus
+
+    def _match_start_pos(self, seq, pattern):
+        """Return the start position of the best alignment of the
+        pattern that ends at the end of the sequence.
+
+        The reversed pattern is aligned to the reversed sequence with a
+        fixed start. Among equally good alignments the shortest one is
+        chosen.
+        """
+        reversed_seq = seq[::-1]
+        pattern_len = len(pattern)
+        char_masks = self._pattern_char_masks(pattern[::-1])
+        all_bits = (1 << pattern_len) - 1
+        last_bit = 1 << (pattern_len - 1)
+        vertical_plus = all_bits
+        vertical_minus = 0
+        score = pattern_len
+        best_score = score
+        best_len = 0
+        for pos, char in enumerate(reversed_seq):
+            equal = char_masks.get(char, 0)
+            x_vertical = equal | vertical_minus
+            x_horizontal = (((equal & vertical_plus) + vertical_plus) ^
+                            vertical_plus) | equal
+            horizontal_plus = vertical_minus | (
+                ~(x_horizontal | vertical_plus) & all_bits)
+            horizontal_minus = vertical_plus & x_horizontal
+            if horizontal_plus & last_bit:
+                score += 1
+            elif horizontal_minus & last_bit:
+                score -= 1
+            # The first row increases by one in each column as the
+            # alignment has to start at the first position
+            horizontal_plus = ((horizontal_plus << 1) | 1) & all_bits
+            horizontal_minus = (horizontal_minus << 1) & all_bits
+            vertical_plus = horizontal_minus | (
+                ~(x_vertical | horizontal_plus) & all_bits)
+            vertical_minus = horizontal_plus & x_vertical
+            if score < best_score:
+                best_score = score
+                best_len = pos + 1
+            # The score cannot drop below the best one once the
+            # alignment is longer than pattern plus errors
+            if pos + 1 >= pattern_len + best_score:
+                break
+        return len(seq) - best_len
+
+    def _adapter_pieces(self, adapter):
+        """Return the pieces of the adapter and their offsets.
+
+        Adapters with wildcards cannot be split into pieces that must
+        occur exactly, for them None is returned.
+        """
+        if "N" in adapter:
+            return None
+        no_of_pieces = int(self._max_error_rate * len(adapter)) + 1
+        piece_len = len(adapter) // no_of_pieces
+        return [(adapter[offset:offset + piece_len], offset)
+                for offset in range(0, piece_len * no_of_pieces, piece_len)]
+
+    def _pattern_char_masks(self, pattern):
+        """Return the positions of each nucleotide in the pattern as bit
+        masks.
+
+        An N in the pattern matches any nucleotide of the read. Other
+        characters of the read do not match.
+        """
+        char_masks = dict((char, 0) for char in "ACGTN")
+        for pos, char in enumerate(pattern):
+            if char == "N":
+                for mask_char in char_masks:
+                    char_masks[mask_char] |= 1 << pos
+            else:
+                char_masks[char] = char_masks.get(char, 0) | (1 << pos)
+        return char_masks
@@ -0,0 +1,41 @@
+import pysam
+
+
+class AlignmentPass(object):
+    """Read the alignments of a BAM file once and pass them to several
+    accumulators.
+
+    Each alignment is decoded only once, no matter how many results
+    are calculated from it. The alignments are passed replicon by
+    replicon in the order of the BAM file and in chunks, so each
+    accumulator processes many alignments with one call. An
+    accumulator has the methods start_reference(ref_seq, length),
+    add_alignments(alignments) and finish_reference(ref_seq).
+    """
+
+    # Number of alignments that are passed to the accumulators at once
+    _chunk_size = 65536
+
+    def __init__(self, accumulators):
+        self._accumulators = accumulators
+
+    def run(self, bam_path):
+        with pysam.AlignmentFile(bam_path) as bam:
+            for ref_seq, length in zip(bam.references, bam.lengths):
+                for accumulator in self._accumulators:
+                    accumulator.start_reference(ref_seq, length)
+                for alignments in self._alignment_chunks(bam.fetch(ref_seq)):
+                    for accumulator in self._accumulators:
+                        accumulator.add_alignments(alignments)
+                for accumulator in self._accumulators:
+                    accumulator.finish_reference(ref_seq)
+
+    def _alignment_chunks(self, alignments):
+        chunk = []
+        for alignment in alignments:
+            chunk.append(alignment)
+            if len(chunk) == self._chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
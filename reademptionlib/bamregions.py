@@ -0,0 +1,42 @@
+import pysam
+
+
+def bam_regions(bam_path, processes):
+    """Split the replicons of a BAM file into regions of about the same
+    number of alignments.
+
+    Each process gets several regions to balance their runtimes. The
+    alignments are assumed to be evenly distributed within a replicon.
+    A region is given as replicon id, start and end.
+    """
+    with pysam.AlignmentFile(bam_path) as bam:
+        replicon_ids_and_lengths = list(zip(bam.references, bam.lengths))
+        replicon_ids_and_no_of_alignments = dict(
+            (index_stats.contig, index_stats.total)
+            for index_stats in bam.get_index_statistics())
+    max_alignments_per_region = max(1, sum(
+        replicon_ids_and_no_of_alignments.values()) // (processes * 4))
+    regions = []
+    for replicon_id, replicon_length in replicon_ids_and_lengths:
+        no_of_regions = 1
+        if processes > 1:
+            no_of_alignments = replicon_ids_and_no_of_alignments.get(
+                replicon_id, 0)
+            no_of_regions = max(1, -(
+                -no_of_alignments // max_alignments_per_region))
+        region_length = max(1, -(-replicon_length // no_of_regions))
+        for start in range(0, replicon_length, region_length):
+            regions.append((replicon_id, start, min(
+                start + region_length, replicon_length)))
+    return regions
+
+
+def region_alignments(bam, region):
+    """Return the alignments starting in the region.
+
+    Alignments starting before the region belong to the previous one.
+    """
+    replicon_id, start, end = region
+    for alignment in bam.fetch(replicon_id, start, end):
+        if alignment.reference_start >= start:
+            yield alignment
@@ -0,0 +1,115 @@
+import concurrent.futures
+import gzip
+import struct
+import zlib
+from collections import deque
+
+
+class OutputCodec(object):
+    """Open output files with a selectable compression.
+
+    Supported codecs are "gzip", "bgzf" (blocked gzip that is
+    compressed by several threads and can be read by any gzip reader),
+    "zstd" (requires the zstandard package) and "none".
+    """
+
+    suffixes = {"gzip": ".gz", "bgzf": ".gz", "zstd": ".zst", "none": ""}
+    default_levels = {"gzip": 9, "bgzf": 6, "zstd": 3, "none": None}
+
+    def __init__(self, codec="gzip", level=None, threads=1):
+        if codec not in self.suffixes:
+            raise UnknownCodec(codec)
+        self.codec = codec
+        if level is None:
+            level = self.default_levels[codec]
+        self._level = level
+        self._threads = threads
+
+    def suffix(self):
+        return self.suffixes[self.codec]
+
+    def open(self, output_path):
+        """Return a binary file handle that compresses on writing."""
+        if self.codec == "gzip":
+            return gzip.open(output_path, "wb", compresslevel=self._level)
+        elif self.codec == "bgzf":
+            return BgzfWriter(output_path, level=self._level,
+                              threads=self._threads)
+        elif self.codec == "zstd":
+            import zstandard
+            compressor = zstandard.ZstdCompressor(
+                level=self._level, threads=self._threads)
+            return compressor.stream_writer(open(output_path, "wb"))
+        return open(output_path, "wb")
+
+
+class BgzfWriter(object):
+    """Write a BGZF file and compress its blocks in parallel.
+
+    Each block is a complete gzip member holding at most 65280 bytes of
+    uncompressed data, so the blocks can be compressed independently
+    by a pool of threads (zlib releases the GIL) and are written in
+    their original order.
+    """
+
+    _block_size = 65280
+    _eof_block = bytes.fromhex(
+        "1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+    def __init__(self, output_path, level=6, threads=1):
+        self._output_fh = open(output_path, "wb")
+        self._level = level
+        self._threads = threads
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads)
+        self._jobs = deque()
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            self._submit_block(bytes(self._buffer[:self._block_size]))
+            del self._buffer[:self._block_size]
+        return len(data)
+
+    def close(self):
+        if self._buffer:
+            self._submit_block(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._jobs:
+            self._output_fh.write(self._jobs.popleft().result())
+        self._output_fh.write(self._eof_block)
+        self._output_fh.close()
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _submit_block(self, data):
+        self._jobs.append(self._executor.submit(
+            compress_bgzf_block, data, self._level))
+        # Write finished blocks and limit the number of blocks in
+        # memory
+        while self._jobs and (self._jobs[0].done() or
+                              len(self._jobs) > 4 * self._threads):
+            self._output_fh.write(self._jobs.popleft().result())
+
+
+def compress_bgzf_block(data, level):
+    """Return the data as BGZF block (a gzip member with BSIZE field)."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed_data = compressor.compress(data) + compressor.flush()
+    # BSIZE is the total block size minus one: 18 bytes header, the
+    # compressed data and 8 bytes footer
+    header = struct.pack(
+        "<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+        len(compressed_data) + 25)
+    footer = struct.pack("<II", zlib.crc32(data), len(data))
+    return header + compressed_data + footer
+
+
+class UnknownCodec(BaseException):
+    pass
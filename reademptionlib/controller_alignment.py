@@ -1,11 +1,18 @@
 import concurrent.futures
+import contextlib
+import copy
 import os
+import sys
+import time
 from reademptionlib.vizalign import AlignViz
 from reademptionlib.bammerger import BamMerger
+from reademptionlib.compression import OutputCodec
 from reademptionlib.crossalignfilter import CrossAlignFilter
 from reademptionlib.cutadapt import Cutadapt
 from reademptionlib.helpers import Helpers
+from reademptionlib.indexcache import IndexCache
 from reademptionlib.paths import Paths
+from reademptionlib.projectcreator import ProjectCreator
 from reademptionlib.rawstatdata import RawStatDataWriter, RawStatDataReader
 from reademptionlib.readalignerstats import ReadAlignerStats
 from reademptionlib.readrealigner import ReadRealigner
@@ -14,6 +21,7 @@ from reademptionlib.readprocessor import ReadProcessor
 from reademptionlib.sambamconverter import SamToBamConverter
 from reademptionlib.segemehl import Segemehl
 from reademptionlib.star import STAR
+from reademptionlib.taskscheduler import TaskScheduler, split_threads
 
 
 class PerformAlignment(object):
@@ -24,6 +32,11 @@ class PerformAlignment(object):
         self._args = args
         self._paths = Paths(args)
         self._helpers = Helpers(args)
+        # The index is built and recorded in the project whose index
+        # folder it is written to. Subsample projects use the index of
+        # their project.
+        self._index_paths = self._paths
+        self._index_helpers = self._helpers
         self._read_files = None
         self._ref_seq_files = None
         self._align_viz = AlignViz()
@@ -33,56 +46,73 @@ class PerformAlignment(object):
         self._helpers.test_folder_existance(
             self._paths.required_read_alignment_folders())
         assert self._args.paired_end in [True, False]
+        if self._subsampling():
+            self._switch_to_subsample_project()
         self._ref_seq_files = self._paths.get_ref_seq_files()
         self._paths.set_ref_seq_paths(self._ref_seq_files)
+        self._index_paths.set_ref_seq_paths(self._ref_seq_files)
         self._test_align_file_existance()
+        self._set_read_paths()
+        self._skip_up_to_date_libs()
+        if not self._lib_names:
+            self._finish_alignment()
+            return
+        if self._args.per_lib_scheduling:
+            self._align_reads_per_lib()
+            return
         if not self._args.paired_end:
             # Single end reads
-            self._read_files = self._paths.get_read_files()
-            self._lib_names = self._paths.get_lib_names_single_end()
-            self._paths.set_read_files_dep_file_lists_single_end(
-                self._read_files, self._lib_names)
-            if not self._args.realign:
-                self._set_primary_aligner_paths_to_final_paths()
-            if not self._args.cutadapt:
+            if self._args.stream_processed_reads:
+                self._paths.processed_read_paths = (
+                    self._paths.processed_read_fifo_paths)
+            elif not self._args.cutadapt:
                 self._prepare_reads_single_end()
             else:
                 self._prepare_reads_se_cutadapt()
             if self._args.segemehl:
-                self._align_single_end_reads()
+                align_function = self._align_single_end_reads
+            else:
+                align_function = self._align_se_star
+            if self._args.stream_processed_reads:
+                self._align_streamed_reads(
+                    align_function, self._paths.processed_read_fifo_paths)
             else:
-                self._align_se_star()
+                align_function()
         else:
             # Paired end reads
-            self._read_file_pairs = self._paths.get_read_file_pairs()
-            self._lib_names = self._paths.get_lib_names_paired_end()
-            self._paths.set_read_files_dep_file_lists_paired_end(
-                self._read_file_pairs, self._lib_names)
-            if not self._args.realign:
-                self._set_primary_aligner_paths_to_final_paths()
-            if not self._args.cutadapt:
+            if self._args.stream_processed_reads:
+                self._paths.processed_read_path_pairs = (
+                    self._paths.processed_read_fifo_path_pairs)
+            elif not self._args.cutadapt:
                 self._prepare_reads_paired_end()
             else:
                 self._prepare_reads_pe_cutadapt()
             if self._args.segemehl:
-                self._align_paired_end_reads()
+                align_function = self._align_paired_end_reads
             else:
-                self._align_pe_star()
-        self._sam_to_bam(
-            self._paths.primary_read_aligner_sam_paths,
-            self._paths.primary_read_aligner_bam_prefix_paths,
-            self._paths.primary_read_aligner_bam_paths)
-        self._generate_read_alignment_stats(
-            self._lib_names,
-            self._paths.primary_read_aligner_bam_paths,
-            self._paths.unaligned_reads_paths,
-            self._paths.primary_read_aligner_stats_path)
+                align_function = self._align_pe_star
+            if self._args.stream_processed_reads:
+                self._align_streamed_reads(
+                    align_function, [
+                        fifo_path for fifo_path_pair in
+                        self._paths.processed_read_fifo_path_pairs
+                        for fifo_path in fifo_path_pair])
+            else:
+                align_function()
+        if not self._args.stream_alignments:
+            self._sam_to_bam(
+                self._paths.primary_read_aligner_sam_paths,
+                self._paths.primary_read_aligner_bam_prefix_paths)
         final_unaligned_reads_paths = self._paths.unaligned_reads_paths
         if self._args.realign:
-            self._run_realigner_and_process_alignments()
-            self._merge_bam_files()
+            self._realign_while_generating_primary_stats()
             final_unaligned_reads_paths = (
                 self._paths.realigned_unaligned_reads_paths)
+        else:
+            self._generate_primary_read_alignment_stats()
+        if self._args.realign:
+            # The primary alignments might be removed after merging
+            self._merge_bam_files()
         if self._args.crossalign_cleaning_str is not None:
             self._remove_crossaligned_reads()
         if not self._args.cutadapt:
@@ -91,18 +121,421 @@ class PerformAlignment(object):
                 self._paths.read_alignment_bam_paths,
                 final_unaligned_reads_paths,
                 self._paths.read_alignments_stats_path)
-            self._write_alignment_stat_table()
-            self._align_viz.alignment_viz(
-                self._paths.read_alignments_stats_path, "{}".format(
-                    self._paths.viz_align_base_folder))
-            self._align_viz.processing_viz(
-                self._paths.read_processing_stats_path, "{}".format(
-                    self._paths.viz_align_base_folder))
-            self._align_viz.alignment_processing_overview(
-                self._paths.read_processing_stats_path,
-                self._paths.read_alignments_stats_path, "{}".format(
-                    self._paths.viz_align_base_folder))
-                
+        self._finish_alignment()
+
+    def _set_read_paths(self, lib_indices=None):
+        """Set the paths of the files of all libraries or only of the
+        libraries with the given indices.
+        """
+        if not self._args.paired_end:
+            self._read_files = self._paths.get_read_files()
+            self._lib_names = self._paths.get_lib_names_single_end()
+            if lib_indices is not None:
+                self._read_files = [
+                    self._read_files[lib_index] for lib_index in lib_indices]
+                self._lib_names = [
+                    self._lib_names[lib_index] for lib_index in lib_indices]
+            self._paths.set_read_files_dep_file_lists_single_end(
+                self._read_files, self._lib_names,
+                compression_suffix=self._processed_reads_suffix())
+        else:
+            self._read_file_pairs = self._paths.get_read_file_pairs()
+            self._lib_names = self._paths.get_lib_names_paired_end()
+            if lib_indices is not None:
+                self._read_file_pairs = [
+                    self._read_file_pairs[lib_index]
+                    for lib_index in lib_indices]
+                self._lib_names = [
+                    self._lib_names[lib_index] for lib_index in lib_indices]
+            self._paths.set_read_files_dep_file_lists_paired_end(
+                self._read_file_pairs, self._lib_names,
+                compression_suffix=self._processed_reads_suffix())
+        if not self._args.realign:
+            self._set_primary_aligner_paths_to_final_paths()
+
+    def _skip_up_to_date_libs(self):
+        """Restrict the alignment to the libraries whose results of a
+        previous run cannot be kept.
+        """
+        self._all_lib_names = self._lib_names
+        self._lib_parameters = self._helpers.step_parameters()
+        lib_indices = [
+            lib_index for lib_index, lib_name in enumerate(self._lib_names)
+            if not self._helpers.step_is_up_to_date(
+                "align:%s" % lib_name, self._lib_input_paths(lib_index),
+                self._lib_parameters)]
+        if len(lib_indices) < len(self._lib_names):
+            self._set_read_paths(lib_indices)
+
+    def _lib_input_paths(self, lib_index):
+        if not self._args.paired_end:
+            read_paths = [self._paths.read_paths[lib_index]]
+        else:
+            read_paths = self._paths.read_path_pairs[lib_index]
+        return read_paths + self._paths.ref_seq_paths
+
+    def _lib_output_paths(self, lib_index):
+        if self._args.realign:
+            unaligned_reads_path = self._paths.realigned_unaligned_reads_paths[
+                lib_index]
+        else:
+            unaligned_reads_path = self._paths.unaligned_reads_paths[
+                lib_index]
+        output_paths = [self._paths.read_alignment_bam_paths[lib_index],
+                        unaligned_reads_path]
+        if self._args.crossalign_cleaning_str is not None:
+            output_paths.append(self._paths.crossmapped_reads_paths[lib_index])
+        # Not all aligners write unaligned reads
+        return [output_path for output_path in output_paths
+                if os.path.exists(output_path)]
+
+    def _finish_alignment(self):
+        """Record the libraries aligned in this run, add the statistics
+        of the kept libraries to the statistics files and write the
+        statistics table.
+        """
+        stats_paths = [self._paths.read_processing_stats_path,
+                       self._paths.read_alignments_stats_path]
+        if self._args.realign:
+            stats_paths += [self._paths.primary_read_aligner_stats_path,
+                            self._paths.read_realigner_stats_path]
+        stats_paths_and_stats = dict(
+            (stats_path, RawStatDataReader().read(stats_path))
+            for stats_path in stats_paths
+            if os.path.exists(stats_path))
+        # The statistics of each library by the name of the file
+        lib_names_and_results = {}
+        jobs = []
+        # The input and output files of the libraries are hashed in
+        # parallel
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._args.processes) as executor:
+            for lib_index, lib_name in enumerate(self._lib_names):
+                lib_names_and_results[lib_name] = dict(
+                    (os.path.basename(stats_path), stats[lib_name])
+                    for stats_path, stats in stats_paths_and_stats.items()
+                    if lib_name in stats)
+                jobs.append(executor.submit(
+                    self._helpers.record_step, "align:%s" % lib_name,
+                    self._lib_input_paths(lib_index), self._lib_parameters,
+                    self._lib_output_paths(lib_index),
+                    result=lib_names_and_results[lib_name]))
+        # Evaluate thread outcome
+        self._helpers.check_job_completeness(jobs)
+        if self._lib_names != self._all_lib_names:
+            for lib_name in self._all_lib_names:
+                if lib_name not in lib_names_and_results:
+                    lib_names_and_results[lib_name] = (
+                        self._helpers.step_result("align:%s" % lib_name))
+            for stats_path in stats_paths:
+                lib_names_and_stats = dict(
+                    (lib_name, lib_names_and_results[lib_name][
+                        os.path.basename(stats_path)])
+                    for lib_name in self._all_lib_names
+                    if os.path.basename(stats_path) in lib_names_and_results[
+                        lib_name])
+                if lib_names_and_stats:
+                    RawStatDataWriter(pretty=True).write(
+                        lib_names_and_stats, stats_path)
+            self._lib_names = self._all_lib_names
+        if not self._args.cutadapt:
+            self._write_alignment_stat_table_and_viz()
+
+    def _align_reads_per_lib(self):
+        """Run all steps of the alignment for each library independently.
+
+        Each step of a library (read processing, alignment, BAM
+        conversion, realignment, cross alignment removal and
+        statistics) is started as soon as the previous steps of this
+        library are finished and enough processes (and memory, if
+        limited by --max_memory) are available. So one slow library
+        does not hold up the others.
+        """
+        self._build_segemehl_index()
+        if self._args.crossalign_cleaning_str is not None:
+            self._string_to_species_and_sequence_ids()
+        max_memory = None
+        if self._args.max_memory is not None:
+            max_memory = int(self._args.max_memory * 1024**3)
+        task_scheduler = TaskScheduler(self._args.processes, max_memory)
+        for lib_index, lib_name in enumerate(self._lib_names):
+            self._add_lib_tasks(task_scheduler, lib_index, lib_name)
+        task_scheduler.run()
+        self._write_lib_task_stats(task_scheduler.results)
+        lib_names_and_runtimes = dict(
+            (lib_name, task_scheduler.runtimes["align:%s" % lib_name])
+            for lib_name in self._lib_names
+            if "align:%s" % lib_name in task_scheduler.runtimes)
+        if lib_names_and_runtimes:
+            self._write_alignment_runtimes(lib_names_and_runtimes)
+        self._finish_alignment()
+
+    def _add_lib_tasks(self, task_scheduler, lib_index, lib_name):
+        """Add the tasks of a library with their dependencies.
+
+        The tasks are named after the step and the library.
+        """
+        paths = self._paths
+        dependencies = []
+
+        def add_task(step, function, args, cpus=1, memory=0):
+            task_name = "%s:%s" % (step, lib_name)
+            task_scheduler.add_task(task_name, function, args,
+                                    dependencies=list(dependencies),
+                                    cpus=cpus, memory=memory)
+            return [task_name]
+
+        dependencies = add_task(
+            "process", self._process_reads_of_lib, (lib_index,),
+            cpus=self._processes_per_lib())
+        sam_path = paths.primary_read_aligner_sam_paths[lib_index]
+        bam_path = paths.primary_read_aligner_bam_paths[lib_index]
+        # The aligner is assumed to need as much memory as its index
+        threads = self._alignment_threads()[lib_index]
+        dependencies = add_task(
+            "align", self._segemehl_align_function(),
+            (lib_index, threads), cpus=threads,
+            memory=os.path.getsize(paths.index_path))
+        if not self._args.stream_alignments:
+            dependencies = add_task(
+                "sam_to_bam", self._sam_to_bam_converter(
+                    self._processes_per_lib()).sam_to_bam,
+                (sam_path, paths.primary_read_aligner_bam_prefix_paths[
+                    lib_index]), cpus=self._processes_per_lib())
+        unaligned_reads_path = paths.unaligned_reads_paths[lib_index]
+        if self._args.realign:
+            primary_stats_task = add_task(
+                "primary_stats", self._read_aligner_stats().count,
+                (bam_path, unaligned_reads_path),
+                cpus=self._processes_per_lib())
+            dependencies = add_task(
+                "realign", self._realign_reads_of_lib, (lib_index,),
+                cpus=self._args.processes)
+            unaligned_reads_path = paths.realigned_unaligned_reads_paths[
+                lib_index]
+            realigner_stats_task = add_task(
+                "realigner_stats", self._read_aligner_stats().count,
+                (paths.read_realigner_bam_paths[lib_index],
+                 unaligned_reads_path), cpus=self._processes_per_lib())
+            # The merge might remove the BAM files that are counted by
+            # the statistics tasks
+            dependencies = (
+                primary_stats_task + dependencies + realigner_stats_task)
+            dependencies = add_task(
+                "merge", self._merge_bam_files_of_lib, (lib_index,))
+        if self._args.crossalign_cleaning_str is not None:
+            dependencies = add_task(
+                "crossalign_cleaning", self._remove_crossaligned_reads_for_lib,
+                (paths.read_alignment_bam_paths[lib_index],
+                 paths.read_alignment_bam_with_crossmappings_paths[lib_index],
+                 paths.read_alignment_bam_cross_cleaned_tmp_paths[lib_index],
+                 paths.crossmapped_reads_paths[lib_index]),
+                cpus=self._processes_per_lib())
+        add_task("stats", self._read_aligner_stats().count,
+                 (paths.read_alignment_bam_paths[lib_index],
+                  unaligned_reads_path), cpus=self._processes_per_lib())
+
+    def _read_aligner_stats(self):
+        """Return a counter of the alignment statistics of a library
+        that uses the processes of the library or estimates the
+        statistics from a sample of the alignments.
+        """
+        sample_size = None
+        if self._args.quick_stats:
+            sample_size = self._args.quick_stats_sample_size
+        return ReadAlignerStats(
+            collapsed_reads=self._args.collapse_reads,
+            processes=self._processes_per_lib(), sample_size=sample_size)
+
+    def _process_reads_of_lib(self, lib_index):
+        read_processor = self._read_processor()
+        if not self._args.paired_end:
+            return read_processor.process_single_end(
+                self._paths.read_paths[lib_index],
+                self._paths.processed_read_paths[lib_index])
+        return read_processor.process_paired_end(
+            self._paths.read_path_pairs[lib_index],
+            self._paths.processed_read_path_pairs[lib_index])
+
+    def _align_reads_of_lib(self, lib_index, threads):
+        if not self._args.paired_end:
+            read_file_or_pair = self._paths.processed_read_paths[lib_index]
+        else:
+            read_file_or_pair = self._paths.processed_read_path_pairs[
+                lib_index]
+        read_aligner = Segemehl(self._args.segemehl_bin, self._args.progress)
+        read_aligner.run_alignment(
+            read_file_or_pair, self._paths.index_path,
+            self._paths.ref_seq_paths,
+            self._paths.primary_read_aligner_sam_paths[lib_index],
+            self._paths.unaligned_reads_paths[lib_index],
+            threads=int(threads),
+            hit_strategy=int(self._args.hit_strategy),
+            accuracy=int(self._args.segemehl_accuracy),
+            evalue=float(self._args.segemehl_evalue),
+            split=self._args.split, paired_end=self._args.paired_end)
+
+    def _segemehl_align_function(self):
+        if self._args.stream_alignments:
+            return self._align_reads_of_lib_to_bam
+        return self._align_reads_of_lib
+
+    def _align_reads_of_lib_to_bam(self, lib_index, threads):
+        """Align the reads of a library and sort the alignments into
+        the BAM file while the aligner is running.
+
+        The aligner writes its SAM output into a FIFO, so only the
+        sorted BAM file and its index are stored.
+        """
+        sam_path = self._paths.primary_read_aligner_sam_paths[lib_index]
+        if os.path.exists(sam_path):
+            os.remove(sam_path)
+        os.mkfifo(sam_path)
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=1) as executor:
+                # Most of the sorting and compression happens after the
+                # aligner has finished, so the sorter gets its threads
+                job = executor.submit(
+                    self._sam_to_bam_converter(threads).sort_sam_to_bam,
+                    sam_path,
+                    self._paths.primary_read_aligner_bam_prefix_paths[
+                        lib_index])
+                try:
+                    self._align_reads_of_lib(lib_index, threads)
+                finally:
+                    self._wait_for_fifo_reader(job, sam_path)
+                job.result()
+        finally:
+            os.remove(sam_path)
+
+    def _align_reads_of_lib_star(self, lib_index, threads):
+        if not self._args.paired_end:
+            read_file_or_pair = self._paths.processed_read_paths[lib_index]
+            output_path = self._paths.primary_read_aligner_sam_paths[
+                lib_index]
+        else:
+            read_file_or_pair = self._paths.processed_read_path_pairs[
+                lib_index]
+            output_path = (self._paths.read_alignments_folder + '/' +
+                           " ".join(self._paths.get_lib_names_paired_end()) +
+                           '_')
+        STAR(self._args.STAR_bin).align_reads(
+            int(threads),
+            self._paths.read_alignment_index_folder,
+            read_file_or_pair, output_path,
+            (self._paths.annotation_folder + '/' +
+             " ".join(self._paths.get_annotation_files())),
+            paired_end=self._args.paired_end, include_annotation=False,
+            genome_load=(
+                "LoadAndKeep" if self._args.star_shared_genome else None))
+
+    def _realign_reads_of_lib(self, lib_index):
+        sam_to_bam_converter = self._sam_to_bam_converter(
+            self._args.processes)
+        if not self._args.stream_realigner_input:
+            # As the realigner needs a *sorted* SAM file
+            sam_to_bam_converter.bam_to_sam(
+                self._paths.primary_read_aligner_bam_paths[lib_index],
+                self._paths.read_realigner_tmp_sam_paths[lib_index])
+        self._run_realigner_of_lib(lib_index)
+        sam_to_bam_converter.sam_to_bam(
+            self._paths.read_realigner_sam_paths[lib_index],
+            self._paths.read_realigner_bam_prefixes_paths[lib_index])
+
+    def _run_realigner_of_lib(self, lib_index):
+        """Realign the unaligned reads of a library.
+
+        The sorted SAM file of the primary alignments has to exist
+        unless it is streamed from the BAM file.
+        """
+        query_sam_path = self._paths.read_realigner_tmp_sam_paths[lib_index]
+        read_realigner = ReadRealigner(
+            self._args.lack_bin, self._args.progress)
+        with self._primary_alignments_stream(lib_index):
+            read_realigner.run_alignment(
+                self._paths.unaligned_reads_paths[lib_index], query_sam_path,
+                self._paths.ref_seq_paths,
+                self._paths.read_realigner_sam_paths[lib_index],
+                self._paths.realigned_unaligned_reads_paths[lib_index],
+                int(self._args.processes), int(self._args.segemehl_accuracy))
+        if not self._args.stream_realigner_input:
+            os.remove(query_sam_path)
+
+    @contextlib.contextmanager
+    def _primary_alignments_stream(self, lib_index):
+        """Write the sorted primary alignments of a library as SAM into
+        a FIFO while the realigner reads them.
+
+        Without --stream_realigner_input nothing is done.
+        """
+        if not self._args.stream_realigner_input:
+            yield
+            return
+        fifo_path = self._paths.read_realigner_tmp_sam_paths[lib_index]
+        if os.path.exists(fifo_path):
+            os.remove(fifo_path)
+        os.mkfifo(fifo_path)
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=1) as executor:
+                job = executor.submit(
+                    self._sam_to_bam_converter(1).bam_to_sam,
+                    self._paths.primary_read_aligner_bam_paths[lib_index],
+                    fifo_path)
+                try:
+                    yield
+                finally:
+                    self._wait_for_fifo_writer(job, [fifo_path])
+                job.result()
+        finally:
+            os.remove(fifo_path)
+
+    def _merge_bam_files_of_lib(self, lib_index):
+        primary_aligner_bam = self._paths.primary_read_aligner_bam_paths[
+            lib_index]
+        realigner_bam = self._paths.read_realigner_bam_paths[lib_index]
+        self._remove_outdated_bam_file(
+            self._paths.read_alignment_bam_paths[lib_index])
+        BamMerger().merge(self._paths.read_alignment_bam_paths[lib_index],
+                          primary_aligner_bam, realigner_bam)
+        if not self._args.keep_original_alignments:
+            for bam_file in [primary_aligner_bam, realigner_bam]:
+                os.remove(bam_file)
+                os.remove("%s.bai" % bam_file)
+
+    def _write_lib_task_stats(self, task_results):
+        """Write the statistics returned by the tasks of all libraries
+        in the same files as the stagewise alignment.
+        """
+        raw_stat_data_writer = RawStatDataWriter(pretty=True)
+        stat_steps_and_paths = [
+            ("process", self._paths.read_processing_stats_path),
+            ("stats", self._paths.read_alignments_stats_path)]
+        if self._args.realign:
+            stat_steps_and_paths += [
+                ("primary_stats", self._paths.primary_read_aligner_stats_path),
+                ("realigner_stats", self._paths.read_realigner_stats_path)]
+        for step, output_stats_path in stat_steps_and_paths:
+            read_files_and_stats = dict(
+                (lib_name, task_results["%s:%s" % (step, lib_name)])
+                for lib_name in self._lib_names
+                if "%s:%s" % (step, lib_name) in task_results)
+            raw_stat_data_writer.write(read_files_and_stats, output_stats_path)
+
+    def _write_alignment_stat_table_and_viz(self):
+        self._write_alignment_stat_table()
+        self._align_viz.alignment_viz(
+            self._paths.read_alignments_stats_path, "{}".format(
+                self._paths.viz_align_base_folder))
+        self._align_viz.processing_viz(
+            self._paths.read_processing_stats_path, "{}".format(
+                self._paths.viz_align_base_folder))
+        self._align_viz.alignment_processing_overview(
+            self._paths.read_processing_stats_path,
+            self._paths.read_alignments_stats_path, "{}".format(
+                self._paths.viz_align_base_folder))
+
     def _test_align_file_existance(self):
         """Test if the input file for the the align subcommand exist."""
         if len(self._paths.get_read_files()) == 0:
@@ -111,6 +544,110 @@ class PerformAlignment(object):
         if len(self._ref_seq_files) == 0:
             self._helpers.write_err_msg_and_quit(
                 "Error! No reference sequence files given!\n")
+        if (self._args.segemehl and
+                self._args.processed_reads_compression == "zstd" and
+                not self._args.stream_processed_reads):
+            self._helpers.write_err_msg_and_quit(
+                "Error! segemehl cannot read zstd compressed reads!\n")
+        if self._args.stream_processed_reads and self._args.cutadapt:
+            self._helpers.write_err_msg_and_quit(
+                "Error! Reads processed by cutadapt cannot be streamed "
+                "to the aligner!\n")
+        if self._args.per_lib_scheduling and (
+                not self._args.segemehl or self._args.cutadapt or
+                self._args.stream_processed_reads):
+            self._helpers.write_err_msg_and_quit(
+                "Error! The per library scheduling can only be used with "
+                "segemehl and without --cutadapt and "
+                "--stream_processed_reads!\n")
+        if self._args.stream_alignments and not self._args.segemehl:
+            self._helpers.write_err_msg_and_quit(
+                "Error! Streaming of alignments is only available for "
+                "segemehl!\n")
+        if self._args.stream_realigner_input and not self._args.realign:
+            self._helpers.write_err_msg_and_quit(
+                "Error! The realigner input can only be streamed if "
+                "--realign is used!\n")
+        if self._args.star_shared_genome and self._args.segemehl:
+            self._helpers.write_err_msg_and_quit(
+                "Error! The shared memory genome is only available for "
+                "STAR!\n")
+        if self._args.concurrent_alignments < 1:
+            self._helpers.write_err_msg_and_quit(
+                "Error! The number of concurrent alignments must be at "
+                "least 1!\n")
+        if self._args.concurrent_alignments > 1 and (
+                self._args.stream_processed_reads or (
+                    not self._args.segemehl and self._args.paired_end)):
+            self._helpers.write_err_msg_and_quit(
+                "Error! Concurrent alignments cannot be used with "
+                "--stream_processed_reads or for paired-end reads aligned "
+                "with STAR!\n")
+        if self._subsampling() and self._args.cutadapt:
+            self._helpers.write_err_msg_and_quit(
+                "Error! Reads processed by cutadapt cannot be subsampled!\n")
+        if self._args.collapse_reads and (
+                self._args.paired_end or self._args.cutadapt):
+            self._helpers.write_err_msg_and_quit(
+                "Error! Reads can only be collapsed for single-end reads "
+                "that are not processed by cutadapt!\n")
+
+    def _subsampling(self):
+        return (self._args.subsample is not None or
+                self._args.subsample_fraction is not None)
+
+    def _subsample_project_name(self):
+        if self._args.subsample_fraction is not None:
+            return "fraction_%s_seed_%s" % (
+                self._args.subsample_fraction, self._args.subsample_seed)
+        if self._args.subsample_mode == "first":
+            return "first_%s" % self._args.subsample
+        return "reservoir_%s_seed_%s" % (
+            self._args.subsample, self._args.subsample_seed)
+
+    def _switch_to_subsample_project(self):
+        """Perform the alignment of subsampled reads in a separate project.
+
+        The subsample project is located in the folder 'subsamples' of
+        the project. Its input folder is a link to the input folder of
+        the project, so that the other subcommands can be run on it
+        unchanged. Its index folder is a link to the index folder of the
+        project, so the index of the project is reused if it is
+        recorded as up to date and else built for both.
+        """
+        subsample_args = copy.copy(self._args)
+        subsample_args.project_path = "%s/%s" % (
+            self._paths.subsamples_folder, self._subsample_project_name())
+        subsample_paths = Paths(subsample_args)
+        project_creator = ProjectCreator()
+        project_creator.create_subfolders([
+            self._paths.subsamples_folder, subsample_args.project_path])
+        if not os.path.exists(subsample_paths.input_folder):
+            os.symlink(os.path.abspath(self._paths.input_folder),
+                       subsample_paths.input_folder)
+        if not os.path.lexists(subsample_paths.read_alignment_index_folder):
+            os.makedirs(os.path.dirname(
+                subsample_paths.read_alignment_index_folder), exist_ok=True)
+            os.symlink(
+                os.path.abspath(self._paths.read_alignment_index_folder),
+                subsample_paths.read_alignment_index_folder)
+        project_creator.create_subfolders(subsample_paths.required_folders())
+        # Subsample projects created before the index folder was linked
+        # keep their own index
+        if os.path.islink(subsample_paths.read_alignment_index_folder):
+            # A recorded index of the project is kept even without -f
+            # as the subsample is only a preview of the project
+            index_args = copy.copy(self._args)
+            index_args.check_for_existing_files = True
+            self._index_helpers = Helpers(index_args)
+        else:
+            self._index_paths = subsample_paths
+            self._index_helpers = Helpers(subsample_args)
+        sys.stderr.write("Aligning subsampled reads in project \"%s\".\n" % (
+            subsample_args.project_path))
+        self._args = subsample_args
+        self._paths = subsample_paths
+        self._helpers = Helpers(subsample_args)
 
     def _set_primary_aligner_paths_to_final_paths(self):
         # If no remapping is performed the paths of the final bam files
@@ -130,20 +667,143 @@ class PerformAlignment(object):
             for lib_name, read_path, processed_read_path in zip(
                     self._lib_names, self._paths.read_paths,
                     self._paths.processed_read_paths):
-                if not self._helpers.file_needs_to_be_created(
-                        processed_read_path):
-                    continue
-                read_processor = ReadProcessor(
-                    poly_a_clipping=self._args.poly_a_clipping,
-                    min_read_length=self._args.min_read_length,
-                    min_phred_score=self._args.min_phred_score,
-                    adapter=self._args.adapter,
-                    reverse_complement=self._args.reverse_complement)
+                read_processor = self._read_processor()
                 read_files_and_jobs[lib_name] = executor.submit(
                     read_processor.process_single_end, read_path,
                     processed_read_path)
         self._evaluet_job_and_generate_stat_file(read_files_and_jobs)
 
+    def _read_processor(self):
+        if not self._args.paired_end:
+            return ReadProcessor(
+                poly_a_clipping=self._args.poly_a_clipping,
+                min_read_length=self._args.min_read_length,
+                min_phred_score=self._args.min_phred_score,
+                adapter=self._args.adapter,
+                adapter_max_error_rate=self._args.adapter_max_error_rate,
+                adapter_min_overlap=self._args.adapter_min_overlap,
+                reverse_complement=self._args.reverse_complement,
+                processes=self._processes_per_lib(),
+                output_codec=self._output_codec(),
+                collapse_reads=self._args.collapse_reads,
+                **self._subsample_kwargs())
+        return ReadProcessor(
+            poly_a_clipping=False,
+            min_read_length=self._args.min_read_length,
+            min_phred_score=self._args.min_phred_score,
+            adapter=self._args.adapter,
+            adapter_max_error_rate=self._args.adapter_max_error_rate,
+            adapter_min_overlap=self._args.adapter_min_overlap,
+            processes=self._processes_per_lib(),
+            output_codec=self._output_codec(),
+            **self._subsample_kwargs())
+
+    def _subsample_kwargs(self):
+        return {"subsample_size": self._args.subsample,
+                "subsample_fraction": self._args.subsample_fraction,
+                "subsample_mode": self._args.subsample_mode,
+                "subsample_seed": self._args.subsample_seed}
+
+    def _output_codec(self):
+        return OutputCodec(
+            self._args.processed_reads_compression,
+            level=self._args.processed_reads_compression_level,
+            threads=self._processes_per_lib())
+
+    def _processed_reads_suffix(self):
+        return OutputCodec.suffixes[self._args.processed_reads_compression]
+
+    def _align_streamed_reads(self, align_function, fifo_paths):
+        """Run the alignment while the reads are processed.
+
+        Instead of storing the processed reads they are written to
+        FIFOs that are directly read by the aligner.
+        """
+        for fifo_path in fifo_paths:
+            if os.path.exists(fifo_path):
+                os.remove(fifo_path)
+            os.mkfifo(fifo_path)
+        self._streamed_read_files_and_jobs = {}
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=1) as self._stream_executor:
+                align_function()
+        finally:
+            for fifo_path in fifo_paths:
+                os.remove(fifo_path)
+        self._evaluet_job_and_generate_stat_file(
+            self._streamed_read_files_and_jobs)
+
+    @contextlib.contextmanager
+    def _processed_reads_stream(self, lib_name):
+        """Process the reads of a library while the aligner reads them.
+
+        Without streaming nothing is done.
+        """
+        if not self._args.stream_processed_reads:
+            yield
+            return
+        lib_index = self._lib_names.index(lib_name)
+        read_processor = self._read_processor()
+        if not self._args.paired_end:
+            fifo_paths = [self._paths.processed_read_fifo_paths[lib_index]]
+            job = self._stream_executor.submit(
+                read_processor.process_single_end,
+                self._paths.read_paths[lib_index], fifo_paths[0])
+        else:
+            fifo_paths = self._paths.processed_read_fifo_path_pairs[lib_index]
+            job = self._stream_executor.submit(
+                read_processor.process_paired_end,
+                self._paths.read_path_pairs[lib_index], fifo_paths)
+        self._streamed_read_files_and_jobs[lib_name] = job
+        try:
+            yield
+        finally:
+            self._wait_for_fifo_writer(job, fifo_paths)
+
+    def _wait_for_fifo_writer(self, job, fifo_paths):
+        """Wait until the read processing job is finished.
+
+        If the aligner stopped before reading all reads from the FIFOs
+        the writer would block forever. Opening and closing the FIFOs
+        for reading makes it fail instead.
+        """
+        while True:
+            try:
+                job.exception(timeout=1)
+                return
+            except concurrent.futures.TimeoutError:
+                for fifo_path in fifo_paths:
+                    fifo_fd = os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+                    os.close(fifo_fd)
+
+    def _wait_for_fifo_reader(self, job, fifo_path):
+        """Wait until the job reading from the FIFO is finished.
+
+        If the aligner stopped without opening the FIFO the reader
+        would block forever. Opening and closing the FIFO for writing
+        makes it read the end of the file instead.
+        """
+        while True:
+            try:
+                job.exception(timeout=1)
+                return
+            except concurrent.futures.TimeoutError:
+                try:
+                    fifo_fd = os.open(
+                        fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+                except OSError:
+                    # The reader has not opened the FIFO yet
+                    continue
+                os.close(fifo_fd)
+
+    def _processes_per_lib(self):
+        """Split the processes between the libraries that are processed
+        in parallel so that large libraries are processed in chunks by
+        several processes.
+        """
+        return max(1, self._args.processes // len(self._lib_names))
+
     def _prepare_reads_se_cutadapt(self):
         cutadapt = Cutadapt(self._args.cutadapt_bin)
         read_files_and_jobs = {}
@@ -152,11 +812,9 @@ class PerformAlignment(object):
             for lib_name, read_path, processed_read_path in zip(
                     self._lib_names, self._paths.read_paths,
                     self._paths.processed_read_paths):
-                if not self._helpers.file_needs_to_be_created(
-                        processed_read_path):
-                    continue
                 cutadapt = Cutadapt(
-                    self._args.cutadapt_options, self._args.cutadapt_bin)
+                    self._args.cutadapt_options, self._args.cutadapt_bin,
+                    self._processed_reads_suffix())
                 read_files_and_jobs[lib_name] = executor.submit(
                     cutadapt.run_cutadapt_se, read_path,
                     self._paths.processed_reads_folder, lib_name)
@@ -167,9 +825,6 @@ class PerformAlignment(object):
         raw_stat_data_writer = RawStatDataWriter(pretty=True)
         # Evaluate thread outcome
         self._helpers.check_job_completeness(read_files_and_jobs.values())
-        if not self._helpers.file_needs_to_be_created(
-                self._paths.read_processing_stats_path):
-            return
         # Create a dict of the read file names and the processing
         # counting results
         read_files_and_stats = dict(
@@ -179,57 +834,143 @@ class PerformAlignment(object):
             read_files_and_stats, self._paths.read_processing_stats_path)
 
     def _align_se_star(self):
-        read_aligner = STAR(
-            self._args.STAR_bin)
-        if self._helpers.file_needs_to_be_created(self._paths.index_path_star):
-            read_aligner.build_index(
-                int(self._args.processes),
-                self._paths.read_alignment_index_folder,
-                " ".join([self._paths.ref_seq_folder + '/' + ref for
-                          ref in self._paths.get_ref_seq_files()]),
-                int(self._args.indexN))
-        for read_path, output_path, nomatch_path, bam_path in zip(
-                self._paths.processed_read_paths,
-                self._paths.primary_read_aligner_sam_paths,
-                self._paths.unaligned_reads_paths,
-                self._paths.primary_read_aligner_bam_paths):
-            if not self._helpers.file_needs_to_be_created(output_path):
-                continue
-            elif not self._helpers.file_needs_to_be_created(bam_path):
-                continue
-            read_aligner.align_reads(
-                int(self._args.processes),
-                self._paths.read_alignment_index_folder,
-                read_path,
-                output_path,
-                (self._paths.annotation_folder + '/' +
-                 " ".join(self._paths.get_annotation_files())),
-                paired_end=False, include_annotation=False)
+        self._build_star_index()
+        with self._star_genome():
+            self._run_alignments(self._align_reads_of_lib_star)
         self._paths.relocate_and_rename_star_output_se()
 
     def _align_single_end_reads(self):
         """Manage the actual alignment of single end reads."""
+        self._build_segemehl_index()
+        self._run_alignments(self._segemehl_align_function())
+
+    def _build_segemehl_index(self):
         read_aligner = Segemehl(
             self._args.segemehl_bin, self._args.progress)
-        if self._helpers.file_needs_to_be_created(self._paths.index_path):
+        if self._args.index_cache is not None:
+            self._link_cached_index(
+                "segemehl", [], lambda index_folder: read_aligner.build_index(
+                    self._index_paths.ref_seq_paths, "%s/%s" % (
+                        index_folder, os.path.basename(
+                            self._index_paths.index_path))))
+        elif not self._index_helpers.step_is_up_to_date(
+                "index", self._index_paths.ref_seq_paths,
+                {"aligner": "segemehl"}):
             read_aligner.build_index(
-                self._paths.ref_seq_paths, self._paths.index_path)
-        for read_path, output_path, nomatch_path, bam_path in zip(
-            self._paths.processed_read_paths,
-            self._paths.primary_read_aligner_sam_paths,
-            self._paths.unaligned_reads_paths,
-                self._paths.read_alignment_bam_paths):
-            if not self._helpers.file_needs_to_be_created(output_path):
-                continue
-            elif not self._helpers.file_needs_to_be_created(bam_path):
-                continue
-            read_aligner.run_alignment(
-                read_path, self._paths.index_path, self._paths.ref_seq_paths,
-                output_path, nomatch_path, int(self._args.processes),
-                int(self._args.hit_strategy),
-                int(self._args.segemehl_accuracy),
-                float(self._args.segemehl_evalue), self._args.split,
-                paired_end=False)
+                self._index_paths.ref_seq_paths, self._index_paths.index_path)
+            self._index_helpers.record_step(
+                "index", self._index_paths.ref_seq_paths,
+                {"aligner": "segemehl"}, [self._index_paths.index_path])
+
+    def _build_star_index(self):
+        read_aligner = STAR(
+            self._args.STAR_bin)
+
+        def build_index(index_folder):
+            read_aligner.build_index(
+                int(self._args.processes), index_folder,
+                " ".join([self._index_paths.ref_seq_folder + '/' + ref for
+                          ref in self._index_paths.get_ref_seq_files()]),
+                int(self._args.indexN))
+
+        if self._args.index_cache is not None:
+            self._link_cached_index(
+                "STAR", [int(self._args.indexN)], build_index)
+        elif not self._index_helpers.step_is_up_to_date(
+                "index", self._index_paths.ref_seq_paths,
+                {"aligner": "STAR", "indexN": int(self._args.indexN)}):
+            build_index(self._index_paths.read_alignment_index_folder)
+            self._index_helpers.record_step(
+                "index", self._index_paths.ref_seq_paths,
+                {"aligner": "STAR", "indexN": int(self._args.indexN)}, [
+                    "%s/%s" % (self._index_paths.read_alignment_index_folder,
+                               index_file) for index_file in sorted(
+                        os.listdir(
+                            self._index_paths.read_alignment_index_folder))])
+
+    def _star_genome(self):
+        """Return a context in which the STAR genome is kept in shared
+        memory if requested.
+        """
+        if not self._args.star_shared_genome:
+            return contextlib.nullcontext()
+        return STAR(self._args.STAR_bin).shared_genome(
+            self._paths.read_alignment_index_folder,
+            "%s/STAR_shared_genome_" % self._paths.align_report_folder)
+
+    def _link_cached_index(self, aligner, parameters, build_function):
+        """Link the files of the index in the cache folder into the
+        index folder of the project.
+
+        The index is only built if it is not in the cache yet.
+        """
+        cached_index_folder = IndexCache(self._args.index_cache).index_folder(
+            aligner, self._index_paths.ref_seq_paths, parameters,
+            build_function)
+        for index_file in os.listdir(cached_index_folder):
+            index_path = "%s/%s" % (
+                self._index_paths.read_alignment_index_folder, index_file)
+            if os.path.lexists(index_path):
+                os.remove(index_path)
+            os.symlink(os.path.abspath("%s/%s" % (
+                cached_index_folder, index_file)), index_path)
+
+    def _run_alignments(self, align_function):
+        """Align the reads of all libraries.
+
+        By default the libraries are aligned one after the other with
+        all processes. With --concurrent_alignments several aligners
+        run at the same time and the processes are split between them
+        according to the library sizes. The runtime of each alignment
+        is written to a JSON file.
+        """
+        alignment_threads = self._alignment_threads()
+        lib_names_and_runtimes = {}
+        if self._args.concurrent_alignments == 1:
+            for lib_index, lib_name in enumerate(self._lib_names):
+                start_time = time.time()
+                with self._processed_reads_stream(lib_name):
+                    align_function(lib_index, alignment_threads[lib_index])
+                lib_names_and_runtimes[lib_name] = time.time() - start_time
+        else:
+            task_scheduler = TaskScheduler(self._args.processes)
+            # Starting the largest libraries first keeps the slowest
+            # alignment from running alone at the end
+            for lib_index in sorted(
+                    range(len(self._lib_names)), key=lambda lib_index: (
+                        -alignment_threads[lib_index], lib_index)):
+                task_scheduler.add_task(
+                    self._lib_names[lib_index], align_function,
+                    (lib_index, alignment_threads[lib_index]),
+                    cpus=alignment_threads[lib_index])
+            task_scheduler.run()
+            lib_names_and_runtimes = task_scheduler.runtimes
+        self._write_alignment_runtimes(lib_names_and_runtimes)
+
+    def _alignment_threads(self):
+        """Return the number of threads of the aligner for each
+        library.
+        """
+        if self._args.concurrent_alignments == 1:
+            return [self._args.processes] * len(self._lib_names)
+        return split_threads(
+            self._lib_sizes(), self._args.processes,
+            self._args.concurrent_alignments)
+
+    def _lib_sizes(self):
+        """Return the size of the input read files of each library."""
+        if not self._args.paired_end:
+            return [os.path.getsize(read_path)
+                    for read_path in self._paths.read_paths]
+        return [sum(os.path.getsize(read_path) for read_path in read_path_pair)
+                for read_path_pair in self._paths.read_path_pairs]
+
+    def _write_alignment_runtimes(self, lib_names_and_runtimes):
+        """Write the runtime of the alignment of each library in
+        seconds.
+        """
+        RawStatDataWriter(pretty=True).write(
+            lib_names_and_runtimes, self._paths.alignment_runtimes_path)
 
     def _prepare_reads_paired_end(self):
         read_files_and_jobs = {}
@@ -238,18 +979,10 @@ class PerformAlignment(object):
             for lib_name, read_path_pair, processed_read_path_pair in zip(
                 self._lib_names, self._paths.read_path_pairs,
                     self._paths.processed_read_path_pairs):
-                for processed_read_path in processed_read_path_pair:
-                    if not self._helpers.file_needs_to_be_created(
-                            processed_read_path):
-                        continue
-                    read_processor = ReadProcessor(
-                        poly_a_clipping=False,
-                        min_read_length=self._args.min_read_length,
-                        min_phred_score=self._args.min_phred_score,
-                        adapter=self._args.adapter)
-                    read_files_and_jobs[lib_name] = executor.submit(
-                        read_processor.process_paired_end, read_path_pair,
-                        processed_read_path_pair)
+                read_processor = self._read_processor()
+                read_files_and_jobs[lib_name] = executor.submit(
+                    read_processor.process_paired_end, read_path_pair,
+                    processed_read_path_pair)
         self._evaluet_job_and_generate_stat_file(read_files_and_jobs)
 
     def _prepare_reads_pe_cutadapt(self):
@@ -260,82 +993,47 @@ class PerformAlignment(object):
             for lib_name, read_path_pair, processed_read_path_pair in zip(
                     self._lib_names, self._paths.read_path_pairs,
                     self._paths.processed_read_path_pairs):
-                if not self._helpers.file_needs_to_be_created(
-                        processed_read_path_pair):
-                    continue
                 cutadapt = Cutadapt(
-                    self._args.cutadapt_options, self._args.cutadapt_bin)
+                    self._args.cutadapt_options, self._args.cutadapt_bin,
+                    self._processed_reads_suffix())
                 read_files_and_jobs[lib_name] = executor.submit(
                     cutadapt.run_cutadapt_pe, read_path_pair,
                     self._paths.processed_reads_folder, lib_name)
         self._helpers.check_job_completeness(read_files_and_jobs.values())
 
     def _align_pe_star(self):
-        read_aligner = STAR(
-            self._args.STAR_bin)
-        if self._helpers.file_needs_to_be_created(self._paths.index_path_star):
-            read_aligner.build_index(
-                int(self._args.processes),
-                self._paths.read_alignment_index_folder,
-                " ".join([self._paths.ref_seq_folder + '/' + ref for
-                          ref in self._paths.get_ref_seq_files()]),
-                int(self._args.indexN))
-        for read_path_pair, output_path, nomatch_path, bam_path in zip(
-            self._paths.processed_read_path_pairs,
-            self._paths.primary_read_aligner_sam_paths,
-            self._paths.unaligned_reads_paths,
-                self._paths.primary_read_aligner_bam_paths):
-            if not self._helpers.file_needs_to_be_created(output_path):
-                continue
-            elif not self._helpers.file_needs_to_be_created(bam_path):
-                continue
-            read_aligner.align_reads(
-                int(self._args.processes),
-                self._paths.read_alignment_index_folder,
-                read_path_pair,
-                (self._paths.read_alignments_folder + '/' +
-                 " ".join(self._paths.get_lib_names_paired_end()) + '_'),
-                (self._paths.annotation_folder + '/' +
-                 " ".join(self._paths.get_annotation_files())),
-                paired_end=True, include_annotation=False)
+        self._build_star_index()
+        with self._star_genome():
+            self._run_alignments(self._align_reads_of_lib_star)
         self._paths.relocate_and_rename_star_output_pe()
         self._paths.relocate_and_rename_star_output()
 
     def _align_paired_end_reads(self):
         """Manage the actual alignemnt of paired end reads."""
-        read_aligner = Segemehl(
-            self._args.segemehl_bin, self._args.progress)
-        if self._helpers.file_needs_to_be_created(self._paths.index_path):
-            read_aligner.build_index(
-                self._paths.ref_seq_paths, self._paths.index_path)
-        for read_path_pair, output_path, nomatch_path, bam_path in zip(
-            self._paths.processed_read_path_pairs,
-            self._paths.primary_read_aligner_sam_paths,
-            self._paths.unaligned_reads_paths,
-                self._paths.primary_read_aligner_bam_paths):
-            if not self._helpers.file_needs_to_be_created(output_path):
-                continue
-            elif not self._helpers.file_needs_to_be_created(bam_path):
-                continue
-            read_aligner.run_alignment(
-                read_path_pair, self._paths.index_path,
-                self._paths.ref_seq_paths, output_path,
-                int(self._args.processes), nomatch_path,
-                int(self._args.hit_strategy),
-                int(self._args.segemehl_accuracy),
-                float(self._args.segemehl_evalue),
-                self._args.split, paired_end=True)
-
-    def _sam_to_bam(self, sam_paths, bam_prefixes_paths, bam_paths):
+        self._build_segemehl_index()
+        self._run_alignments(self._segemehl_align_function())
+
+    def _sam_to_bam_converter(self, threads):
+        """Return a converter using the given number of threads.
+
+        If the memory is limited by --max_memory it is split evenly
+        between all processes.
+        """
+        memory_per_thread = None
+        if self._args.max_memory is not None:
+            memory_per_thread = int(
+                self._args.max_memory * 1024**3 / self._args.processes)
+        return SamToBamConverter(threads, memory_per_thread)
+
+    def _sam_to_bam(self, sam_paths, bam_prefixes_paths):
         """Manage the conversion of mapped read from SAM to BAM format."""
-        sam_to_bam_converter = SamToBamConverter()
+        sam_to_bam_converter = self._sam_to_bam_converter(
+            self._processes_per_lib())
         jobs = []
         with concurrent.futures.ProcessPoolExecutor(
                 max_workers=self._args.processes) as executor:
-            for sam_path, bam_prefix_path, bam_path in zip(
-                    sam_paths, bam_prefixes_paths, bam_paths):
-                if not self._helpers.file_needs_to_be_created(bam_path):
-                    continue
+            for sam_path, bam_prefix_path in zip(
+                    sam_paths, bam_prefixes_paths):
                 jobs.append(executor.submit(
                     sam_to_bam_converter.sam_to_bam,
                     sam_path, bam_prefix_path))
@@ -348,14 +1046,12 @@ class PerformAlignment(object):
         """Manage the generation of alingment statistics."""
         raw_stat_data_writer = RawStatDataWriter(pretty=True)
         read_files_and_jobs = {}
-        if not self._helpers.file_needs_to_be_created(output_stats_path):
-            return
         with concurrent.futures.ProcessPoolExecutor(
                 max_workers=self._args.processes) as executor:
             for (lib_name, read_alignment_bam_path,
                  unaligned_reads_path) in zip(
                     lib_names, result_bam_paths, unaligned_reads_paths):
-                read_aligner_stats = ReadAlignerStats()
+                read_aligner_stats = self._read_aligner_stats()
                 read_files_and_jobs[lib_name] = executor.submit(
                     read_aligner_stats.count, read_alignment_bam_path,
                     unaligned_reads_path)
@@ -366,14 +1062,51 @@ class PerformAlignment(object):
              for lib_name, job in read_files_and_jobs.items()])
         raw_stat_data_writer.write(read_files_and_stats, output_stats_path)
 
+    def _generate_primary_read_alignment_stats(self):
+        self._generate_read_alignment_stats(
+            self._lib_names,
+            self._paths.primary_read_aligner_bam_paths,
+            self._paths.unaligned_reads_paths,
+            self._paths.primary_read_aligner_stats_path)
+
+    def _realign_while_generating_primary_stats(self):
+        """Realign the unaligned reads while the statistics of the
+        primary alignments are generated.
+
+        Both run as tasks in their own processes and split the
+        processes between them. The realignment gets the larger share
+        as it takes much longer.
+        """
+        stats_processes = max(1, self._args.processes // 4)
+        realigner_processes = max(1, self._args.processes - stats_processes)
+        task_scheduler = TaskScheduler(self._args.processes)
+        task_scheduler.add_task(
+            "primary_stats", self._run_with_processes,
+            (stats_processes, "_generate_primary_read_alignment_stats"),
+            cpus=stats_processes)
+        task_scheduler.add_task(
+            "realign", self._run_with_processes,
+            (realigner_processes, "_run_realigner_and_process_alignments"),
+            cpus=realigner_processes)
+        task_scheduler.run()
+
+    def _run_with_processes(self, processes, method_name):
+        """Call a method that uses only the given number of processes.
+
+        This is called in a task process, so the arguments of the
+        calling process are not changed.
+        """
+        self._args.processes = processes
+        getattr(self, method_name)()
+
     def _run_realigner_and_process_alignments(self):
-        # As the realigner needs a *sorted* SAM file
-        self._generate_sorted_tmp_sam_file()
+        if not self._args.stream_realigner_input:
+            # As the realigner needs a *sorted* SAM file
+            self._generate_sorted_tmp_sam_file()
         self._realign_unmapped_reads()
         self._sam_to_bam(
             self._paths.read_realigner_sam_paths,
-            self._paths.read_realigner_bam_prefixes_paths,
-            self._paths.read_realigner_sam_paths)
+            self._paths.read_realigner_bam_prefixes_paths)
         self._generate_read_alignment_stats(
             self._lib_names,
             self._paths.read_realigner_bam_paths,
@@ -381,7 +1114,8 @@ class PerformAlignment(object):
             self._paths.read_realigner_stats_path)
 
     def _generate_sorted_tmp_sam_file(self):
-        sam_to_bam_converter = SamToBamConverter()
+        sam_to_bam_converter = self._sam_to_bam_converter(
+            self._processes_per_lib())
         jobs = []
         with concurrent.futures.ProcessPoolExecutor(
                 max_workers=self._args.processes) as executor:
@@ -394,19 +1128,8 @@ class PerformAlignment(object):
         self._helpers.check_job_completeness(jobs)
 
     def _realign_unmapped_reads(self):
-        read_realigner = ReadRealigner(
-            self._args.lack_bin, self._args.progress)
-        for (query_fasta_path, query_sam_path, realignment_sam_path,
-             unaligned_reads_path) in zip(
-                self._paths.unaligned_reads_paths,
-                self._paths.read_realigner_tmp_sam_paths,
-                self._paths.read_realigner_sam_paths,
-                self._paths.realigned_unaligned_reads_paths):
-            read_realigner.run_alignment(
-                query_fasta_path, query_sam_path, self._paths.ref_seq_paths,
-                realignment_sam_path, unaligned_reads_path,
-                int(self._args.processes), int(self._args.segemehl_accuracy))
-            os.remove(query_sam_path)
+        for lib_index in range(len(self._lib_names)):
+            self._run_realigner_of_lib(lib_index)
 
     def _merge_bam_files(self):
         jobs = []
@@ -416,6 +1139,7 @@ class PerformAlignment(object):
                     self._paths.read_alignment_bam_paths,
                     self._paths.primary_read_aligner_bam_paths,
                     self._paths.read_realigner_bam_paths):
+                self._remove_outdated_bam_file(merged_bam)
                 bam_merger = BamMerger()
                 jobs.append(executor.submit(
                     bam_merger.merge, merged_bam,
@@ -429,6 +1153,12 @@ class PerformAlignment(object):
                     os.remove(bam_file)
                     os.remove("%s.bai" % bam_file)
 
+    def _remove_outdated_bam_file(self, bam_path):
+        """Remove the merged BAM file of a previous run and its index."""
+        for file_path in [bam_path, "%s.bai" % bam_path]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
     def _remove_crossaligned_reads(self):
         self._string_to_species_and_sequence_ids()
         jobs = []
@@ -474,7 +1204,9 @@ class PerformAlignment(object):
         # Perform the removal or cross aligned reads
         cross_align_filter = CrossAlignFilter(
             bam_path, bam_cleaned_tmp_path, crossmapped_reads_path,
-            self._species_and_sequence_ids)
+            self._species_and_sequence_ids,
+            threads=self._processes_per_lib(),
+            processes=self._processes_per_lib())
         cross_align_filter.determine_crossmapped_reads()
         cross_align_filter.write_crossmapping_free_bam()
         # Rename the original mapping file that potentially
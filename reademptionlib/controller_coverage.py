@@ -1,7 +1,8 @@
 import concurrent.futures
-import sys
+import contextlib
 from reademptionlib.coveragecalculator import CoverageCalculator
 from reademptionlib.helpers import Helpers
+from reademptionlib.manifest import atomic_output_path
 from reademptionlib.paths import Paths
 from reademptionlib.rawstatdata import RawStatDataReader
 from reademptionlib.wiggle import WiggleWriter
@@ -9,6 +10,13 @@ from reademptionlib.wiggle import WiggleWriter
 
 class CalculateCoverage(object):
 
+    # Arguments that change the coverage files of a library. The
+    # coverage step is also run by the fused subcommand, which has
+    # further arguments.
+    _lib_argument_names = [
+        "unique_only", "normalize_by_uniquely", "skip_read_count_splitting",
+        "non_strand_specific", "coverage_style", "clip_length"]
+
     def __init__(self, args):
         self._args = args
         self._paths = Paths(args)
@@ -23,6 +31,25 @@ class CalculateCoverage(object):
         """
         self._helpers.test_folder_existance(
             self._paths.required_coverage_folders())
+        # Run the generation of coverage in parallel
+        jobs = []
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._args.processes) as executor:
+            for lib_name, bam_path in self.set_up_libs():
+                if self.lib_is_up_to_date(lib_name, bam_path):
+                    continue
+                jobs.append(executor.submit(
+                    self._create_coverage_files_for_lib, lib_name, bam_path))
+        # Evaluate thread outcome
+        self._helpers.check_job_completeness(jobs)
+
+    def set_up_libs(self):
+        """Set the paths of the libraries and read their numbers of
+        aligned reads.
+
+        Return the names of the libraries and the paths of their BAM
+        files.
+        """
         raw_stat_data_reader = RawStatDataReader()
         alignment_stats = [raw_stat_data_reader.read(
             self._paths.read_alignments_stats_path)]
@@ -40,107 +67,131 @@ class CalculateCoverage(object):
             aligned_counting = "no_of_aligned_reads"
         else:
             aligned_counting = "no_of_uniquely_aligned_reads"
-        read_files_aligned_read_freq = dict([
+        self._read_files_aligned_read_freq = dict([
             (read_file,
              round(attributes["stats_total"][aligned_counting]))
             for read_file, attributes in alignment_stats[0].items()])
-        min_no_of_aligned_reads = float(min(
-            read_files_aligned_read_freq.values()))
-        # Run the generation of coverage in parallel
-        jobs = []
-        with concurrent.futures.ProcessPoolExecutor(
-                max_workers=self._args.processes) as executor:
-            for lib_name, bam_path in zip(
-                    lib_names, self._paths.read_alignment_bam_paths):
-                no_of_aligned_reads = float(
-                    read_files_aligned_read_freq[lib_name])
-                jobs.append(executor.submit(
-                    self._create_coverage_files_for_lib,
-                    lib_name, bam_path, no_of_aligned_reads,
-                    min_no_of_aligned_reads))
-        # Evaluate thread outcome
-        self._helpers.check_job_completeness(jobs)
+        self._min_no_of_aligned_reads = float(min(
+            self._read_files_aligned_read_freq.values()))
+        self._libs_and_collapsed_reads = self._helpers.were_reads_collapsed(
+            lib_names)
+        return list(zip(lib_names, self._paths.read_alignment_bam_paths))
 
-    def _create_coverage_files_for_lib(
-        self, lib_name, bam_path, no_of_aligned_reads,
-            min_no_of_aligned_reads):
+    def lib_is_up_to_date(self, lib_name, bam_path):
+        return self._helpers.step_is_up_to_date(
+            "coverage:%s" % lib_name, [bam_path],
+            self._lib_parameters(lib_name))
+
+    def _lib_parameters(self, lib_name):
+        # The normalized coverages depend on the numbers of aligned
+        # reads of all libraries
+        return self._helpers.step_parameters(
+            self._lib_argument_names,
+            no_of_aligned_reads=float(
+                self._read_files_aligned_read_freq[lib_name]),
+            min_no_of_aligned_reads=self._min_no_of_aligned_reads,
+            collapsed_reads=self._libs_and_collapsed_reads[lib_name])
+
+    def _create_coverage_files_for_lib(self, lib_name, bam_path):
         """Perform the coverage calculation for a given library."""
-        if not self._args.non_strand_specific:
-            strands = ["forward", "reverse"]
-        else:
-            strands = ["forward_and_reverse"]
-        if self._all_coverage_file_exist(
-                lib_name, strands, no_of_aligned_reads,
-                min_no_of_aligned_reads):
-            return
+        coverage_calculator = self.coverage_calculator(lib_name)
+        with self.coverage_files(lib_name, bam_path) as write_coverages:
+            for ref_seq, coverages in (
+                    coverage_calculator.ref_seq_and_coverages(bam_path)):
+                write_coverages(ref_seq, coverages)
+
+    def coverage_calculator(self, lib_name):
         read_count_splitting = True
         if self._args.skip_read_count_splitting:
             read_count_splitting = False
-        coverage_calculator = CoverageCalculator(
+        return CoverageCalculator(
             read_count_splitting=read_count_splitting,
             uniquely_aligned_only=self._args.unique_only,
             coverage_style=self._args.coverage_style,
             clip_length=self._args.clip_length,
-            non_strand_specific=self._args.non_strand_specific)
-        (coverage_writers_raw, coverage_writers_tnoar_min_norm,
-         coverage_writers_tnoar_mil_norm) = self._wiggle_writers(
+            non_strand_specific=self._args.non_strand_specific,
+            collapsed_reads=self._libs_and_collapsed_reads[lib_name])
+
+    @contextlib.contextmanager
+    def coverage_files(self, lib_name, bam_path):
+        """Return a function that writes the coverages of a replicon
+        to the raw and normalized coverage files of the library.
+
+        The coverage files are completed and recorded when the context
+        is left.
+        """
+        if not self._args.non_strand_specific:
+            strands = ["forward", "reverse"]
+        else:
+            strands = ["forward_and_reverse"]
+        no_of_aligned_reads = float(
+            self._read_files_aligned_read_freq[lib_name])
+        min_no_of_aligned_reads = self._min_no_of_aligned_reads
+        (wiggle_paths_raw, wiggle_paths_tnoar_min_norm,
+         wiggle_paths_tnoar_mil_norm) = self._wiggle_paths(
             lib_name, strands, no_of_aligned_reads, min_no_of_aligned_reads)
-        for ref_seq, coverages in coverage_calculator.ref_seq_and_coverages(
-                bam_path):
-            for strand in strands:
-                coverage_writers_raw[strand].write_replicons_coverages(
-                    ref_seq, coverages[strand])
-                coverage_writers_tnoar_min_norm[
-                    strand].write_replicons_coverages(
-                    ref_seq, coverages[strand],
-                    factor=min_no_of_aligned_reads/no_of_aligned_reads)
-                coverage_writers_tnoar_mil_norm[
-                    strand].write_replicons_coverages(
-                    ref_seq, coverages[strand],
-                    factor=1000000/no_of_aligned_reads)
-        for strand in strands:
-            coverage_writers_raw[strand].close_file()
-
-    def _all_coverage_file_exist(
-        self, lib_name, strands, no_of_aligned_reads,
-            min_no_of_aligned_reads):
-        """Test the existance of all coverage file of a library"""
-        files = []
-        for strand in strands:
-            files.append(self._paths.wiggle_file_raw_path(lib_name, strand))
-            files.append(self._paths.wiggle_file_tnoar_norm_min_path(
+        with contextlib.ExitStack() as exit_stack:
+            # The files of previous runs are only replaced if all
+            # coverage files of the library were written
+            (coverage_writers_raw, coverage_writers_tnoar_min_norm,
+             coverage_writers_tnoar_mil_norm) = [
+                 self._wiggle_writers(lib_name, dict(
+                     (strand, exit_stack.enter_context(
+                         atomic_output_path(wiggle_path)))
+                     for strand, wiggle_path in strands_and_paths.items()))
+                 for strands_and_paths in (
+                     wiggle_paths_raw, wiggle_paths_tnoar_min_norm,
+                     wiggle_paths_tnoar_mil_norm)]
+
+            def write_coverages(ref_seq, coverages):
+                for strand in strands:
+                    coverage_writers_raw[strand].write_replicons_coverages(
+                        ref_seq, coverages[strand])
+                    coverage_writers_tnoar_min_norm[
+                        strand].write_replicons_coverages(
+                        ref_seq, coverages[strand],
+                        factor=min_no_of_aligned_reads/no_of_aligned_reads)
+                    coverage_writers_tnoar_mil_norm[
+                        strand].write_replicons_coverages(
+                        ref_seq, coverages[strand],
+                        factor=1000000/no_of_aligned_reads)
+
+            yield write_coverages
+            for coverage_writers in (
+                    coverage_writers_raw, coverage_writers_tnoar_min_norm,
+                    coverage_writers_tnoar_mil_norm):
+                for strand in strands:
+                    coverage_writers[strand].close_file()
+        self._helpers.record_step(
+            "coverage:%s" % lib_name, [bam_path],
+            self._lib_parameters(lib_name), [
+                wiggle_path for strands_and_paths in (
+                    wiggle_paths_raw, wiggle_paths_tnoar_min_norm,
+                    wiggle_paths_tnoar_mil_norm)
+                for wiggle_path in strands_and_paths.values()])
+
+    def _wiggle_paths(self, lib_name, strands, no_of_aligned_reads,
+                      min_no_of_aligned_reads):
+        """Return the paths of the raw and the normalized coverage files
+        of each strand.
+        """
+        wiggle_paths_raw = dict([(
+            strand, self._paths.wiggle_file_raw_path(lib_name, strand))
+            for strand in strands])
+        wiggle_paths_tnoar_min_norm = dict([(
+            strand, self._paths.wiggle_file_tnoar_norm_min_path(
                 lib_name, strand, multi=min_no_of_aligned_reads,
-                div=no_of_aligned_reads))
-            files.append(self._paths.wiggle_file_tnoar_norm_mil_path(
+                div=no_of_aligned_reads)) for strand in strands])
+        wiggle_paths_tnoar_mil_norm = dict([(
+            strand, self._paths.wiggle_file_tnoar_norm_mil_path(
                 lib_name, strand, multi=1000000,
-                div=no_of_aligned_reads))
-        if not any([self._helpers.file_needs_to_be_created(file, quiet=True)
-                    for file in files]):
-            sys.stderr.write(
-                "The files %s exists. Skipping their generation.\n" %
-                ", " .join(files))
-            return True
-        return False
-
-    def _wiggle_writers(self, lib_name, strands, no_of_aligned_reads,
-                        min_no_of_aligned_reads):
-        """Write the calculated coverages to wiggle files."""
-        coverage_writers_raw = dict([(
-            strand, WiggleWriter(
-                "%s_%s" % (lib_name, strand),
-                open(self._paths.wiggle_file_raw_path(lib_name, strand),
-                     "w"))) for strand in strands])
-        coverage_writers_tnoar_min_norm = dict([(
-            strand, WiggleWriter(
-                "%s_%s" % (lib_name, strand),
-                open(self._paths.wiggle_file_tnoar_norm_min_path(
-                    lib_name, strand, multi=min_no_of_aligned_reads,
-                    div=no_of_aligned_reads), "w"))) for strand in strands])
-        coverage_writers_tnoar_mil_norm = dict([(
-            strand, WiggleWriter(
-                "%s_%s" % (lib_name, strand),
-                open(self._paths.wiggle_file_tnoar_norm_mil_path(
-                    lib_name, strand, multi=1000000,
-                    div=no_of_aligned_reads), "w"))) for strand in strands])
-        return (coverage_writers_raw, coverage_writers_tnoar_min_norm,
-                coverage_writers_tnoar_mil_norm)
+                div=no_of_aligned_reads)) for strand in strands])
+        return (wiggle_paths_raw, wiggle_paths_tnoar_min_norm,
+                wiggle_paths_tnoar_mil_norm)
+
+    def _wiggle_writers(self, lib_name, strands_and_paths):
+        """Return writers of the calculated coverages to wiggle files."""
+        return dict([(
+            strand, WiggleWriter("%s_%s" % (lib_name, strand),
+                                 open(wiggle_path, "w")))
+            for strand, wiggle_path in strands_and_paths.items()])
@@ -1,3 +1,4 @@
+import os
 from reademptionlib.deseq import DESeqRunner
 from reademptionlib.helpers import Helpers
 from reademptionlib.paths import Paths
@@ -18,6 +19,11 @@ class RunDeseq(object):
                     self._args.libs.split(",")]
         conditions = self._args.conditions.split(",")
         self._check_deseq_args(arg_libs, conditions)
+        parameters = self._helpers.step_parameters()
+        if self._helpers.step_is_up_to_date(
+                "deseq", [self._paths.gene_wise_quanti_combined_path],
+                parameters):
+            return
         deseq_runner = DESeqRunner(
             arg_libs, conditions, self._paths.deseq_raw_folder,
             self._paths.deseq_extended_folder, self._paths.deseq_script_path,
@@ -32,6 +38,12 @@ class RunDeseq(object):
         deseq_runner.merge_counting_files_with_results()
         self._viz_deseq()
         deseq_runner.create_final_output_files()
+        self._helpers.record_step(
+            "deseq", [self._paths.gene_wise_quanti_combined_path], parameters,
+            ["%s/%s" % (folder, output_file) for folder in [
+                self._paths.deseq_raw_folder,
+                self._paths.deseq_extended_folder]
+             for output_file in sorted(os.listdir(folder))])
 
     def _check_deseq_args(self, arg_libs, conditions):
         """Test if the given arguments are sufficient."""
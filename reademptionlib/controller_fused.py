@@ -0,0 +1,78 @@
+import concurrent.futures
+import contextlib
+from reademptionlib.alignmentpass import AlignmentPass
+from reademptionlib.controller_coverage import CalculateCoverage
+from reademptionlib.controller_genequanti import GeneQuantification
+from reademptionlib.coveragecalculator import CoverageAccumulator
+from reademptionlib.helpers import Helpers
+from reademptionlib.paths import Paths
+
+
+class FusedQuantification(object):
+    """Create the coverage files and the gene wise quantifications with
+    one pass through the alignments of each library.
+
+    The output files are the same as the ones of the coverage and the
+    gene_quanti subcommands.
+    """
+
+    def __init__(self, args):
+        self._args = args
+        self._paths = Paths(args)
+        self._helpers = Helpers(args)
+        self._calculate_coverage = CalculateCoverage(args)
+        self._gene_quantification = GeneQuantification(args)
+
+    def create_coverage_files_and_quantify_gene_wise(self):
+        self._helpers.test_folder_existance(
+            self._paths.required_coverage_folders() +
+            self._paths.required_gene_quanti_folders())
+        lib_names_and_bam_paths = self._calculate_coverage.set_up_libs()
+        lib_names = [lib_name for lib_name, bam_path in
+                     self._gene_quantification.set_up_libs()]
+        jobs = []
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._args.processes) as executor:
+            for lib_name, bam_path in lib_names_and_bam_paths:
+                calculate_coverages = (
+                    not self._calculate_coverage.lib_is_up_to_date(
+                        lib_name, bam_path))
+                quantify_gene_wise = (
+                    not self._gene_quantification.lib_is_up_to_date(
+                        lib_name, bam_path))
+                if not (calculate_coverages or quantify_gene_wise):
+                    continue
+                jobs.append(executor.submit(
+                    self._run_alignment_pass, lib_name, bam_path,
+                    calculate_coverages, quantify_gene_wise))
+        # Evaluate thread outcome
+        self._helpers.check_job_completeness(jobs)
+        self._gene_quantification.create_overview(lib_names)
+        self._gene_quantification.viz_gene_quanti()
+
+    def _run_alignment_pass(self, lib_name, bam_path, calculate_coverages,
+                            quantify_gene_wise):
+        """Create the coverage files and the gene wise quantification
+        of a library with one pass through its alignments.
+        """
+        accumulators = []
+        with contextlib.ExitStack() as exit_stack:
+            if calculate_coverages:
+                write_coverages = exit_stack.enter_context(
+                    self._calculate_coverage.coverage_files(
+                        lib_name, bam_path))
+                accumulators.append(CoverageAccumulator(
+                    self._calculate_coverage.coverage_calculator(lib_name),
+                    write_coverages))
+            if quantify_gene_wise:
+                gene_quanti_paths = exit_stack.enter_context(
+                    self._gene_quantification.gene_quanti_files(
+                        lib_name, bam_path))
+                gene_wise_quantification_accumulator = (
+                    self._gene_quantification
+                    .gene_wise_quantification_accumulator(lib_name))
+                accumulators.append(gene_wise_quantification_accumulator)
+            AlignmentPass(accumulators).run(bam_path)
+            if quantify_gene_wise:
+                gene_wise_quantification_accumulator.write_countings(
+                    gene_quanti_paths)
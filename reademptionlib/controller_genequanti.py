@@ -1,9 +1,11 @@
 import concurrent.futures
-import sys
+import contextlib
 import json
 from reademptionlib.genewisequanti import GeneWiseOverview
 from reademptionlib.genewisequanti import GeneWiseQuantification
+from reademptionlib.genewisequanti import GeneWiseQuantificationAccumulator
 from reademptionlib.helpers import Helpers
+from reademptionlib.manifest import atomic_output_path
 from reademptionlib.paths import Paths
 from reademptionlib.rawstatdata import RawStatDataReader
 from reademptionlib.vizgenequanti import GeneQuantiViz
@@ -11,6 +13,16 @@ from reademptionlib.vizgenequanti import GeneQuantiViz
 
 class GeneQuantification(object):
 
+    # Arguments that change the countings of a library and the overview
+    # tables. These steps are also run by the fused subcommand, which
+    # has further arguments.
+    _lib_argument_names = [
+        "min_overlap", "read_region", "clip_length",
+        "no_count_split_by_alignment_no", "no_count_splitting_by_gene_no",
+        "allowed_features", "skip_antisense", "unique_only", "pseudocounts"]
+    _overview_argument_names = [
+        "allowed_features", "skip_antisense", "non_strand_specific"]
+
     def __init__(self, args):
         self._args = args
         self._paths = Paths(args)
@@ -20,12 +32,28 @@ class GeneQuantification(object):
         """Manage the counting of aligned reads per gene."""
         self._helpers.test_folder_existance(
             self._paths.required_gene_quanti_folders())
-        norm_by_alignment_freq = True
-        norm_by_overlap_freq = True
-        if self._args.no_count_split_by_alignment_no:
-            norm_by_alignment_freq = False
-        if self._args.no_count_splitting_by_gene_no:
-            norm_by_overlap_freq = False
+        lib_names_and_bam_paths = self.set_up_libs()
+        jobs = []
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._args.processes) as executor:
+            for lib_name, read_alignment_path in lib_names_and_bam_paths:
+                if self.lib_is_up_to_date(lib_name, read_alignment_path):
+                    continue
+                jobs.append(executor.submit(
+                    self._quantify_gene_wise, lib_name, read_alignment_path))
+        # Evaluate thread outcome
+        self._helpers.check_job_completeness(jobs)
+        self.create_overview([
+            lib_name for lib_name, read_alignment_path in
+            lib_names_and_bam_paths])
+        self.viz_gene_quanti()
+
+    def set_up_libs(self):
+        """Set the paths of the libraries and the annotation files.
+
+        Return the names of the libraries and the paths of their BAM
+        files.
+        """
         raw_stat_data_reader = RawStatDataReader()
         alignment_stats = [raw_stat_data_reader.read(
             self._paths.read_alignments_stats_path)]
@@ -40,39 +68,43 @@ class GeneQuantification(object):
         else:
             self._paths.set_read_files_dep_file_lists_paired_end(
                 self._paths.get_read_files(), lib_names)
-        jobs = []
-        with concurrent.futures.ProcessPoolExecutor(
-                max_workers=self._args.processes) as executor:
-            for lib_name, read_alignment_path in zip(
-                    lib_names, self._paths.read_alignment_bam_paths):
-                jobs.append(executor.submit(
-                    self._quantify_gene_wise, lib_name,
-                    read_alignment_path, norm_by_alignment_freq,
-                    norm_by_overlap_freq, annotation_files))
-        # Evaluate thread outcome
-        self._helpers.check_job_completeness(jobs)
-        self._gene_quanti_create_overview(
-            annotation_files, self._paths.annotation_paths, lib_names)
-        self._viz_gene_quanti()
-
-    def _quantify_gene_wise(
-            self, lib_name, read_alignment_path,
-            norm_by_alignment_freq,  norm_by_overlap_freq,
-            annotation_files):
+        self._annotation_files = annotation_files
+        self._libs_and_collapsed_reads = self._helpers.were_reads_collapsed(
+            lib_names)
+        return list(zip(lib_names, self._paths.read_alignment_bam_paths))
+
+    def lib_is_up_to_date(self, lib_name, read_alignment_path):
+        return self._helpers.step_is_up_to_date(
+            "gene_quanti:%s" % lib_name,
+            [read_alignment_path] + self._paths.annotation_paths,
+            self._lib_parameters(lib_name))
+
+    def _lib_parameters(self, lib_name):
+        return self._helpers.step_parameters(
+            self._lib_argument_names,
+            collapsed_reads=self._libs_and_collapsed_reads[lib_name])
+
+    def _quantify_gene_wise(self, lib_name, read_alignment_path):
         """Perform the gene wise quantification for a given library."""
-        gene_quanti_paths = [
-            self._paths.gene_quanti_path(lib_name, annotation_file)
-            for annotation_file in annotation_files]
-        # Check if all output files for this library exist - if so
-        # skip their creation
-        if not any([self._helpers.file_needs_to_be_created(
-                gene_quanti_path, quiet=True)
-                for gene_quanti_path in gene_quanti_paths]):
-            sys.stderr.write(
-                "The file(s) %s exist(s). Skipping their/its generation.\n" %
-                ", " .join(gene_quanti_paths))
-            return
-        gene_wise_quantification = GeneWiseQuantification(
+        gene_wise_quantification = self.gene_wise_quantification(lib_name)
+        gene_wise_quantification.calc_overlaps_per_alignment(
+            read_alignment_path, self._paths.annotation_paths)
+        with self.gene_quanti_files(
+                lib_name, read_alignment_path) as gene_quanti_paths:
+            for annotation_path, gene_quanti_path in zip(
+                    self._paths.annotation_paths, gene_quanti_paths):
+                gene_wise_quantification.quantify(
+                    read_alignment_path, annotation_path, gene_quanti_path,
+                    self._args.pseudocounts)
+
+    def gene_wise_quantification(self, lib_name):
+        norm_by_alignment_freq = True
+        norm_by_overlap_freq = True
+        if self._args.no_count_split_by_alignment_no:
+            norm_by_alignment_freq = False
+        if self._args.no_count_splitting_by_gene_no:
+            norm_by_overlap_freq = False
+        return GeneWiseQuantification(
             min_overlap=self._args.min_overlap,
             read_region=self._args.read_region,
             clip_length=self._args.clip_length,
@@ -80,19 +112,39 @@ class GeneQuantification(object):
             norm_by_overlap_freq=norm_by_overlap_freq,
             allowed_features_str=self._args.allowed_features,
             skip_antisense=self._args.skip_antisense,
-            unique_only=self._args.unique_only)
-        gene_wise_quantification.calc_overlaps_per_alignment(
-            read_alignment_path, self._paths.annotation_paths)
-        for annotation_file, annotation_path in zip(
-                annotation_files, self._paths.annotation_paths):
-            gene_wise_quantification.quantify(
-                read_alignment_path, annotation_path,
-                self._paths.gene_quanti_path(
-                    lib_name, annotation_file), self._args.pseudocounts)
-
-    def _gene_quanti_create_overview(
-            self, annotation_files, annotation_paths, lib_names):
+            unique_only=self._args.unique_only,
+            collapsed_reads=self._libs_and_collapsed_reads[lib_name])
+
+    def gene_wise_quantification_accumulator(self, lib_name):
+        return GeneWiseQuantificationAccumulator(
+            self.gene_wise_quantification(lib_name),
+            self._paths.annotation_paths,
+            self._args.pseudocounts)
+
+    @contextlib.contextmanager
+    def gene_quanti_files(self, lib_name, read_alignment_path):
+        """Return the paths to which the countings of the library for
+        each annotation file are written.
+
+        The files are only replaced and recorded if all countings of
+        the library were written.
+        """
+        gene_quanti_paths = [
+            self._paths.gene_quanti_path(lib_name, annotation_file)
+            for annotation_file in self._annotation_files]
+        with contextlib.ExitStack() as exit_stack:
+            yield [exit_stack.enter_context(
+                atomic_output_path(gene_quanti_path))
+                   for gene_quanti_path in gene_quanti_paths]
+        self._helpers.record_step(
+            "gene_quanti:%s" % lib_name,
+            [read_alignment_path] + self._paths.annotation_paths,
+            self._lib_parameters(lib_name), gene_quanti_paths)
+
+    def create_overview(self, lib_names):
         """Create an overview table of all gene quantification for all libs."""
+        annotation_files = self._annotation_files
+        annotation_paths = self._paths.annotation_paths
         strand_specific = True
         if self._args.non_strand_specific:
                     strand_specific = False
@@ -108,23 +160,37 @@ class GeneQuantification(object):
                 path_and_name_combos[annotation_path].append(
                     [read_file, self._paths.gene_quanti_path(
                         read_file, annotation_file)])
-        if self._helpers.file_needs_to_be_created(
-                self._paths.gene_wise_quanti_combined_path):
+        # The overview tables depend on the countings and the numbers
+        # of aligned reads of all libraries
+        input_paths = [
+            gene_quanti_path
+            for annotation_path in annotation_paths
+            for lib_name, gene_quanti_path in path_and_name_combos[
+                annotation_path]] + [self._paths.read_alignments_stats_path]
+        parameters = self._helpers.step_parameters(
+            self._overview_argument_names, lib_names=lib_names)
+        if self._helpers.step_is_up_to_date(
+                "gene_quanti_overview", input_paths, parameters):
+            return
+        with atomic_output_path(
+                self._paths.gene_wise_quanti_combined_path) as tmp_path:
             gene_wise_overview.create_overview_raw_countings(
-                path_and_name_combos, lib_names,
-                self._paths.gene_wise_quanti_combined_path)
-        if self._helpers.file_needs_to_be_created(
-                self._paths.gene_wise_quanti_combined_rpkm_path):
+                path_and_name_combos, lib_names, tmp_path)
+        with atomic_output_path(
+                self._paths.gene_wise_quanti_combined_rpkm_path) as tmp_path:
             gene_wise_overview.create_overview_rpkm(
-                path_and_name_combos, lib_names,
-                self._paths.gene_wise_quanti_combined_rpkm_path,
+                path_and_name_combos, lib_names, tmp_path,
                 self._libs_and_total_num_of_aligned_reads())
-        if self._helpers.file_needs_to_be_created(
-                self._paths.gene_wise_quanti_combined_tnoar_path):
+        with atomic_output_path(
+                self._paths.gene_wise_quanti_combined_tnoar_path) as tmp_path:
             gene_wise_overview.create_overview_norm_by_tnoar(
-                path_and_name_combos, lib_names,
-                self._paths.gene_wise_quanti_combined_tnoar_path,
+                path_and_name_combos, lib_names, tmp_path,
                 self._libs_and_total_num_of_aligned_reads())
+        self._helpers.record_step(
+            "gene_quanti_overview", input_paths, parameters, [
+                self._paths.gene_wise_quanti_combined_path,
+                self._paths.gene_wise_quanti_combined_rpkm_path,
+                self._paths.gene_wise_quanti_combined_tnoar_path])
 
     def _libs_and_total_num_of_aligned_reads(self):
         """Read the total number of reads per library."""
@@ -134,7 +200,7 @@ class GeneQuantification(object):
         return dict([(lib, values["stats_total"]["no_of_aligned_reads"])
                      for lib, values in read_aligner_stats.items()])
 
-    def _viz_gene_quanti(self):
+    def viz_gene_quanti(self):
         """Generate plots based on the gene-wise read countings"""
         gene_quanti_viz = GeneQuantiViz(
             self._paths.gene_wise_quanti_combined_path,
@@ -1,12 +1,13 @@
 import numpy as np
 import pysam
+from reademptionlib.readcollapser import read_multiplicity
 
 
 class CoverageCalculator(object):
 
     def __init__(self, read_count_splitting=True, uniquely_aligned_only=False,
                  coverage_style="global", clip_length=11,
-                 non_strand_specific=False):
+                 non_strand_specific=False, collapsed_reads=False):
         self._read_count_splitting = read_count_splitting
         self._uniquely_aligned_only = uniquely_aligned_only
         self._coverage_style = coverage_style
@@ -14,15 +15,19 @@ class CoverageCalculator(object):
         self._coverage_add_function = self._select_coverage_add_function()
         self._coverages = {}
         self._non_strand_specific = non_strand_specific
+        self._collapsed_reads = collapsed_reads
 
     def ref_seq_and_coverages(self, bam_path):
         bam = self._open_bam_file(bam_path)
         for ref_seq, length in zip(bam.references, bam.lengths):
             self._init_coverage_list(length)
             self._calc_coverage(ref_seq, bam)
-            if self._non_strand_specific:
-                self._sum_strand_coverages()
-            yield(ref_seq, self._coverages)
+            yield(ref_seq, self._finished_coverages())
+
+    def _finished_coverages(self):
+        if self._non_strand_specific:
+            self._sum_strand_coverages()
+        return self._coverages
 
     def _sum_strand_coverages(self):
         self._coverages["forward_and_reverse"] = [
@@ -37,20 +42,26 @@ class CoverageCalculator(object):
 
     def _calc_coverage(self, ref_seq, bam):
         for entry in bam.fetch(ref_seq):
-            number_of_hits = dict(entry.tags)["NH"]
-            if self._uniquely_aligned_only is True and number_of_hits != 1:
-                continue
-            # Note: No translation from SAMParsers coordinates to python
-            # list coorindates is needed.
-            start = entry.pos
-            end = entry.aend
-            # Normalize coverage increment by number of read alignments
-            # per read
-            if self._read_count_splitting is True:
-                increment = 1.0 / float(number_of_hits)
-            else:
-                increment = 1.0
-            self._coverage_add_function(entry, increment, start, end)
+            self._add_alignment(entry)
+
+    def _add_alignment(self, entry):
+        number_of_hits = dict(entry.tags)["NH"]
+        if self._uniquely_aligned_only is True and number_of_hits != 1:
+            return
+        # Note: No translation from SAMParsers coordinates to python
+        # list coorindates is needed.
+        start = entry.pos
+        end = entry.aend
+        # Normalize coverage increment by number of read alignments
+        # per read
+        if self._read_count_splitting is True:
+            increment = 1.0 / float(number_of_hits)
+        else:
+            increment = 1.0
+        # A collapsed read stands for several identical reads
+        if self._collapsed_reads:
+            increment *= read_multiplicity(entry.query_name)
+        self._coverage_add_function(entry, increment, start, end)
 
     def _select_coverage_add_function(self):
         if self._coverage_style == "first_base_only":
@@ -100,3 +111,28 @@ class CoverageCalculator(object):
         else:
             self._coverages["reverse"][center_start:center_end] -= (
                 increment / center_length)
+
+
+class CoverageAccumulator(object):
+    """Calculate the coverages of each replicon from the alignments
+    passed to it by an AlignmentPass.
+
+    The coverages of a replicon are given to the coverage writing
+    function as soon as all its alignments were added.
+    """
+
+    def __init__(self, coverage_calculator, write_coverages):
+        self._coverage_calculator = coverage_calculator
+        self._write_coverages = write_coverages
+
+    def start_reference(self, ref_seq, length):
+        self._coverage_calculator._init_coverage_list(length)
+
+    def add_alignments(self, alignments):
+        add_alignment = self._coverage_calculator._add_alignment
+        for alignment in alignments:
+            add_alignment(alignment)
+
+    def finish_reference(self, ref_seq):
+        self._write_coverages(
+            ref_seq, self._coverage_calculator._finished_coverages())
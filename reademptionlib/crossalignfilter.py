@@ -1,60 +1,82 @@
+import concurrent.futures
+import multiprocessing
+import os
+import numpy as np
 import pysam
 import sys
+from reademptionlib.bamregions import bam_regions, region_alignments
+
+# Hashes of the cross mapped reads in the worker processes
+_crossmapped_read_hashes = set()
 
 
 class CrossAlignFilter(object):
-    
+    """Remove reads that are aligned to sequences of different species.
+
+    The BAM file is split into regions of about the same number of
+    alignments which are processed by several processes. Read names are
+    only kept as 64 bit hashes.
+    """
+
     def __init__(self, input_bam, output_bam, output_crossmapped_reads,
-                 orgs_and_replicon_ids):
+                 orgs_and_replicon_ids, threads=1, processes=1):
         self._input_bam = input_bam
         self._output_bam = output_bam
         self._output_crossmapped_reads = output_crossmapped_reads
         self._orgs_and_replicon_ids = orgs_and_replicon_ids
-        self._crossmapped_reads = set()
+        self._threads = threads
+        self._processes = processes
+        self._crossmapped_read_hashes = np.array([], dtype=np.int64)
         self.no_of_crossmapped_reads = None
-        
+
     def determine_crossmapped_reads(self):
         """Find reads that are mapped to sequences of different species.
 
-        The comparison is performed replicon wise in order to reduce
-        the memory footprint.
+        The hashes of the names of the reads aligned in each region of
+        the given replicons are collected in parallel. Each replicon
+        has a bit mask of its organism(s). The masks are combined per
+        read and reads with more than one organism bit are cross
+        mapped. Only the hashes of the cross mapped reads are kept.
+        Their names are written when the cleaned BAM file is generated.
         """
         self._check_replicon_existance()
-        done_replicon_comparison = []
-        with pysam.Samfile(self._input_bam) as bam:
-            for org, replicon_ids in self._orgs_and_replicon_ids.items():
-                for replicon_id in replicon_ids:
-                    self._read_ids = set()
-                    # First, collect the ids of the aligned reads of
-                    # this replicon
-                    for alignment in bam.fetch(reference=replicon_id):
-                        self._read_ids.add(alignment.qname)
-                    # Then compare them to the alignments of each
-                    # replicon of the other organism(s)
-                    for comp_org, comp_replicon_ids in (
-                            self._orgs_and_replicon_ids.items()):
-                        # Only compare replicons of different species
-                        if org == comp_org:
-                            continue
-                        for comp_replicon_id in comp_replicon_ids:
-                            comparison = sorted([replicon_id,
-                                                 comp_replicon_id])
-                            # Check if comparison of the two replicons
-                            # has been done already
-                            if comparison in done_replicon_comparison:
-                                continue
-                            done_replicon_comparison.append(comparison)
-                            # Compare all read ids of the comparison
-                            # replicon to the query replicon read ids
-                            for alignment in bam.fetch(
-                                    reference=comp_replicon_id):
-                                if alignment.qname in self._read_ids:
-                                    self._crossmapped_reads.add(
-                                        alignment.qname)
-        self.no_of_crossmapped_reads = len(self._crossmapped_reads)
-        # Write list of cross mapped read to file
-        with open(self._output_crossmapped_reads, "w") as output_list_fh:
-            output_list_fh.write("\n".join(self._crossmapped_reads) + "\n")
+        replicon_ids_and_org_masks = {}
+        for org_index, replicon_ids in enumerate(
+                self._orgs_and_replicon_ids.values()):
+            for replicon_id in replicon_ids:
+                replicon_ids_and_org_masks[replicon_id] = (
+                    replicon_ids_and_org_masks.get(replicon_id, 0) |
+                    (1 << org_index))
+        regions = [
+            region for region in bam_regions(
+                self._input_bam, self._processes)
+            if region[0] in replicon_ids_and_org_masks]
+        read_hashes = [np.array([], dtype=np.int64)]
+        org_masks = [np.array([], dtype=np.uint64)]
+        for region, region_read_hashes in zip(regions, self._map(
+                _region_read_hashes,
+                [(self._input_bam, region) for region in regions])):
+            read_hashes.append(region_read_hashes)
+            org_masks.append(np.full(
+                len(region_read_hashes),
+                replicon_ids_and_org_masks[region[0]], dtype=np.uint64))
+        self._crossmapped_read_hashes = self._crossmapped_hashes(
+            np.concatenate(read_hashes), np.concatenate(org_masks))
+        self.no_of_crossmapped_reads = len(self._crossmapped_read_hashes)
+
+    def _crossmapped_hashes(self, read_hashes, org_masks):
+        if len(read_hashes) == 0:
+            return np.array([], dtype=np.int64)
+        order = np.argsort(read_hashes, kind="stable")
+        read_hashes = read_hashes[order]
+        org_masks = org_masks[order]
+        read_starts = np.flatnonzero(np.concatenate(
+            ([True], read_hashes[1:] != read_hashes[:-1])))
+        read_org_masks = np.bitwise_or.reduceat(org_masks, read_starts)
+        # A mask with more than one bit set has a lowest bit that is
+        # not the only one
+        crossmapped = (read_org_masks & (read_org_masks - np.uint64(1))) != 0
+        return read_hashes[read_starts[crossmapped]]
 
     def _check_replicon_existance(self):
         found_all = True
@@ -67,17 +89,92 @@ class CrossAlignFilter(object):
                         found_all = False
         if not found_all:
             raise RepliconIdNotInBam
-        
+
     def write_crossmapping_free_bam(self):
-        with pysam.Samfile(self._input_bam) as input_bam:
-            with pysam.Samfile(self._output_bam, "wb",
-                               header=input_bam.header) as output_bam:
-                for alignment in input_bam.fetch():
-                    if not alignment.qname in self._crossmapped_reads:
-                        output_bam.write(alignment)
+        """Write the alignments of reads that are not cross mapped and
+        the names of the cross mapped reads.
+
+        Each region is written to its own BAM file in parallel. As the
+        regions follow the order of the sorted input the region files
+        are concatenated to the sorted output BAM file.
+        """
+        regions = bam_regions(self._input_bam, self._processes)
+        shard_paths = ["%s.shard_%s" % (self._output_bam, region_index)
+                       for region_index in range(len(regions))]
+        shard_threads = max(1, self._threads // self._processes)
+        crossmapped_reads = {}
+        for region_crossmapped_reads in self._map(
+                _write_region_without_crossmapped_reads,
+                [(self._input_bam, shard_path, region, shard_threads)
+                 for shard_path, region in zip(shard_paths, regions)],
+                initializer=_set_crossmapped_read_hashes,
+                initargs=(self._crossmapped_read_hashes,)):
+            # Dictionary keys keep the order of the first occurrence
+            crossmapped_reads.update(
+                dict.fromkeys(region_crossmapped_reads))
+        if shard_paths:
+            # The compressed blocks are copied without recompression
+            try:
+                pysam.cat("-o", self._output_bam, *shard_paths)
+            finally:
+                for shard_path in shard_paths:
+                    os.remove(shard_path)
+        else:
+            with pysam.AlignmentFile(self._input_bam) as input_bam:
+                pysam.AlignmentFile(
+                    self._output_bam, "wb", header=input_bam.header).close()
         pysam.index(self._output_bam)
+        # Write list of cross mapped read to file
+        with open(self._output_crossmapped_reads, "w") as output_list_fh:
+            output_list_fh.write("\n".join(crossmapped_reads) + "\n")
+
+    def _map(self, function, args_list, initializer=None, initargs=()):
+        """Call the function with each of the arguments and return the
+        results in the same order.
+        """
+        if self._processes == 1:
+            if initializer is not None:
+                initializer(*initargs)
+            return [function(*args) for args in args_list]
+        # Forked processes share the seed of the string hashes with
+        # this process, so the read name hashes of all processes match
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._processes,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=initializer, initargs=initargs) as executor:
+            jobs = [executor.submit(function, *args) for args in args_list]
+        return [job.result() for job in jobs]
+
+
+def _region_read_hashes(bam_path, region):
+    with pysam.AlignmentFile(bam_path) as bam:
+        return np.unique(np.fromiter(
+            (hash(alignment.query_name)
+             for alignment in region_alignments(bam, region)),
+            dtype=np.int64))
+
+
+def _set_crossmapped_read_hashes(crossmapped_read_hashes):
+    global _crossmapped_read_hashes
+    _crossmapped_read_hashes = set(crossmapped_read_hashes.tolist())
+
+
+def _write_region_without_crossmapped_reads(
+        input_bam_path, output_bam_path, region, threads):
+    crossmapped_read_hashes = _crossmapped_read_hashes
+    crossmapped_reads = {}
+    with pysam.AlignmentFile(input_bam_path) as input_bam:
+        with pysam.AlignmentFile(
+                output_bam_path, "wb", header=input_bam.header,
+                threads=threads) as output_bam:
+            for alignment in region_alignments(input_bam, region):
+                read_name = alignment.query_name
+                if hash(read_name) in crossmapped_read_hashes:
+                    crossmapped_reads[read_name] = None
+                else:
+                    output_bam.write(alignment)
+    return list(crossmapped_reads)
 
 
 class RepliconIdNotInBam(BaseException):
     pass
-
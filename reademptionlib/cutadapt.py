@@ -2,13 +2,16 @@ from subprocess import call
 
 
 class Cutadapt(object):
-    def __init__(self, cutadapt_options, cutadapt_bin="cutadapt"):
+    def __init__(self, cutadapt_options, cutadapt_bin="cutadapt",
+                 compression_suffix=".gz"):
         self._cutadapt_bin = cutadapt_bin
         self._cutadapt_options = cutadapt_options
+        # cutadapt chooses the output compression based on the suffix
+        self._compression_suffix = compression_suffix
 
     def run_cutadapt_se(self, read_path, processed_read_path, lib_name):
-        output_path = "%s/%s_processed.fa.gz" % (
-            processed_read_path, lib_name)
+        output_path = "%s/%s_processed.fa%s" % (
+            processed_read_path, lib_name, self._compression_suffix)
         cutadapt_call = [
             self._cutadapt_bin, "-o", output_path, read_path,
             str(self._cutadapt_options)[2:-2]]
@@ -16,10 +19,10 @@ class Cutadapt(object):
 
     def run_cutadapt_pe(
             self, read_path_pair, processed_read_path, lib_name):
-        output_path_p1 = "%s/%s_p1_processed.fa.gz" % (
-            processed_read_path, lib_name)
-        output_path_p2 = "%s/%s_p2_processed.fa.gz" % (
-            processed_read_path, lib_name)
+        output_path_p1 = "%s/%s_p1_processed.fa%s" % (
+            processed_read_path, lib_name, self._compression_suffix)
+        output_path_p2 = "%s/%s_p2_processed.fa%s" % (
+            processed_read_path, lib_name, self._compression_suffix)
         cutadapt_call = [self._cutadapt_bin, "-o", output_path_p1, "-p",
                          output_path_p2, read_path_pair[0], read_path_pair[1],
                          str(self._cutadapt_options)[2:-2]]
@@ -0,0 +1,133 @@
+class FastxParser(object):
+    """A byte-level parser for FASTA and FASTQ files.
+
+    The input is read in large blocks that are cut at record
+    boundaries and then split into records. This avoids the
+    per-record object creation of Bio.SeqIO. FASTQ entries are
+    expected to consist of exactly four lines. Entries that do not
+    raise a FastqFormatError naming the file.
+    """
+
+    def __init__(self, chunk_size=4194304, fastx_path=None):
+        self._chunk_size = chunk_size
+        self.fastq = None
+        # Used in error messages. It is taken from the file handle if
+        # not given.
+        self.fastx_path = fastx_path
+
+    def entries(self, fastx_fh):
+        """Return (header, sequence, qualities) of each entry.
+
+        Header and sequence are strings, the qualities are the raw
+        (Phred+33 encoded) bytes of the quality line or None for FASTA
+        entries. The file handle must be opened in binary mode.
+        """
+        for chunk in self.chunks(fastx_fh):
+            for entry in self.entries_of_chunk(chunk):
+                yield entry
+
+    def chunks(self, fastx_fh):
+        """Return blocks of bytes that contain only complete entries."""
+        if self.fastx_path is None:
+            self.fastx_path = getattr(fastx_fh, "name", None)
+        rest = b""
+        while True:
+            block = fastx_fh.read(self._chunk_size)
+            if not block:
+                break
+            block = rest + block
+            if b"\r" in block:
+                block = block.replace(b"\r", b"")
+            if self.fastq is None:
+                self._detect_format(block)
+            cut_pos = self._end_of_last_complete_entry(block)
+            yield_block = block[:cut_pos]
+            rest = block[cut_pos:]
+            if yield_block.strip():
+                yield yield_block
+        if rest.strip():
+            if self.fastq is None:
+                self._detect_format(rest)
+            yield rest
+
+    def entries_of_chunk(self, chunk):
+        """Split a block of complete entries into single entries."""
+        if self.fastq:
+            return self._fastq_entries_of_chunk(chunk)
+        return self._fasta_entries_of_chunk(chunk)
+
+    def _fastq_entries_of_chunk(self, chunk):
+        lines = chunk.strip().split(b"\n")
+        self._check_fastq_lines(lines)
+        line_iter = iter(lines)
+        for header, seq, _, qualities in zip(
+                line_iter, line_iter, line_iter, line_iter):
+            yield(header[1:].decode().rstrip(), seq.decode(), qualities)
+
+    def _check_fastq_lines(self, lines):
+        """Test that the lines form entries of four lines each.
+
+        As the chunks are cut by counting lines, a blank line or an
+        entry spanning more lines would shift all following entries.
+        """
+        headers = lines[0::4]
+        separators = lines[2::4]
+        # Joining the lines is faster than testing each line
+        if (len(lines) % 4 == 0 and
+                (b"\n" + b"\n".join(headers)).count(b"\n@") ==
+                len(headers) and
+                (b"\n" + b"\n".join(separators)).count(b"\n+") ==
+                len(separators)):
+            return
+        for entry_start in range(0, len(lines), 4):
+            entry_lines = lines[entry_start:entry_start + 4]
+            if not (len(entry_lines) == 4 and
+                    entry_lines[0][:1] == b"@" and
+                    entry_lines[2][:1] == b"+"):
+                raise FastqFormatError(
+                    "Malformed FASTQ entry in \"%s\" starting with the "
+                    "line \"%s\". Each entry has to consist of four lines: "
+                    "a header starting with \"@\", the sequence, a line "
+                    "starting with \"+\" and the qualities." % (
+                        self.fastx_path, entry_lines[0].decode(
+                            errors="replace")))
+
+    def _fasta_entries_of_chunk(self, chunk):
+        # The first character of a stripped chunk is the ">" of the
+        # first header
+        for entry in chunk.strip()[1:].split(b"\n>"):
+            header, _, seq = entry.partition(b"\n")
+            yield(header.decode().rstrip(),
+                  seq.replace(b"\n", b"").decode(), None)
+
+    def _detect_format(self, block):
+        first_char = block.lstrip()[:1]
+        if first_char == b"@":
+            self.fastq = True
+        elif first_char == b">":
+            self.fastq = False
+
+    def _end_of_last_complete_entry(self, block):
+        """Return the position after the last complete entry.
+
+        As the block might end in the middle of an entry everything
+        after the returned position has to be carried over to the next
+        block.
+        """
+        if self.fastq:
+            # A FASTQ entry always spans four lines. A quality line
+            # can start with an "@" so the lines have to be counted.
+            pos = len(block)
+            for _ in range(block.count(b"\n") % 4 + 1):
+                pos = block.rfind(b"\n", 0, pos)
+                if pos == -1:
+                    return 0
+            return pos + 1
+        pos = block.rfind(b"\n>")
+        if pos == -1:
+            return 0
+        return pos + 1
+
+
+class FastqFormatError(Exception):
+    pass
@@ -1,5 +1,6 @@
 import csv
 from reademptionlib.gff3 import Gff3Parser
+from reademptionlib.readcollapser import read_multiplicity
 import pysam
 
 
@@ -8,12 +9,14 @@ class GeneWiseQuantification(object):
     def __init__(self, min_overlap=1, read_region="global", clip_length=11,
                  norm_by_alignment_freq=True, norm_by_overlap_freq=True,
                  allowed_features_str=None, skip_antisense=False,
-                 unique_only=False):
+                 unique_only=False, collapsed_reads=False):
         """
         - normalize_by_alignment: consider that some reads are aligned at
           more than one location and only count fractions
         - normalize_by_overlapping_genes: consider that some alignment
           overlap with more than on gene
+        - collapsed_reads: each alignment counts as many times as
+          the multiplicity stored in the read name
 
         """
         self._min_overlap = min_overlap
@@ -24,6 +27,7 @@ class GeneWiseQuantification(object):
         self._allowed_features = _allowed_features(allowed_features_str)
         self._skip_antisense = skip_antisense
         self._unique_only = unique_only
+        self._collapsed_reads = collapsed_reads
 
     def calc_overlaps_per_alignment(self, read_alignment_path,
                                     annotation_paths):
@@ -54,8 +58,7 @@ class GeneWiseQuantification(object):
         sam = pysam.Samfile(read_alignment_path)
         gff3_parser = Gff3Parser()
         output_fh = open(output_path, "w")
-        output_fh.write("#" + "\t".join(_gff_field_descriptions()
-                                        + ["sense", "antisense"]) + "\n")
+        self._write_header(output_fh)
         for entry in gff3_parser.entries(open(annotation_path)):
             if _entry_to_use(entry, self._allowed_features) is False:
                 continue
@@ -67,12 +70,32 @@ class GeneWiseQuantification(object):
                 sum_antisense = 1
             for alignment in self._overlapping_alignments(sam, entry):
                 fraction = fraction_calc_method(alignment)
+                if self._collapsed_reads:
+                    fraction *= read_multiplicity(alignment.query_name)
                 if self._same_strand(entry, alignment):
                     sum_sense += fraction
                 else:
                     sum_antisense += fraction
-            output_fh.write(str(entry) + "\t" + str(sum_sense) + "\t" +
-                            str(sum_antisense) + "\n")
+            self._write_countings(output_fh, entry, sum_sense, sum_antisense)
+        output_fh.close()
+
+    def write_countings(self, output_path, entries_and_countings):
+        """Write the sense and anti-sense countings of the annotation
+        entries like quantify does.
+        """
+        with open(output_path, "w") as output_fh:
+            self._write_header(output_fh)
+            for entry, (sum_sense, sum_antisense) in entries_and_countings:
+                self._write_countings(
+                    output_fh, entry, sum_sense, sum_antisense)
+
+    def _write_header(self, output_fh):
+        output_fh.write("#" + "\t".join(_gff_field_descriptions()
+                                        + ["sense", "antisense"]) + "\n")
+
+    def _write_countings(self, output_fh, entry, sum_sense, sum_antisense):
+        output_fh.write(str(entry) + "\t" + str(sum_sense) + "\t" +
+                        str(sum_antisense) + "\n")
 
     def _same_strand(self, entry, alignment):
         assert entry.strand in ["+", "-"]
@@ -128,40 +151,45 @@ class GeneWiseQuantification(object):
         # this correctly (checked in IGB, IGV and the unit testings).
         for alignment in sam.fetch(
                 reference=entry.seq_id, start=entry.start-1, end=entry.end):
-            # 1-based alignment coordinates
-            start = alignment.pos+1
-            end = alignment.aend
-            if self._read_region == "first_base_only":
-                if (alignment.is_reverse is False) and (
-                   (start < entry.start) or (start > entry.end)):
-                        continue
-                if (alignment.is_reverse is True) and (
-                   (end < entry.start) or (end > entry.end)):
-                        continue
-            elif self._read_region == "last_base_only":
-                if (alignment.is_reverse is False) and (
-                   (end < entry.start) or (end > entry.end)):
-                        continue
-                if (alignment.is_reverse is True) and (
-                   (start < entry.start) or (start > entry.end)):
-                        continue
-            elif self._read_region == "centered":
-                if _get_overlap(start + self._clip_length,
-                                end - self._clip_length,
-                                entry.start,
-                                entry.end) < self._min_overlap:
-                    continue
-            else:
-                if alignment.get_overlap(entry.start-1,
-                                         entry.end) < self._min_overlap:
-                    continue
-            if self._skip_antisense:
-                if not self._same_strand(entry, alignment):
-                    continue
-            if self._unique_only:
-                if dict(alignment.tags)["NH"] != 1:
-                    continue
-            yield(alignment)
+            if self._alignment_overlaps(alignment, entry):
+                yield(alignment)
+
+    def _alignment_overlaps(self, alignment, entry):
+        """Test if a fetched alignment is counted for the entry."""
+        # 1-based alignment coordinates
+        start = alignment.pos+1
+        end = alignment.aend
+        if self._read_region == "first_base_only":
+            if (alignment.is_reverse is False) and (
+               (start < entry.start) or (start > entry.end)):
+                    return False
+            if (alignment.is_reverse is True) and (
+               (end < entry.start) or (end > entry.end)):
+                    return False
+        elif self._read_region == "last_base_only":
+            if (alignment.is_reverse is False) and (
+               (end < entry.start) or (end > entry.end)):
+                    return False
+            if (alignment.is_reverse is True) and (
+               (start < entry.start) or (start > entry.end)):
+                    return False
+        elif self._read_region == "centered":
+            if _get_overlap(start + self._clip_length,
+                            end - self._clip_length,
+                            entry.start,
+                            entry.end) < self._min_overlap:
+                return False
+        else:
+            if alignment.get_overlap(entry.start-1,
+                                     entry.end) < self._min_overlap:
+                return False
+        if self._skip_antisense:
+            if not self._same_strand(entry, alignment):
+                return False
+        if self._unique_only:
+            if dict(alignment.tags)["NH"] != 1:
+                return False
+        return True
 
     def _alignment_id(self, alignment):
         return (":".join([str(alignment.tid), alignment.qname,
@@ -173,6 +201,132 @@ class GeneWiseQuantification(object):
                 [str(val) for val in [seq_id, feature, start, end, strand]]))
 
 
+class GeneWiseQuantificationAccumulator(object):
+    """Count the alignments overlapping the annotation entries from the
+    alignments passed to it by an AlignmentPass.
+
+    The countings are the same as the ones of calc_overlaps_per_alignment
+    and quantify but each alignment is read once instead of being
+    fetched for each entry it overlaps. As the alignments are passed in
+    the order of their start only the entries they can overlap are
+    kept as candidates.
+    """
+
+    def __init__(self, gene_wise_quantification, annotation_paths,
+                 pseudocounts=False):
+        self._gene_wise_quantification = gene_wise_quantification
+        self._fraction_calc_method = (
+            gene_wise_quantification._fraction_calc_method())
+        gff3_parser = Gff3Parser()
+        self._entries = []
+        for annotation_path in annotation_paths:
+            with open(annotation_path) as annotation_fh:
+                self._entries.append([
+                    entry for entry in gff3_parser.entries(annotation_fh)
+                    if _entry_to_use(
+                        entry, gene_wise_quantification._allowed_features)])
+        if pseudocounts is False:
+            initial_counting = 0
+        else:
+            initial_counting = 1
+        self._countings = [
+            [[initial_counting, initial_counting] for entry in entries]
+            for entries in self._entries]
+        # The regions that are fetched for the entries (0-based and
+        # half-open) sorted by their start
+        self._ref_seqs_and_entry_regions = {}
+        for annotation_index, entries in enumerate(self._entries):
+            for entry_index, entry in enumerate(entries):
+                self._ref_seqs_and_entry_regions.setdefault(
+                    entry.seq_id, []).append(
+                        (entry.start-1, entry.end, annotation_index,
+                         entry_index))
+        for entry_regions in self._ref_seqs_and_entry_regions.values():
+            entry_regions.sort()
+
+    def start_reference(self, ref_seq, length):
+        self._entry_regions = self._ref_seqs_and_entry_regions.get(
+            ref_seq, [])
+        self._next_entry_region_index = 0
+        self._candidate_entry_regions = []
+        self._alignment_start = None
+        # Alignments with the same start and the entries they overlap
+        self._alignments_and_overlaps = []
+
+    def add_alignments(self, alignments):
+        alignment_overlaps = self._gene_wise_quantification._alignment_overlaps
+        entry_regions = self._entry_regions
+        for alignment in alignments:
+            start = alignment.reference_start
+            if start != self._alignment_start:
+                self._count_alignments()
+                self._alignment_start = start
+                # Entries ending before the start cannot overlap this
+                # or any following alignment
+                self._candidate_entry_regions = [
+                    entry_region
+                    for entry_region in self._candidate_entry_regions
+                    if entry_region[1] > start]
+            end = alignment.reference_end
+            if end is None:
+                # Like the fetching of alignments without CIGAR string
+                end = start + 1
+            while (self._next_entry_region_index < len(entry_regions) and
+                   entry_regions[self._next_entry_region_index][0] < end):
+                self._candidate_entry_regions.append(
+                    entry_regions[self._next_entry_region_index])
+                self._next_entry_region_index += 1
+            self._alignments_and_overlaps.append((alignment, [
+                (annotation_index, entry_index)
+                for (region_start, region_end, annotation_index,
+                     entry_index) in self._candidate_entry_regions
+                if region_start < end and region_end > start and
+                alignment_overlaps(
+                    alignment, self._entries[annotation_index][entry_index])
+            ]))
+
+    def finish_reference(self, ref_seq):
+        self._count_alignments()
+
+    def write_countings(self, output_paths):
+        """Write the countings of each annotation file like quantify."""
+        for output_path, entries, countings in zip(
+                output_paths, self._entries, self._countings):
+            self._gene_wise_quantification.write_countings(
+                output_path, zip(entries, countings))
+
+    def _count_alignments(self):
+        """Add the alignments with the same start to the countings of
+        the entries they overlap.
+
+        Alignments with the same alignment id have the same start, so
+        their numbers of overlaps are complete.
+        """
+        gene_wise_quantification = self._gene_wise_quantification
+        alignments_and_no_of_overlaps = {}
+        for alignment, overlaps in self._alignments_and_overlaps:
+            if overlaps:
+                alignment_id = gene_wise_quantification._alignment_id(
+                    alignment)
+                alignments_and_no_of_overlaps[alignment_id] = (
+                    alignments_and_no_of_overlaps.get(alignment_id, 0) +
+                    len(overlaps))
+        gene_wise_quantification.alignments_and_no_of_overlaps = (
+            alignments_and_no_of_overlaps)
+        for alignment, overlaps in self._alignments_and_overlaps:
+            for annotation_index, entry_index in overlaps:
+                entry = self._entries[annotation_index][entry_index]
+                fraction = self._fraction_calc_method(alignment)
+                if gene_wise_quantification._collapsed_reads:
+                    fraction *= read_multiplicity(alignment.query_name)
+                countings = self._countings[annotation_index][entry_index]
+                if gene_wise_quantification._same_strand(entry, alignment):
+                    countings[0] += fraction
+                else:
+                    countings[1] += fraction
+        self._alignments_and_overlaps = []
+
+
 class GeneWiseOverview(object):
 
     def __init__(self, allowed_features_str=None, skip_antisense=False,
@@ -219,6 +373,7 @@ class GeneWiseOverview(object):
             self._add_to_overview_strand_unspecific(
                 path_and_name_combos, "sense_and_antisense", 9, 10,
                 output_fh, normalization, libs_and_tnoar)
+        output_fh.close()
 
     def _add_to_overview(
             self, path_and_name_combos, direction, column, output_fh,
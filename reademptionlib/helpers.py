@@ -1,14 +1,24 @@
 import concurrent.futures
 import os
 import sys
+from reademptionlib.manifest import Manifest
 from reademptionlib.paths import Paths
+from reademptionlib.rawstatdata import RawStatDataReader
 
 
 class Helpers(object):
 
+    # Arguments that change how a step is run but not its results
+    _run_time_args = [
+        "project_path", "processes", "check_for_existing_files", "progress",
+        "per_lib_scheduling", "max_memory", "concurrent_alignments",
+        "stream_processed_reads", "stream_alignments",
+        "stream_realigner_input", "star_shared_genome", "index_cache"]
+
     def __init__(self, args):
         self._paths = Paths(args)
         self._args = args
+        self._manifest = Manifest(self._paths.manifest_path)
 
     def test_folder_existance(self, task_specific_folders):
         """Test the existance of required folders."""
@@ -19,17 +29,46 @@ class Helpers(object):
                     "Error! Folder '%s' does not exist! Is the given project "
                     "folder name correct?\n" % folder)
         
-    def file_needs_to_be_created(self, file_path, quiet=False):
-        """Test if a file exists of need to be created."""
+    def step_parameters(self, argument_names=None,
+                        **additional_parameters):
+        """Return the arguments that can change the results of a step
+        together with the given additional parameters.
+
+        Steps that are run by several subcommands give the names of the
+        arguments they use, so their parameters do not depend on the
+        subcommand. Otherwise all arguments of the subcommand are used.
+        """
+        parameters = dict(
+            (name, value) for name, value in vars(self._args).items()
+            if name not in self._run_time_args and not callable(value) and
+            (argument_names is None or name in argument_names))
+        parameters.update(additional_parameters)
+        return parameters
+
+    def step_is_up_to_date(self, step, input_paths, parameters):
+        """Test if a step of a previous run can be kept.
+
+        Steps are only kept if requested and if their inputs and
+        parameters are unchanged and their outputs are complete and
+        unchanged.
+        """
         if not self._args.check_for_existing_files:
-            return True
-        if os.path.exists(file_path):
-            if not quiet:
-                sys.stderr.write(
-                    "File %s exists. Skipping its generation.\n" % file_path)
             return False
+        if not self._manifest.is_up_to_date(step, input_paths, parameters):
+            return False
+        sys.stderr.write("Step %s is up to date. Skipping it.\n" % step)
         return True
 
+    def record_step(self, step, input_paths, parameters, output_paths,
+                    result=None):
+        """Record a step after its outputs were written."""
+        self._manifest.record(
+            step, input_paths, parameters, output_paths, result=result)
+
+    def step_result(self, step):
+        """Return the result recorded for a step."""
+        return self._manifest.result(step)
+
     def check_job_completeness(self, jobs):
         """Check the completness of each job in a list"""
         for job in concurrent.futures.as_completed(jobs):
@@ -46,5 +85,21 @@ class Helpers(object):
         if len(lib_names) * 2 == len(self._paths.get_read_files()):
             return True
         return False
-        
+
+    def were_reads_collapsed(self, lib_names):
+        """Check for each library if identical reads were collapsed
+        before the alignment
+
+        The read processing statistics of collapsed libraries contain
+        the number of unique reads. Return a dictionary of the library
+        names and the result.
+        """
+        read_processing_stats = {}
+        if os.path.exists(self._paths.read_processing_stats_path):
+            read_processing_stats = RawStatDataReader().read(
+                self._paths.read_processing_stats_path)
+        return dict(
+            (lib_name,
+             "no_of_unique_reads" in read_processing_stats.get(lib_name, {}))
+            for lib_name in lib_names)
 
@@ -0,0 +1,89 @@
+import fcntl
+import hashlib
+import os
+import shutil
+
+
+class IndexCache(object):
+    """Store aligner indices in a folder that can be shared by projects.
+
+    Each index is stored in a subfolder named after a hash of the
+    aligner, the index parameters and the content of the reference
+    sequence files. An index is built into a temporary folder while a
+    lock for its hash is held and renamed when it is complete, so
+    projects running at the same time build each index only once and
+    never use an incomplete one. An index is only stored if the build
+    succeeded and wrote the main files of the aligner's index.
+    """
+
+    # Files that each index of an aligner consists of
+    _aligners_and_index_files = {
+        "segemehl": ["index.idx"], "STAR": ["Genome", "SA", "SAindex"]}
+
+    def __init__(self, cache_folder):
+        self._cache_folder = cache_folder
+
+    def index_folder(self, aligner, ref_seq_paths, parameters,
+                     build_function):
+        """Return the folder of the index and build it if needed.
+
+        The build function is called with the folder the index has to
+        be written to.
+        """
+        index_key = self.index_key(aligner, ref_seq_paths, parameters)
+        index_folder = "%s/%s" % (self._cache_folder, index_key)
+        if os.path.exists(index_folder):
+            return index_folder
+        os.makedirs(self._cache_folder, exist_ok=True)
+        with open("%s.lock" % index_folder, "w") as lock_fh:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            try:
+                # Another project might have built the index while
+                # this one was waiting for the lock
+                if not os.path.exists(index_folder):
+                    self._build_index(aligner, index_folder, build_function)
+            finally:
+                fcntl.flock(lock_fh, fcntl.LOCK_UN)
+        return index_folder
+
+    def index_key(self, aligner, ref_seq_paths, parameters):
+        """Return the hash of the aligner, the parameters and the
+        content of the reference sequence files.
+        """
+        index_hash = hashlib.sha256()
+        index_hash.update(("%s\n%r\n" % (aligner, parameters)).encode())
+        for ref_seq_path in ref_seq_paths:
+            with open(ref_seq_path, "rb") as ref_seq_fh:
+                for block in iter(lambda: ref_seq_fh.read(1048576), b""):
+                    index_hash.update(block)
+            # Mark the end of a file so that differently split
+            # references result in different hashes
+            index_hash.update(b"\0")
+        return "%s_%s" % (aligner, index_hash.hexdigest())
+
+    def _build_index(self, aligner, index_folder, build_function):
+        tmp_index_folder = "%s.tmp" % index_folder
+        if os.path.exists(tmp_index_folder):
+            # Left over by an interrupted build
+            shutil.rmtree(tmp_index_folder)
+        os.makedirs(tmp_index_folder)
+        try:
+            build_function(tmp_index_folder)
+            self._check_index_files(aligner, tmp_index_folder)
+        except BaseException:
+            shutil.rmtree(tmp_index_folder)
+            raise
+        os.rename(tmp_index_folder, index_folder)
+
+    def _check_index_files(self, aligner, index_folder):
+        for index_file in self._aligners_and_index_files.get(aligner, []):
+            index_path = "%s/%s" % (index_folder, index_file)
+            if not (os.path.isfile(index_path) and
+                    os.path.getsize(index_path) > 0):
+                raise IncompleteIndex(
+                    "The %s index is missing the file \"%s\"." % (
+                        aligner, index_file))
+
+
+class IncompleteIndex(BaseException):
+    pass
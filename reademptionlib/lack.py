@@ -1,4 +1,4 @@
-from subprocess import call
+from subprocess import check_call
 import os
 
 
@@ -29,6 +29,6 @@ class Lack(object):
         # Discard standard error output
         if self._show_progress is False:
             with open(os.devnull, "w") as devnull:
-                call(lack_call, stderr=devnull)
+                check_call(lack_call, stderr=devnull)
         else:
-            call(lack_call)
+            check_call(lack_call)
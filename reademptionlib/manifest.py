@@ -0,0 +1,136 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+
+
+class Manifest(object):
+    """Record the fingerprints of the inputs, parameters and outputs of
+    the steps run in a project.
+
+    A step (e.g. the alignment of one library) is up to date if its
+    input files and parameters are the same as when it was recorded
+    and its output files are unchanged since then. Steps are recorded
+    after all their outputs are written, so the outputs of interrupted
+    steps are never up to date. The SHA-256 hash of a file is only
+    recalculated if its size or modification time changed. Several
+    processes can record steps at the same time.
+    """
+
+    def __init__(self, manifest_path):
+        self._manifest_path = manifest_path
+        self._base_folder = os.path.dirname(os.path.abspath(manifest_path))
+
+    def is_up_to_date(self, step, input_paths, parameters):
+        """Test if the step was recorded with the same inputs and
+        parameters and if its outputs are unchanged.
+        """
+        manifest = self._read()
+        step_entry = manifest["steps"].get(step)
+        if step_entry is None:
+            return False
+        if step_entry["parameters"] != self._normalized(parameters):
+            return False
+        file_hashes = manifest["files"]
+        if step_entry["inputs"] != self._file_hashes(
+                input_paths, file_hashes):
+            return False
+        output_paths = [
+            self._absolute_path(output_path)
+            for output_path in step_entry["outputs"]]
+        return step_entry["outputs"] == self._file_hashes(
+            output_paths, file_hashes)
+
+    def result(self, step):
+        """Return the result recorded for the step or None."""
+        step_entry = self._read()["steps"].get(step)
+        if step_entry is None:
+            return None
+        return step_entry["result"]
+
+    def record(self, step, input_paths, parameters, output_paths,
+               result=None):
+        """Record the step after all its outputs were written.
+
+        The result has to be serializable as JSON.
+        """
+        file_hashes = self._read()["files"]
+        step_entry = {
+            "inputs": self._file_hashes(input_paths, file_hashes),
+            "parameters": self._normalized(parameters),
+            "outputs": self._file_hashes(output_paths, file_hashes),
+            "result": self._normalized(result)}
+        os.makedirs(self._base_folder, exist_ok=True)
+        with open("%s.lock" % self._manifest_path, "w") as lock_fh:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            try:
+                # Other processes might have recorded steps since the
+                # manifest was read
+                manifest = self._read()
+                manifest["steps"][step] = step_entry
+                manifest["files"].update(file_hashes)
+                with atomic_output_path(self._manifest_path) as tmp_path:
+                    with open(tmp_path, "w") as manifest_fh:
+                        json.dump(manifest, manifest_fh, indent=4,
+                                  sort_keys=True)
+            finally:
+                fcntl.flock(lock_fh, fcntl.LOCK_UN)
+
+    def _read(self):
+        if not os.path.exists(self._manifest_path):
+            return {"steps": {}, "files": {}}
+        with open(self._manifest_path) as manifest_fh:
+            return json.load(manifest_fh)
+
+    def _normalized(self, value):
+        # Tuples become lists like after reading the manifest
+        return json.loads(json.dumps(value, sort_keys=True))
+
+    def _file_hashes(self, file_paths, file_hashes):
+        """Return the hashes of the files by their path relative to the
+        manifest.
+
+        Missing files have no hash. The file hashes given are reused
+        and updated.
+        """
+        hashes = {}
+        for file_path in file_paths:
+            relative_path = os.path.relpath(file_path, self._base_folder)
+            if not os.path.isfile(file_path):
+                hashes[relative_path] = None
+                continue
+            file_stat = os.stat(file_path)
+            fingerprint = [file_stat.st_size, file_stat.st_mtime_ns]
+            if file_hashes.get(relative_path, [None])[:2] != fingerprint:
+                file_hashes[relative_path] = fingerprint + [
+                    self._file_hash(file_path)]
+            hashes[relative_path] = file_hashes[relative_path][2]
+        return hashes
+
+    def _file_hash(self, file_path):
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as file_fh:
+            for block in iter(lambda: file_fh.read(1048576), b""):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    def _absolute_path(self, relative_path):
+        return os.path.join(self._base_folder, relative_path)
+
+
+@contextlib.contextmanager
+def atomic_output_path(output_path):
+    """Return a temporary path next to the output path that is renamed
+    to the output path if no error occurs.
+
+    So the output file is either complete or not changed at all.
+    """
+    tmp_path = "%s.tmp" % output_path
+    try:
+        yield tmp_path
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
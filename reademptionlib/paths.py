@@ -14,6 +14,7 @@ class Paths(object):
         """Set the name of folders used in a project."""
         self.input_folder = "%s/input" % (self.base_path)
         self.output_folder = "%s/output" % (self.base_path)
+        self.subsamples_folder = "%s/subsamples" % (self.base_path)
         self._set_input_folder_names()
         self._set_read_alignment_folder_names()
         self._set_coverage_folder_names()
@@ -97,6 +98,7 @@ class Paths(object):
 
     def _set_static_files(self):
         """Set name of common files."""
+        self.manifest_path = "%s/manifest.json" % self.base_path
         self.read_processing_stats_path = "%s/read_processing.json" % (
             self.raw_stat_data_folder)
         self.primary_read_aligner_stats_path = (
@@ -106,6 +108,8 @@ class Paths(object):
             self.raw_stat_data_folder)
         self.read_alignments_stats_path = "%s/read_alignments_final.json" % (
             self.raw_stat_data_folder)
+        self.alignment_runtimes_path = "%s/alignment_runtimes.json" % (
+            self.raw_stat_data_folder)
         self.read_file_stats = "%s/input_read_stats.txt" % (
             self.align_report_folder)
         self.ref_seq_file_stats = "%s/reference_sequences_stats.txt" % (
@@ -245,11 +249,15 @@ class Paths(object):
     def required_viz_deseq_folders(self):
         return [self.viz_deseq_base_folder]
 
-    def set_read_files_dep_file_lists_single_end(self, read_files, lib_names):
+    def set_read_files_dep_file_lists_single_end(
+            self, read_files, lib_names, compression_suffix=".gz"):
         self.read_paths = self._path_list(self.read_fasta_folder, read_files)
         self.processed_read_paths = self._path_list(
             self.processed_reads_folder, lib_names,
-            appendix="_processed.fa.gz")
+            appendix="_processed.fa" + compression_suffix)
+        self.processed_read_fifo_paths = self._path_list(
+            self.processed_reads_folder, lib_names,
+            appendix="_processed_stream.fa")
         self.unaligned_reads_paths = self._path_list(
             self.unaligned_reads_folder, lib_names,
             appendix="_unaligned.fa")
@@ -259,7 +267,7 @@ class Paths(object):
         self._set_alignment_paths(lib_names)
 
     def set_read_files_dep_file_lists_paired_end(
-            self, read_file_pairs, lib_names):
+            self, read_file_pairs, lib_names, compression_suffix=".gz"):
         self.read_path_pairs = [
             self._path_list(self.read_fasta_folder, read_file_pair)
             for read_file_pair in read_file_pairs]
@@ -267,7 +275,15 @@ class Paths(object):
             self._path_list(
                 self.processed_reads_folder,
                 [self._clean_file_name(read_file)
-                 for read_file in read_file_pair], appendix="_processed.fa.gz")
+                 for read_file in read_file_pair],
+                appendix="_processed.fa" + compression_suffix)
+            for read_file_pair in read_file_pairs]
+        self.processed_read_fifo_path_pairs = [
+            self._path_list(
+                self.processed_reads_folder,
+                [self._clean_file_name(read_file)
+                 for read_file in read_file_pair],
+                appendix="_processed_stream.fa")
             for read_file_pair in read_file_pairs]
         # The read of both files that are not matchend will be dumped
         # together into on file. Due to this there is only one file
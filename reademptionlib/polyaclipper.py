@@ -1,46 +1,54 @@
+import re
+
+
+def _poly_a_window_pattern(length=11):
+    """Return a regex matching an "AAAA" starting window of the given
+    length that contains at most one non-A.
+
+    The start of the first match is the clipping position.
+    """
+    tail_length = length - 4
+    alternatives = ["A" * tail_length] + [
+        "A" * pos + "[^A]" + "A" * (tail_length - pos - 1)
+        for pos in range(tail_length)]
+    return re.compile("AAAA(?:%s)" % "|".join(alternatives))
+
+
 class PolyAClipper(object):
     """Uses very simple heuristics to detect and remove polyA tails."""
 
+    _poly_a_window = _poly_a_window_pattern()
+
     def clip_poly_a_stretch(self, sequence):
         """Search for a longer block of As and clip before it.
 
         Search for a block of four As. If the seven nucleotides after
         that are at least six A clip before the block of four As.
+
+        All windows are checked in one regular expression search, so
+        the sequence is scanned only once.
         """
-        sequence = sequence.upper()
-        length = 11
-        if "AAAA" in sequence:
-            for subseq, start_pos in self._aaaa_starting_substrings(
-                    sequence, length):
-                # Tolerate one mismatch
-                if subseq.count("A") < length - 1:
-                    continue
-                else:
-                    # Use sequence only to the start of the poly-A
-                    # tail
-                    sequence = sequence[:start_pos]
-                    break
+        if not sequence.isupper():
+            sequence = sequence.upper()
+        start_pos = sequence.find("AAAA")
+        if start_pos == -1:
+            return sequence
+        match = self._poly_a_window.search(sequence, start_pos)
+        if match is not None:
+            # Use sequence only to the start of the poly-A tail
+            sequence = sequence[:match.start()]
         return sequence
 
-    def _aaaa_starting_substrings(self, sequence, length):
-        """Find all AAAA starting substring of the given length"""
-        start_pos = 0
-        while start_pos != -1:
-            start_pos = sequence.find("AAAA", start_pos)
-            if start_pos == -1:
-                break
-            if start_pos + length > len(sequence):
-                start_pos = -1
-            else:
-                cur_start_pos = start_pos
-                start_pos = start_pos + 1
-                yield([sequence[cur_start_pos:cur_start_pos+length],
-                       cur_start_pos])
+    def clip_poly_a_stretches(self, sequences):
+        """Clip poly-A stretches and 3' terminal As of a list of sequences.
+
+        This is the batch version of clip_poly_a_stretch followed by
+        remove_3_prime_a.
+        """
+        clip_poly_a_stretch = self.clip_poly_a_stretch
+        return [clip_poly_a_stretch(sequence).rstrip("A")
+                for sequence in sequences]
 
     def remove_3_prime_a(self, sequence):
         """Remove 3' terminal As"""
-        if sequence == '':
-            return sequence
-        elif sequence[-1] == "A":
-            sequence = self.remove_3_prime_a(sequence[:-1])
-        return sequence
+        return sequence.rstrip("A")
@@ -1,4 +1,5 @@
 import json
+from reademptionlib.manifest import atomic_output_path
 
 
 class RawStatDataWriter(object):
@@ -7,8 +8,9 @@ class RawStatDataWriter(object):
         self._pretty = pretty
 
     def write(self, input_object, output_path):
-        with open(output_path, "w") as output_fh:
-            self._write_json(input_object, output_fh)
+        with atomic_output_path(output_path) as tmp_path:
+            with open(tmp_path, "w") as output_fh:
+                self._write_json(input_object, output_fh)
 
     def _write_json(self, input_object, output_fh):
         if self._pretty is True:
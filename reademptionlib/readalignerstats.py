@@ -1,61 +1,398 @@
+import array
+import concurrent.futures
+import gzip
+import re
 import sys
 from collections import defaultdict
-from functools import reduce
+from reademptionlib.bamregions import bam_regions, region_alignments
 from reademptionlib.fasta import FastaParser
+from reademptionlib.readcollapser import read_multiplicity
+import numpy as np
 import pysam
 import os
 
 
 class ReadAlignerStats(object):
 
-    def __init__(self):
+    # Counters of each reference in the order of the statistics
+    _counter_names = [
+        "no_of_alignments", "no_of_aligned_reads", "no_of_split_alignments",
+        "no_of_uniquely_aligned_reads"]
+    # Number of alignments whose tags are collected before they are
+    # added to the counters
+    _chunk_size = 1048576
+    # Number of bytes of a FASTA file that are read at once
+    _block_size = 1048576
+    # Number of windows of a reference that are sampled in the quick
+    # mode. Reading a window needs a lookup in the BAM index.
+    _no_of_sampled_windows = 256
+    # Quantile of the standard normal distribution for the 95%%
+    # confidence intervals of the quick mode
+    _confidence_level = 0.95
+    _z_value = 1.959964
+
+    def __init__(self, collapsed_reads=False, processes=1, sample_size=None):
         self.fasta_parser = FastaParser()
+        # If the reads were collapsed each alignment and unaligned
+        # read counts as many times as its read name says
+        self._collapsed_reads = collapsed_reads
+        self._processes = processes
+        # If a sample size is given the statistics are estimated from
+        # a sample of about this many alignments per reference
+        self._sample_size = sample_size
 
     def count(self, read_alignment_result_bam_path, unaligned_reads_path):
         self._stats = {}
-        if unaligned_reads_path == "NA":
+        if self._sample_size is None:
             self._count_aligned_reads_and_alignments(
                 read_alignment_result_bam_path)
         else:
-            self._count_aligned_reads_and_alignments(
+            self._estimate_aligned_reads_and_alignments(
                 read_alignment_result_bam_path)
+        if unaligned_reads_path != "NA":
             self._count_unaligned_reads(unaligned_reads_path)
         return self._stats
 
     def _count_unaligned_reads(self, unaligned_read_paths):
         if os.path.isfile(unaligned_read_paths):
-            with open(unaligned_read_paths) as fasta_fh:
-                self._stats[
-                    "stats_total"][
-                        "no_of_unaligned_reads"
-                    ] = self._count_fasta_entries(fasta_fh)
+            self._stats[
+                "stats_total"][
+                    "no_of_unaligned_reads"
+                ] = self._count_fasta_entries(unaligned_read_paths)
+
+    def _count_fasta_entries(self, fasta_path):
+        """Count the entries of a (gzipped) FASTA file.
 
-    def _count_fasta_entries(self, fasta_fh):
-        return reduce(lambda x, y: x + 1,
-                      self.fasta_parser.entries(fasta_fh), 0)
+        The file is read in large blocks of bytes and only the ">" at
+        line starts are counted, so the sequences are never decoded.
+        With collapsed reads only the header lines are split up to get
+        the multiplicity of each read.
+        """
+        no_of_entries = 0
+        for block in _line_blocks(fasta_path, self._block_size):
+            if self._collapsed_reads:
+                no_of_entries += sum(
+                    read_multiplicity(header_id.decode())
+                    for header_id in _header_id_pattern.findall(block))
+            else:
+                no_of_entries += block.count(b"\n>")
+        return no_of_entries
 
     def _count_aligned_reads_and_alignments(
             self, read_alignment_result_bam_path):
-        bam = pysam.Samfile(read_alignment_result_bam_path)
+        """Count the alignments and aligned reads of each reference.
+
+        The tags of the alignments are collected in chunks that are
+        added to NumPy counters of each reference. The alignments of a
+        reference are added in the order of the BAM file, so the sums
+        are exactly the same as if each alignment was added on its own.
+
+        With several processes the references are split into regions
+        that are counted in parallel. The countings of the regions of a
+        reference are summed up, so the sums can differ in the last
+        digits.
+        """
+        with pysam.AlignmentFile(read_alignment_result_bam_path) as bam:
+            ref_ids = bam.references
+            self._init_counters(len(ref_ids))
+            if self._processes == 1:
+                for chunk in self._alignment_chunks(bam.fetch()):
+                    self._add_chunk(*chunk)
+        if self._processes > 1:
+            self._count_regions(read_alignment_result_bam_path, ref_ids)
+        self._set_stats(ref_ids)
+
+    def _set_stats(self, ref_ids):
         stats_per_ref = defaultdict(dict)
-        no_of_hits_per_read_freq = {}
-        for ref_id in bam.references:
-            self._init_counting_dict(stats_per_ref, ref_id)
-        for entry in bam.fetch():
-            ref_id = bam.get_reference_name(entry.tid)
+        for ref_index, ref_id in enumerate(ref_ids):
+            stats_per_ref[ref_id] = defaultdict(float, zip(
+                self._counter_names,
+                self._counters[:, ref_index].tolist()))
+            # The alignment lengths are kept in a defaultdict as they
+            # are not summed up for all references
+            stats_per_ref[ref_id]["alignment_length_and_freqs"] = (
+                defaultdict(int, self._alignment_length_freqs[ref_index]))
+            stats_per_ref[ref_id]["no_of_hits_per_read_and_freqs"] = (
+                self._calc_down_to_read(self._no_of_hits_freqs[ref_index]))
+        self._stats["stats_per_reference"] = stats_per_ref
+        self._stats["stats_total"] = self._sum_countings(stats_per_ref)
+
+    def _estimate_aligned_reads_and_alignments(
+            self, read_alignment_result_bam_path):
+        """Estimate the statistics of each reference from a random
+        sample of its alignments.
+
+        The numbers of mapped and unmapped alignment records are taken
+        from the BAM index. Each reference is split into windows of the
+        same length and randomly chosen windows that contain about the
+        sample size alignments on average are counted. If a reference
+        has fewer alignments than the sample size all its alignments
+        are counted.
+        As each alignment of a reference is sampled with the same
+        probability the counters are estimated as the number of mapped
+        records times the counter per sampled record. The confidence
+        intervals consider that the windows are sampled as a whole.
+        """
+        random_generator = np.random.default_rng(0)
+        confidence_intervals_per_ref = {}
+        no_of_sampled_records_per_ref = {}
+        with pysam.AlignmentFile(read_alignment_result_bam_path) as bam:
+            ref_ids = bam.references
+            ref_ids_and_index_stats = dict(
+                (index_stats.contig, index_stats)
+                for index_stats in bam.get_index_statistics())
+            no_of_unplaced_records = bam.nocoordinate
+            self._init_counters(len(ref_ids))
+            variances = np.zeros((len(self._counter_names), len(ref_ids)))
+            for ref_index, (ref_id, ref_length) in enumerate(
+                    zip(ref_ids, bam.lengths)):
+                index_stats = ref_ids_and_index_stats[ref_id]
+                (no_of_sampled_records_per_ref[ref_id],
+                 variances[:, ref_index]) = self._estimate_reference(
+                     bam, ref_index, ref_id, ref_length, index_stats.mapped,
+                     random_generator)
+        self._set_stats(ref_ids)
+        for ref_index, ref_id in enumerate(ref_ids):
+            stats = self._stats["stats_per_reference"][ref_id]
+            index_stats = ref_ids_and_index_stats[ref_id]
+            stats["no_of_mapped_records"] = index_stats.mapped
+            stats["no_of_unmapped_records"] = index_stats.unmapped
+            confidence_intervals_per_ref[ref_id] = self._confidence_intervals(
+                self._counters[:, ref_index], variances[:, ref_index])
+        stats_total = self._sum_countings(self._stats["stats_per_reference"])
+        stats_total["no_of_unmapped_records"] = stats_total.get(
+            "no_of_unmapped_records", 0) + no_of_unplaced_records
+        self._stats["stats_total"] = stats_total
+        # The references are sampled independently
+        self._stats["sampling"] = {
+            "sample_size_per_reference": self._sample_size,
+            "no_of_sampled_records": no_of_sampled_records_per_ref,
+            "confidence_level": self._confidence_level,
+            "confidence_intervals": {
+                "stats_per_reference": confidence_intervals_per_ref,
+                "stats_total": self._confidence_intervals(
+                    self._counters.sum(axis=1), variances.sum(axis=1))}}
+
+    def _estimate_reference(self, bam, ref_index, ref_id, ref_length,
+                            no_of_mapped_records, random_generator):
+        """Set the estimated counters and frequencies of a reference.
+
+        Return the number of sampled records and the variances of the
+        estimated counters.
+        """
+        no_of_counters = len(self._counter_names)
+        if no_of_mapped_records == 0 or ref_length == 0:
+            return 0, np.zeros(no_of_counters)
+        # The windows are sized to contain the sample size in total
+        no_of_windows = max(1, min(ref_length, (
+            no_of_mapped_records * self._no_of_sampled_windows //
+            max(1, self._sample_size))))
+        no_of_sampled_windows = min(
+            no_of_windows, self._no_of_sampled_windows)
+        # The windows are read in the order of the BAM file
+        sampled_windows = np.sort(random_generator.choice(
+            no_of_windows, no_of_sampled_windows, replace=False)).tolist()
+        # The counters and frequencies of the window stats are the ones
+        # of the sampled windows
+        window_stats = ReadAlignerStats(collapsed_reads=self._collapsed_reads)
+        window_stats._init_counters(no_of_sampled_windows)
+        window_indices = array.array("q")
+
+        def sampled_alignments():
+            for sampled_window_index, window_index in enumerate(
+                    sampled_windows):
+                for alignment in region_alignments(bam, (
+                        ref_id, ref_length * window_index // no_of_windows,
+                        ref_length * (window_index + 1) // no_of_windows)):
+                    window_indices.append(sampled_window_index)
+                    yield alignment
+
+        no_of_sampled_records = 0
+        for ref_indices, *fields in window_stats._alignment_chunks(
+                sampled_alignments()):
+            # The window indices of the alignments of the chunk were
+            # collected while the chunk was filled
+            window_stats._add_chunk(np.array(window_indices[
+                no_of_sampled_records:], dtype=np.int64), *fields)
+            no_of_sampled_records += len(ref_indices)
+        window_sizes = np.bincount(
+            np.array(window_indices, dtype=np.int64),
+            minlength=no_of_sampled_windows).astype(float)
+        window_counters = window_stats._counters
+        if no_of_sampled_records == 0:
+            return 0, np.zeros(no_of_counters)
+        # Ratio estimator of the counters per record
+        counters_per_record = (
+            window_counters.sum(axis=1) / no_of_sampled_records)
+        scaling_factor = no_of_mapped_records / no_of_sampled_records
+        self._counters[:, ref_index] = (
+            no_of_mapped_records * counters_per_record)
+        for freqs, window_freqs in [
+                (self._alignment_length_freqs[ref_index],
+                 window_stats._alignment_length_freqs),
+                (self._no_of_hits_freqs[ref_index],
+                 window_stats._no_of_hits_freqs)]:
+            for region_freqs in window_freqs[:no_of_sampled_windows]:
+                for value, freq in region_freqs.items():
+                    freqs[value] = freqs.get(value, 0) + freq
+            for value in freqs:
+                freqs[value] *= scaling_factor
+        if no_of_sampled_windows < 2:
+            return no_of_sampled_records, np.zeros(no_of_counters)
+        residuals = window_counters - np.outer(
+            counters_per_record, window_sizes)
+        finite_population_correction = (
+            1 - no_of_sampled_windows / no_of_windows)
+        mean_window_size = no_of_sampled_records / no_of_sampled_windows
+        variances = (
+            finite_population_correction *
+            (residuals ** 2).sum(axis=1) / (no_of_sampled_windows - 1) /
+            no_of_sampled_windows / mean_window_size ** 2 *
+            no_of_mapped_records ** 2)
+        return no_of_sampled_records, variances
+
+    def _confidence_intervals(self, estimates, variances):
+        margins = self._z_value * np.sqrt(variances)
+        return dict(
+            (counter_name, [max(0.0, estimate - margin), estimate + margin])
+            for counter_name, estimate, margin in zip(
+                self._counter_names, estimates.tolist(), margins.tolist()))
+
+    def _init_counters(self, no_of_refs):
+        self._counters = np.zeros((len(self._counter_names), no_of_refs))
+        self._alignment_length_freqs = [{} for ref_index in range(no_of_refs)]
+        self._no_of_hits_freqs = [{} for ref_index in range(no_of_refs)]
+
+    def _count_regions(self, bam_path, ref_ids):
+        """Count the regions of the BAM file in parallel and add their
+        countings to the ones of their references.
+        """
+        regions = bam_regions(bam_path, self._processes)
+        ref_ids_and_indices = dict(
+            (ref_id, ref_index) for ref_index, ref_id in enumerate(ref_ids))
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._processes) as executor:
+            jobs = [executor.submit(
+                _count_region, bam_path, region, self._collapsed_reads)
+                    for region in regions]
+            # The regions are added in the order of the BAM file, so
+            # the frequencies keep the order of the first occurrence
+            for region, job in zip(regions, jobs):
+                self._add_region_countings(
+                    ref_ids_and_indices[region[0]], *job.result())
+
+    def _region_countings(self, bam_path, region):
+        """Return the counters and the alignment length and number of
+        hits frequencies of the alignments starting in the region.
+        """
+        self._init_counters(1)
+        with pysam.AlignmentFile(bam_path) as bam:
+            for ref_indices, *fields in self._alignment_chunks(
+                    region_alignments(bam, region)):
+                # All alignments belong to the reference of the region
+                self._add_chunk(np.zeros_like(ref_indices), *fields)
+        return (self._counters[:, 0].tolist(),
+                self._alignment_length_freqs[0], self._no_of_hits_freqs[0])
+
+    def _add_region_countings(self, ref_index, counters,
+                              alignment_length_freqs, no_of_hits_freqs):
+        self._counters[:, ref_index] += counters
+        for freqs, region_freqs in [
+                (self._alignment_length_freqs[ref_index],
+                 alignment_length_freqs),
+                (self._no_of_hits_freqs[ref_index], no_of_hits_freqs)]:
+            for value, freq in region_freqs.items():
+                freqs[value] = freqs.get(value, 0) + freq
+
+    def _alignment_chunks(self, alignments):
+        """Yield the reference indices, numbers of hits, numbers of
+        splits (0 for unsplit alignments), query lengths and
+        multiplicities of chunks of alignments.
+        """
+        chunk = self._empty_chunk()
+        for entry in alignments:
+            # The append methods are only bound once per chunk as this
+            # is done for every alignment
+            if len(chunk[0]) == 0:
+                (append_ref_index, append_no_of_hits, append_no_of_splits,
+                 append_query_length, append_multiplicity) = [
+                     field.append for field in chunk]
             try:
-                self._count_alignment(
-                    entry, ref_id, stats_per_ref, no_of_hits_per_read_freq)
+                append_no_of_hits(entry.get_tag("NH"))
             except KeyError:
                 sys.stderr.write(
                     "SAM entry with unspecified reference found! Stoping\n")
                 sys.exit(2)
-        self._stats["stats_per_reference"] = stats_per_ref
-        for ref_id, stats in stats_per_ref.items():
-            stats_per_ref[ref_id][
-                "no_of_hits_per_read_and_freqs"] = self._calc_down_to_read(
-                stats_per_ref[ref_id]["no_of_hits_per_read_and_freqs"])
-        self._stats["stats_total"] = self._sum_countings(stats_per_ref)
+            append_ref_index(entry.reference_id)
+            if entry.has_tag("XL"):
+                append_no_of_splits(entry.get_tag("XL"))
+            else:
+                append_no_of_splits(0)
+            append_query_length(entry.query_length)
+            if self._collapsed_reads:
+                append_multiplicity(read_multiplicity(entry.query_name))
+            if len(chunk[0]) == self._chunk_size:
+                yield self._chunk_arrays(chunk)
+                chunk = self._empty_chunk()
+        if len(chunk[0]) > 0:
+            yield self._chunk_arrays(chunk)
+
+    def _empty_chunk(self):
+        return [array.array("q") for field_index in range(5)]
+
+    def _chunk_arrays(self, chunk):
+        chunk_arrays = [np.frombuffer(field, dtype=np.int64)
+                        for field in chunk[:4]]
+        if self._collapsed_reads:
+            return chunk_arrays + [np.frombuffer(chunk[4], dtype=np.int64)]
+        return chunk_arrays + [np.ones(len(chunk[0]), dtype=np.int64)]
+
+    def _add_chunk(self, ref_indices, no_of_hits, no_of_splits,
+                   query_lengths, multiplicities):
+        """Add the alignments of a chunk to the counters.
+
+        np.add.at adds the values one after the other in the given
+        order.
+        """
+        is_split = no_of_splits > 0
+        # Consider split reads
+        no_of_splits = np.where(is_split, no_of_splits, 1).astype(float)
+        alignment_fractions = multiplicities / no_of_splits
+        is_unique = no_of_hits == 1
+        (alignments, aligned_reads, split_alignments,
+         uniquely_aligned_reads) = self._counters
+        np.add.at(alignments, ref_indices, alignment_fractions)
+        np.add.at(aligned_reads, ref_indices, multiplicities / (
+            no_of_hits.astype(float) * no_of_splits))
+        np.add.at(split_alignments, ref_indices[is_split],
+                  alignment_fractions[is_split])
+        np.add.at(uniquely_aligned_reads, ref_indices[is_unique],
+                  alignment_fractions[is_unique])
+        self._add_freqs(self._alignment_length_freqs, ref_indices,
+                        query_lengths, multiplicities)
+        self._add_freqs(self._no_of_hits_freqs, ref_indices, no_of_hits,
+                        multiplicities)
+
+    def _add_freqs(self, freqs_per_ref, ref_indices, values,
+                   multiplicities):
+        """Add the multiplicities of the values to their frequencies.
+
+        New values are added to the frequencies of a reference in the
+        order of their first occurrence.
+        """
+        ref_indices_and_values = (ref_indices << 32) | values
+        (unique_ref_indices_and_values, first_indices,
+         inverse_indices) = np.unique(
+             ref_indices_and_values, return_index=True,
+             return_inverse=True)
+        freqs = np.bincount(inverse_indices, weights=multiplicities)
+        for unique_index in np.argsort(first_indices).tolist():
+            ref_index_and_value = int(
+                unique_ref_indices_and_values[unique_index])
+            ref_freqs = freqs_per_ref[ref_index_and_value >> 32]
+            value = ref_index_and_value & 0xffffffff
+            ref_freqs[value] = ref_freqs.get(value, 0) + int(
+                freqs[unique_index])
 
     def _sum_countings(self, stats_per_ref):
         total_stats = {}
@@ -80,33 +417,35 @@ class ReadAlignerStats(object):
                     for no_of_hits_per_read, freq in
                     no_of_hits_per_read_freq.items())
 
-    def _init_counting_dict(self, stats_per_ref, ref_id):
-        stats_per_ref[ref_id] = defaultdict(float)
-        stats_per_ref[ref_id]["no_of_alignments"]
-        stats_per_ref[ref_id]["no_of_aligned_reads"]
-        stats_per_ref[ref_id]["no_of_split_alignments"]
-        stats_per_ref[ref_id]["no_of_uniquely_aligned_reads"]
-        stats_per_ref[ref_id][
-            "alignment_length_and_freqs"] = defaultdict(int)
-        stats_per_ref[ref_id][
-            "no_of_hits_per_read_and_freqs"] = defaultdict(int)
-
-    def _count_alignment(self, entry, ref_id, stats_per_ref,
-                         no_of_hits_per_read_freq):
-        entry_tags_dict = dict(entry.tags)
-        no_of_hits = entry_tags_dict["NH"]
-        # Consider split reads
-        no_of_splits = float(entry_tags_dict.get("XL", 1))
-        stats_per_ref[ref_id]["no_of_hits_per_read_and_freqs"][
-            no_of_hits] += 1
-        if "XL" in entry_tags_dict:
-            stats_per_ref[ref_id]["no_of_split_alignments"] += 1.0/no_of_splits
-        stats_per_ref[ref_id]["no_of_alignments"] += 1.0/no_of_splits
-        stats_per_ref[
-            ref_id]["no_of_aligned_reads"] += 1.0/(
-            float(no_of_hits) * no_of_splits)
-        if no_of_hits == 1:
-            stats_per_ref[ref_id][
-                "no_of_uniquely_aligned_reads"] += 1.0/no_of_splits
-        stats_per_ref[ref_id][
-            "alignment_length_and_freqs"][entry.query_length] += 1
+
+def _count_region(bam_path, region, collapsed_reads):
+    return ReadAlignerStats(collapsed_reads=collapsed_reads)._region_countings(
+        bam_path, region)
+
+
+# Ids of the FASTA headers in a block of lines that starts with a
+# newline
+_header_id_pattern = re.compile(rb"\n>(\S+)")
+
+
+def _line_blocks(file_path, block_size):
+    """Yield blocks of complete lines of a (gzipped) file.
+
+    Each block starts with the newline in front of its first line, so
+    the first line of the file is found the same way as the others.
+    """
+    with open(file_path, "rb") as file_fh:
+        is_gzipped = file_fh.read(2) == b"\x1f\x8b"
+    with (gzip.open if is_gzipped else open)(file_path, "rb") as file_fh:
+        rest = b"\n"
+        while True:
+            block = file_fh.read(block_size)
+            if not block:
+                break
+            block = rest + block
+            # The newline in front of the last, maybe incomplete line
+            # is kept for the next block
+            last_line_start = block.rfind(b"\n")
+            rest = block[last_line_start:]
+            yield block[:last_line_start]
+        yield rest
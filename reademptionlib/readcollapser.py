@@ -0,0 +1,49 @@
+class ReadCollapser(object):
+    """Collapse identical reads into one entry per unique sequence.
+
+    The name of a collapsed read is the name of the first read with
+    this sequence followed by "_x" and the number of reads with this
+    sequence (e.g. "read_1_x25"). Aligners keep this name so that the
+    multiplicity of each alignment can be restored with
+    read_multiplicity. All unique sequences are kept in memory.
+    """
+
+    def __init__(self):
+        self._seqs_and_names_and_counts = {}
+
+    def add_fasta(self, fasta_data):
+        """Add the reads of FASTA formated bytes with one line per
+        header and sequence.
+        """
+        lines = fasta_data.split(b"\n")
+        seqs_and_names_and_counts = self._seqs_and_names_and_counts
+        for header, seq in zip(lines[0::2], lines[1::2]):
+            name_and_count = seqs_and_names_and_counts.get(seq)
+            if name_and_count is None:
+                # Only the read name i.e. the header up to the first
+                # whitespace is kept
+                seqs_and_names_and_counts[seq] = [
+                    header[1:].split(None, 1)[0], 1]
+            else:
+                name_and_count[1] += 1
+
+    def no_of_unique_reads(self):
+        return len(self._seqs_and_names_and_counts)
+
+    def fasta_chunks(self, no_of_entries=100000):
+        """Return the collapsed reads as FASTA formated bytes in the
+        order of their first occurrence.
+        """
+        entries = []
+        for seq, (name, count) in self._seqs_and_names_and_counts.items():
+            entries.append(b">%s_x%d\n%s\n" % (name, count, seq))
+            if len(entries) == no_of_entries:
+                yield b"".join(entries)
+                entries = []
+        if entries:
+            yield b"".join(entries)
+
+
+def read_multiplicity(read_name):
+    """Return the number of reads a collapsed read stands for."""
+    return int(read_name.rsplit("_x", 1)[1])
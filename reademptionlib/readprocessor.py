@@ -1,36 +1,71 @@
 import bz2
+import concurrent.futures
 import gzip
 import lzma
-from collections import defaultdict
+import os
+import queue
+import random
+import stat
+import threading
+from collections import defaultdict, deque
+from functools import partial
+from itertools import islice
+import numpy as np
+from reademptionlib.adaptertrimmer import AdapterTrimmer
+from reademptionlib.compression import OutputCodec
+from reademptionlib.fastx import FastxParser
 from reademptionlib.polyaclipper import PolyAClipper
-from Bio import SeqIO
-from Bio.Seq import Seq
+from reademptionlib.readcollapser import ReadCollapser
+from reademptionlib.reversecomplement import reverse_complements
 
 
 class ReadProcessor(object):
     
     def __init__(self, poly_a_clipping=False,  min_read_length=20,
                  paired_end=False, min_phred_score=None,
-                 adapter=None, reverse_complement=False):
+                 adapter=None, reverse_complement=False, processes=1,
+                 chunk_size=4194304, paired_end_chunk_size=20000,
+                 output_codec=None, adapter_max_error_rate=0.1,
+                 adapter_min_overlap=3, collapse_reads=False,
+                 subsample_size=None, subsample_fraction=None,
+                 subsample_mode="reservoir", subsample_seed=1):
         self._poly_a_clipping = poly_a_clipping
         self._min_read_length = min_read_length
         self._paired_end = paired_end
         self._min_phred_score = min_phred_score
         self._adapter = adapter
+        self._adapter_trimmer = None
+        if adapter is not None:
+            if isinstance(adapter, str):
+                adapter = [adapter]
+            self._adapter_trimmer = AdapterTrimmer(
+                adapter, max_error_rate=adapter_max_error_rate,
+                min_overlap=adapter_min_overlap)
         self._poly_a_clipper = PolyAClipper()
         self._reverse_complement = reverse_complement
+        self._processes = processes
+        self._chunk_size = chunk_size
+        self._paired_end_chunk_size = paired_end_chunk_size
+        if output_codec is None:
+            output_codec = OutputCodec()
+        self._output_codec = output_codec
+        self._collapse_reads = collapse_reads
+        self._subsample_size = subsample_size
+        self._subsample_fraction = subsample_fraction
+        self._subsample_mode = subsample_mode
+        self._subsample_seed = subsample_seed
 
     def process_single_end(self, input_path, output_path):
         self._init_stat_dict()
-        with gzip.open(output_path, "wb") as output_fh:
+        with self._output_fh(output_path) as output_fh:
             input_fh = self._input_fh(input_path)
             self._process_single_end(input_fh, output_fh)
         return self._stats
 
     def process_paired_end(self, input_path_pair, output_path_pair):
         self._init_stat_dict()
-        with gzip.open(output_path_pair[0], "wb") as output_p1_fh, \
-                gzip.open(output_path_pair[1], "wb") as output_p2_fh:
+        with self._output_fh(output_path_pair[0]) as output_p1_fh, \
+                self._output_fh(output_path_pair[1]) as output_p2_fh:
             input_p1_fh = self._input_fh(input_path_pair[0])
             input_p2_fh = self._input_fh(input_path_pair[1])
             self._process_paired_end(
@@ -38,132 +73,366 @@ class ReadProcessor(object):
         return self._stats
 
     def _init_stat_dict(self):
-        self._stats = defaultdict(int)
-        self._stats["total_no_of_reads"]
-        self._stats["polya_removed"]
-        self._stats["single_a_removed"]
-        self._stats["unmodified"]
-        self._stats["too_short"]
-        self._stats["long_enough"]
-        self._stats[
-            "read_length_before_processing_and_freq"] = defaultdict(int)
-        self._stats["read_length_after_processing_and_freq"] = defaultdict(int)
+        self._stats = self._new_stat_dict()
+
+    def _new_stat_dict(self):
+        stats = defaultdict(int)
+        stats["total_no_of_reads"]
+        stats["polya_removed"]
+        stats["single_a_removed"]
+        stats["unmodified"]
+        stats["too_short"]
+        stats["long_enough"]
+        stats["adapter_trimmed"]
+        stats["adapter_and_no_of_trimmed_reads"] = defaultdict(int)
+        stats["read_length_before_processing_and_freq"] = defaultdict(int)
+        stats["read_length_after_processing_and_freq"] = defaultdict(int)
+        # Per position (1-based) histograms of the unprocessed reads
+        stats["position_and_base_and_freq"] = defaultdict(
+            partial(defaultdict, int))
+        stats["position_and_phred_score_and_freq"] = defaultdict(
+            partial(defaultdict, int))
+        return stats
+
+    def _add_to_stats(self, chunk_stats):
+        self._add_countings(self._stats, chunk_stats)
+
+    def _add_countings(self, countings, new_countings):
+        for attribute, value in new_countings.items():
+            if type(value) is defaultdict:
+                self._add_countings(countings[attribute], value)
+            else:
+                countings[attribute] += value
+
+    def _chunk_results(self, chunk_function, chunk_args):
+        """Apply the chunk function to each chunk and return the results
+        in the order of the chunks.
+
+        With more than one process the chunks are processed in
+        parallel. Only a limited number of chunks are kept in memory
+        at the same time.
+        """
+        if self._processes <= 1:
+            for args in chunk_args:
+                yield chunk_function(*args)
+            return
+        max_pending_jobs = 2 * self._processes
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._processes) as executor:
+            jobs = deque()
+            for args in chunk_args:
+                jobs.append(executor.submit(chunk_function, *args))
+                if len(jobs) >= max_pending_jobs:
+                    yield jobs.popleft().result()
+            while jobs:
+                yield jobs.popleft().result()
     
     def _input_fh(self, input_path):
-        """Return a file hande
+        """Return a binary file handle
 
-        Can deal with plain fasta files, gzipped bzipped2 fasta.
+        Can deal with plain, gzipped, bzipped2 and xz compressed
+        FASTA/FASTQ files.
         """
         if input_path.endswith(".gz"):
-            return gzip.open(input_path, "rt")
+            return gzip.open(input_path, "rb")
         elif input_path.endswith(".bz2"):
-            return bz2.open(input_path, "rt")
+            return bz2.open(input_path, "rb")
         elif input_path.endswith(".xz"):
-            return lzma.open(input_path, "rt")
-        with open(input_path, "r") as check_file:
-            check_file.seek(0)
-            first_line = check_file.readline()
-            if first_line[0] == '@':
-                self._fastq = True
-            else:
-                self._fastq = False
-        return open(input_path)
+            return lzma.open(input_path, "rb")
+        return open(input_path, "rb")
 
-    def _trim_by_quality(self, seq, qualities):
-        good_nucl = []
-        for nucl, qual in zip(seq, qualities):
-            if qual < self._min_phred_score:
-                break
-            good_nucl.append(nucl)
-        return "".join(good_nucl)
+    def _output_fh(self, output_path):
+        """Return a binary file handle for the processed reads
 
-    def _clip_adapter(self, seq):
-        adapter_start_pos = seq.find(self._adapter)
-        if adapter_start_pos == -1:
-            return seq
-        else:
-            return seq[:adapter_start_pos]
+        Files are compressed with the output codec. Named pipes
+        (FIFOs) that are read by an aligner are not compressed and
+        written by a separate thread, so that a full pipe of one mate
+        cannot block the writing to the pipe of the other mate.
+        """
+        if os.path.exists(output_path) and stat.S_ISFIFO(
+                os.stat(output_path).st_mode):
+            return BackgroundWriter(output_path)
+        return self._output_codec.open(output_path)
+
+    def _trim_by_quality(self, seqs, qualities):
+        """Trim each sequence before its first base with a Phred score
+        below the minimal Phred score.
+
+        The qualities are the raw Phred+33 encoded bytes. They are
+        concatenated and searched for low quality bases at once.
+        """
+        lengths = np.array([len(read_qualities)
+                            for read_qualities in qualities], dtype=np.int64)
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        low_quality_positions = np.flatnonzero(np.frombuffer(
+            b"".join(qualities), dtype=np.uint8) < self._min_phred_score + 33)
+        # The first low quality position at or after the start of each
+        # read - or the end of all reads if there is none
+        first_low_quality_positions = np.append(
+            low_quality_positions, ends[-1:])[
+                np.searchsorted(low_quality_positions, starts)]
+        trimmed_lengths = np.minimum(first_low_quality_positions, ends) - starts
+        return [seq[:trimmed_length] for seq, trimmed_length in zip(
+            seqs, trimmed_lengths.tolist())]
+
+    def _count_bases_and_qualities_per_position(self, seqs, qualities, stats):
+        """Add the base and Phred score frequencies at each read position
+        to the statistics.
+        """
+        lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+        if lengths.sum() == 0:
+            return
+        positions = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths)
+        for attribute, values, offset in [
+                ("position_and_base_and_freq",
+                 "".join(seqs).encode(), 0),
+                ("position_and_phred_score_and_freq",
+                 None if qualities is None else b"".join(qualities), 33)]:
+            if values is None:
+                continue
+            value_array = np.frombuffer(values, dtype=np.uint8)
+            freqs = np.bincount(positions * 256 + value_array)
+            for index in np.flatnonzero(freqs).tolist():
+                position, value = divmod(index, 256)
+                if offset == 0:
+                    value = chr(value)
+                else:
+                    value -= offset
+                stats[attribute][position + 1][value] += int(freqs[index])
+
+    def _clip_adapter(self, seq, stats):
+        seq, adapter = self._adapter_trimmer.trim(seq)
+        if adapter is not None:
+            stats["adapter_trimmed"] += 1
+            stats["adapter_and_no_of_trimmed_reads"][adapter] += 1
+        return seq
         
     def _process_single_end(self, input_fh, output_fh):
-        for header, seq, qualities in self._parse_sequences(input_fh):
-            raw_seq_len = len(seq)
-            self._stats["total_no_of_reads"] += 1
-            if self._fastq and self._min_phred_score is not None:
-                seq = self._trim_by_quality(seq, qualities)
-            if self._reverse_complement:
-                seq = Seq(seq)
-                seq = str(seq.reverse_complement())
-            if self._adapter is not None:
-                seq = self._clip_adapter(seq)
-            if self._poly_a_clipping:
-                seq = self._poly_a_clipper.clip_poly_a_stretch(seq)
-                seq = self._poly_a_clipper.remove_3_prime_a(seq)
+        fastx_parser = FastxParser(chunk_size=self._chunk_size)
+        # The format is detected while reading the first chunk
+        if self._subsampling():
+            chunk_args = ((chunk, fastx_parser.fastq, fastx_parser.fastx_path)
+                          for chunk in self._sampled_chunks(
+                              fastx_parser, input_fh))
+        else:
+            chunk_args = ((chunk, fastx_parser.fastq, fastx_parser.fastx_path)
+                          for chunk in fastx_parser.chunks(input_fh))
+        read_collapser = None
+        if self._collapse_reads:
+            read_collapser = ReadCollapser()
+        for output, chunk_stats in self._chunk_results(
+                self._process_single_end_chunk, chunk_args):
+            if read_collapser is None:
+                output_fh.write(output)
+            else:
+                read_collapser.add_fasta(output)
+            self._add_to_stats(chunk_stats)
+        if read_collapser is not None:
+            for output in read_collapser.fasta_chunks():
+                output_fh.write(output)
+            self._stats["no_of_unique_reads"] = (
+                read_collapser.no_of_unique_reads())
+
+    def _process_single_end_chunk(self, chunk, fastq, fastx_path):
+        fastx_parser = FastxParser(fastx_path=fastx_path)
+        fastx_parser.fastq = fastq
+        stats = self._new_stat_dict()
+        entries = list(fastx_parser.entries_of_chunk(chunk))
+        if not entries:
+            return b"", stats
+        headers, seqs, qualities = [list(values) for values in zip(*entries)]
+        if not fastq:
+            qualities = None
+        raw_seq_lens = [len(seq) for seq in seqs]
+        self._count_bases_and_qualities_per_position(seqs, qualities, stats)
+        if qualities is not None and self._min_phred_score is not None:
+            seqs = self._trim_by_quality(seqs, qualities)
+        if self._reverse_complement:
+            seqs = reverse_complements(seqs)
+        if self._adapter_trimmer is not None:
+            seqs = [self._clip_adapter(seq, stats) for seq in seqs]
+        # The poly-A clipping is done for the whole chunk at once
+        if self._poly_a_clipping:
+            seqs = self._poly_a_clipper.clip_poly_a_stretches(seqs)
+        stats["total_no_of_reads"] = len(seqs)
+        output = []
+        for header, seq, raw_seq_len in zip(headers, seqs, raw_seq_lens):
             clipped_seq_len = len(seq)
             if clipped_seq_len == raw_seq_len - 1:
-                self._stats["single_a_removed"] += 1
+                stats["single_a_removed"] += 1
             elif clipped_seq_len < raw_seq_len - 1:
-                self._stats["polya_removed"] += 1
+                stats["polya_removed"] += 1
             else:
-                self._stats["unmodified"] += 1
+                stats["unmodified"] += 1
             if clipped_seq_len < self._min_read_length:
-                self._stats["too_short"] += 1
+                stats["too_short"] += 1
                 continue
-            self._stats["long_enough"] += 1
-            self._stats["read_length_before_processing_and_freq"][
+            stats["long_enough"] += 1
+            stats["read_length_before_processing_and_freq"][
                 raw_seq_len] += 1
-            self._stats["read_length_after_processing_and_freq"][
+            stats["read_length_after_processing_and_freq"][
                 clipped_seq_len] += 1
-            # Encoding to bytes is necessary due to saving via gzip
-            output_fh.write(str.encode(">%s\n%s\n" % (header, seq)))
+            output.append(">%s\n%s\n" % (header, seq))
+        # Encoding to bytes is necessary due to saving in binary mode
+        return "".join(output).encode(), stats
+
+    def _subsampling(self):
+        return (self._subsample_size is not None or
+                self._subsample_fraction is not None)
+
+    def _sample(self, entries):
+        """Return a sample of the entries in their original order.
+
+        Either a fraction of the entries is chosen randomly or a given
+        number of entries - the first ones or a random reservoir
+        sample. The random choice depends only on the seed, so mates
+        of paired end reads given as entry pairs stay together.
+        """
+        random_generator = random.Random(self._subsample_seed)
+        if self._subsample_fraction is not None:
+            return (entry for entry in entries
+                    if random_generator.random() < self._subsample_fraction)
+        if self._subsample_mode == "first":
+            return islice(entries, self._subsample_size)
+        reservoir = []
+        for entry_no, entry in enumerate(entries):
+            if entry_no < self._subsample_size:
+                reservoir.append((entry_no, entry))
+                continue
+            replace_pos = random_generator.randint(0, entry_no)
+            if replace_pos < self._subsample_size:
+                reservoir[replace_pos] = (entry_no, entry)
+        return (entry for entry_no, entry in sorted(
+            reservoir, key=lambda entry_no_and_entry: entry_no_and_entry[0]))
+
+    def _sampled_chunks(self, fastx_parser, input_fh):
+        """Return chunks in the format of the input containing only the
+        sampled entries.
+        """
+        entries = self._sample(fastx_parser.entries(input_fh))
+        # The chunks contain as many entries as the paired end chunks
+        while True:
+            chunk_entries = list(islice(entries, self._paired_end_chunk_size))
+            if not chunk_entries:
+                break
+            if fastx_parser.fastq:
+                yield b"".join(
+                    b"@%s\n%s\n+\n%s\n" % (
+                        header.encode(), seq.encode(), qualities)
+                    for header, seq, qualities in chunk_entries)
+            else:
+                yield b"".join(
+                    b">%s\n%s\n" % (header.encode(), seq.encode())
+                    for header, seq, qualities in chunk_entries)
 
     def _parse_sequences(self, input_fh):
-        if self._fastq:
-            for seq_record in SeqIO.parse(input_fh, "fastq"):
-                yield(seq_record.description, str(seq_record.seq),
-                      seq_record.letter_annotations["phred_quality"])
-        else:
-            for seq_record in SeqIO.parse(input_fh, "fasta"):
-                yield(seq_record.description, str(seq_record.seq), None)
+        return FastxParser().entries(input_fh)
         
     def _process_paired_end(
             self, input_p1_fh, input_p2_fh, output_p1_fh, output_p2_fh):
-        for fasta_entry_p1, fasta_entry_p2 in zip(
-                self._parse_sequences(input_p1_fh),
-                self._parse_sequences(input_p2_fh,)):
-            header_p1 = fasta_entry_p1[0]
-            header_p2 = fasta_entry_p2[0]
-            seq_p1 = fasta_entry_p1[1]
-            seq_p2 = fasta_entry_p2[1]
-            qualities_p1 = fasta_entry_p1[2]
-            qualities_p2 = fasta_entry_p1[2]
-            raw_seq_p1_len = len(seq_p1)
-            raw_seq_p2_len = len(seq_p2)
-            self._stats["total_no_of_reads"] += 1
-            self._stats["unmodified"] += 1
-            if self._fastq and self._min_phred_score is not None:
-                seq_p1 = self._trim_by_quality(seq_p1, qualities_p1)
-                seq_p2 = self._trim_by_quality(seq_p2, qualities_p2)
+        chunk_args = ((entry_pairs,) for entry_pairs in
+                      self._entry_pair_chunks(input_p1_fh, input_p2_fh))
+        for output_p1, output_p2, chunk_stats in self._chunk_results(
+                self._process_paired_end_chunk, chunk_args):
+            output_p1_fh.write(output_p1)
+            output_p2_fh.write(output_p2)
+            self._add_to_stats(chunk_stats)
+
+    def _entry_pair_chunks(self, input_p1_fh, input_p2_fh):
+        """Return lists of entry pairs of the paired end read files."""
+        entry_pairs = zip(self._parse_sequences(input_p1_fh),
+                          self._parse_sequences(input_p2_fh))
+        if self._subsampling():
+            entry_pairs = self._sample(entry_pairs)
+        while True:
+            chunk = list(islice(entry_pairs, self._paired_end_chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+    def _process_paired_end_chunk(self, entry_pairs):
+        stats = self._new_stat_dict()
+        output_p1 = []
+        output_p2 = []
+        mate_reads = []
+        for mate_entries in zip(*entry_pairs):
+            headers, seqs, qualities = [
+                list(values) for values in zip(*mate_entries)]
+            if qualities[0] is None:
+                qualities = None
+            raw_seq_lens = [len(seq) for seq in seqs]
+            self._count_bases_and_qualities_per_position(
+                seqs, qualities, stats)
+            if qualities is not None and self._min_phred_score is not None:
+                seqs = self._trim_by_quality(seqs, qualities)
             if self._reverse_complement:
-                seq_p1 = Seq(seq_p1)
-                seq_p1 = str(seq_p1.reverse_complement())
-                seq_p2 = Seq(seq_p2)
-                seq_p2 = str(seq_p2.reverse_complement())
-            if self._adapter is not None:
-                seq_p1 = self._clip_adapter(seq_p1)
-                seq_p2 = self._clip_adapter(seq_p2)
+                seqs = reverse_complements(seqs)
+            if self._adapter_trimmer is not None:
+                seqs = [self._clip_adapter(seq, stats) for seq in seqs]
+            mate_reads.append(list(zip(headers, seqs, raw_seq_lens)))
+        for ((header_p1, seq_p1, raw_seq_p1_len),
+             (header_p2, seq_p2, raw_seq_p2_len)) in zip(*mate_reads):
+            stats["total_no_of_reads"] += 1
+            stats["unmodified"] += 1
             if (raw_seq_p1_len < self._min_read_length or
                     raw_seq_p2_len < self._min_read_length):
-                self._stats["too_short"] += 1
+                stats["too_short"] += 1
                 continue
-            self._stats["long_enough"] += 1
-            self._stats["read_length_before_processing_and_freq"][
+            stats["long_enough"] += 1
+            stats["read_length_before_processing_and_freq"][
                 raw_seq_p1_len] += 1
-            self._stats["read_length_after_processing_and_freq"][
+            stats["read_length_after_processing_and_freq"][
                 raw_seq_p1_len] += 1
-            self._stats["read_length_before_processing_and_freq"][
+            stats["read_length_before_processing_and_freq"][
                 raw_seq_p2_len] += 1
-            self._stats["read_length_after_processing_and_freq"][
+            stats["read_length_after_processing_and_freq"][
                 raw_seq_p2_len] += 1
-            # Encoding to bytes is necessary due to saving via gzip
-            output_p1_fh.write(str.encode(">%s\n%s\n" % (header_p1, seq_p1)))
-            output_p2_fh.write(str.encode(">%s\n%s\n" % (header_p2, seq_p2)))
+            output_p1.append(">%s\n%s\n" % (header_p1, seq_p1))
+            output_p2.append(">%s\n%s\n" % (header_p2, seq_p2))
+        # Encoding to bytes is necessary due to saving in binary mode
+        return "".join(output_p1).encode(), "".join(output_p2).encode(), stats
+
+
+class BackgroundWriter(object):
+    """Write data to a file in a separate thread.
+
+    Opening and writing happen in the thread, so neither blocks the
+    caller, e.g. if the file is a FIFO that is not read yet.
+    """
+
+    def __init__(self, output_path):
+        self._queue = queue.Queue()
+        self._exception = None
+        self._thread = threading.Thread(
+            target=self._write, args=(output_path,))
+        self._thread.start()
+
+    def write(self, data):
+        if self._exception is not None:
+            raise self._exception
+        self._queue.put(data)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._exception is not None:
+            raise self._exception
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write(self, output_path):
+        try:
+            with open(output_path, "wb") as output_fh:
+                while True:
+                    data = self._queue.get()
+                    if data is None:
+                        break
+                    output_fh.write(data)
+        except Exception as exception:
+            self._exception = exception
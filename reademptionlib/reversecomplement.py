@@ -0,0 +1,28 @@
+_NUCLEOTIDES = "ACGTURYKMSWBDHVN"
+_COMPLEMENTS = "TGCAAYRMKSWVHDBN"
+# Translation tables for str and bytes sequences. All IUPAC nucleotide
+# codes in upper and lower case are complemented, U is complemented to
+# A and all other characters are kept.
+_STR_TABLE = str.maketrans(
+    _NUCLEOTIDES + _NUCLEOTIDES.lower(), _COMPLEMENTS + _COMPLEMENTS.lower())
+_BYTES_TABLE = bytes.maketrans(
+    (_NUCLEOTIDES + _NUCLEOTIDES.lower()).encode(),
+    (_COMPLEMENTS + _COMPLEMENTS.lower()).encode())
+
+
+def reverse_complement(seq):
+    """Return the reverse complement of a str or bytes sequence."""
+    if isinstance(seq, str):
+        return seq.translate(_STR_TABLE)[::-1]
+    return seq.translate(_BYTES_TABLE)[::-1]
+
+
+def reverse_complements(seqs):
+    """Return the reverse complements of a list of str sequences.
+
+    The sequences are joined, translated and reversed at once.
+    """
+    if not seqs:
+        return []
+    # Reversing the joined sequences also reverses their order
+    return "\n".join(seqs).translate(_STR_TABLE)[::-1].split("\n")[::-1]
@@ -1,11 +1,18 @@
 import os
 import pysam
+from reademptionlib.manifest import atomic_output_path
 
 
 class SamToBamConverter(object):
 
-    def __init__(self):
-        self._unsorted_appendix = ".tmp_unsorted"
+    def __init__(self, threads=1, memory_per_thread=None):
+        """Use the given number of threads for compression and sorting.
+
+        The memory per sorting thread is given in bytes. If it is not
+        given the default of samtools is used.
+        """
+        self._threads = max(1, threads)
+        self._memory_per_thread = memory_per_thread
 
     def sam_to_bam(self, sam_path, bam_path_prefix):
         if self._sam_file_is_empty(sam_path) is True:
@@ -16,34 +23,61 @@ class SamToBamConverter(object):
             # Remove SAM file
             os.remove(sam_path)
             return
-        temp_unsorted_bam_path = self._temp_unsorted_bam_path(
-            bam_path_prefix)
-        # Generate unsorted BAM file
-        pysam.samtools.view(
-            "-b", "-o{}".format(temp_unsorted_bam_path), sam_path,
-            catch_stdout=False)
-        # Generate sorted BAM file
-        pysam.sort(temp_unsorted_bam_path, "-o", bam_path_prefix + ".bam")
-        # Generate index for BAM file
-        pysam.index("{}.bam".format(bam_path_prefix))
-        # Remove unsorted BAM file
-        os.remove(temp_unsorted_bam_path)
+        self.sort_sam_to_bam(sam_path, bam_path_prefix)
         # Remove SAM file
         os.remove(sam_path)
 
+    def sort_sam_to_bam(self, sam_path, bam_path_prefix):
+        """Sort the alignments of a SAM file into an indexed BAM file.
+
+        The SAM file is read only once, so it can also be a FIFO the
+        aligner is writing to. The alignments are sorted in memory and
+        sorted blocks are spilled to temporary files next to the BAM
+        file if the memory is exceeded. No unsorted BAM file is
+        written. The BAM file only replaces an existing one once it is
+        complete.
+        """
+        sort_options = self._additional_threads_options()
+        if self._memory_per_thread is not None:
+            sort_options += ["-m", str(int(self._memory_per_thread))]
+        with atomic_output_path("%s.bam" % bam_path_prefix) as tmp_bam_path:
+            pysam.sort(*(sort_options + [
+                "-O", "bam", "-o", tmp_bam_path, sam_path]))
+        pysam.index(*(self._additional_threads_options() + [
+            "%s.bam" % bam_path_prefix]))
+
     def bam_to_sam(self, bam_path, sam_path):
-        pysam.view("-ho{}".format(sam_path), bam_path, catch_stdout=False)
+        pysam.view(*(self._additional_threads_options() + [
+            "-ho{}".format(sam_path), bam_path]), catch_stdout=False)
 
-    def _temp_unsorted_bam_path(self, bam_path_prefix):
-        return "%s%s.bam" % (bam_path_prefix, self._unsorted_appendix)
+    def _additional_threads_options(self):
+        # samtools counts the threads in addition to the main thread
+        return ["-@", str(self._threads - 1)]
 
     def _sam_file_is_empty(self, sam_path):
-        # Check if there is any line that is not a header line
-        # (i.e. which is not starting with @)
-        for line in open(sam_path):
-            if line.startswith("@") is False:
-                return False
-        return True
+        """Check if the SAM file contains only header lines.
+
+        As header lines are only allowed at the beginning, only the
+        last line has to be checked. The end of the file is read in
+        growing blocks until the last line is complete, as a long
+        alignment line could otherwise be cut at a field that starts
+        with an "@".
+        """
+        with open(sam_path, "rb") as sam_fh:
+            sam_fh.seek(0, os.SEEK_END)
+            block_start = sam_fh.tell()
+            block_size = 65536
+            tail = b""
+            while block_start > 0:
+                block_size = min(block_size, block_start)
+                block_start -= block_size
+                sam_fh.seek(block_start)
+                tail = sam_fh.read(block_size) + tail
+                if b"\n" in tail.rstrip(b"\n"):
+                    break
+                block_size *= 2
+            last_line = tail.rstrip(b"\n").rsplit(b"\n", 1)[-1]
+        return last_line == b"" or last_line.startswith(b"@")
 
     def _generate_empty_bam_file(self, sam_path, bam_path_prefix):
         samfile = pysam.Samfile(sam_path, "r")
@@ -1,4 +1,4 @@
-from subprocess import call
+from subprocess import check_call
 import os
 
 
@@ -14,9 +14,9 @@ class Segemehl(object):
             "--generate", index_file]
         if self._show_progress is False:
             with open(os.devnull, "w") as devnull:
-                call(segemehl_call, stderr=devnull)
+                check_call(segemehl_call, stderr=devnull)
         else:
-            call(segemehl_call)
+            check_call(segemehl_call)
 
     # Due to testing I changed threads -> threads=1, hit_strategy
     # -> hit_strategy=1, nomatch_path deleted 'threads, nomatch_path, hit_s..'
@@ -56,6 +56,6 @@ class Segemehl(object):
         # Discard standard error output
         if self._show_progress is False:
             with open(os.devnull, "w") as devnull:
-                call(segemehl_call, stderr=devnull)
+                check_call(segemehl_call, stderr=devnull)
         else:
-            call(segemehl_call)
+            check_call(segemehl_call)
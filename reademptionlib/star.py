@@ -1,4 +1,6 @@
-from subprocess import call
+import contextlib
+import signal
+from subprocess import call, check_call
 
 
 class STAR(object):
@@ -15,39 +17,79 @@ class STAR(object):
             "--runThreadN", str(threads), "--genomeDir ",
             index_folder, "--genomeFastaFiles " + fasta_files,
             "--genomeSAindexNbases", str(indexN)]
-        call(STAR_call)
+        check_call(STAR_call)
+
+    @contextlib.contextmanager
+    def shared_genome(self, index_folder, output_prefix):
+        """Keep the genome in shared memory during the with block.
+
+        Alignments with genome_load="LoadAndKeep" use the loaded genome
+        instead of loading it on their own. The genome is removed from
+        the shared memory when the block is left, also if an alignment
+        failed or the process is terminated.
+        """
+        self._genome_load(index_folder, "LoadAndExit", output_prefix)
+        previous_sigterm_handler = signal.signal(
+            signal.SIGTERM, _exit_on_signal)
+        try:
+            yield
+        finally:
+            signal.signal(signal.SIGTERM, previous_sigterm_handler)
+            self._genome_load(index_folder, "Remove", output_prefix)
 
     def align_reads(self, threads, index_folder,
                     read_file_or_pair, output_folder,
                     annotation_file,
                     paired_end=False,
-                    include_annotation=False):
+                    include_annotation=False,
+                    genome_load=None):
+        """Align reads with STAR
+
+        The command STAR uses to uncompress the read files is chosen
+        based on their suffix. With genome_load="LoadAndKeep" a genome
+        in shared memory is used (see shared_genome).
+        """
         if not paired_end:
             assert type(read_file_or_pair) == str
             STAR_call = [
                 self._STAR_bin,
-                "--readFilesIn", read_file_or_pair,
-                "--readFilesCommand zcat"]
+                "--readFilesIn", read_file_or_pair]
         else:
             assert type(read_file_or_pair) == list
             STAR_call = [
                 self._STAR_bin,
                 "--readFilesIn", read_file_or_pair[0],
-                read_file_or_pair[1],
-                "--readFilesCommand zcat"]
+                read_file_or_pair[1]]
+        read_file = (read_file_or_pair if not paired_end
+                     else read_file_or_pair[0])
+        read_files_command = self._read_files_command(read_file)
+        if read_files_command is not None:
+            STAR_call += ["--readFilesCommand"] + read_files_command
         STAR_call += [
             "--runThreadN", str(threads),
             "--genomeDir", index_folder,
             "--outFileNamePrefix", output_folder,
             "--outReadsUnmapped Fastx"]
+        if genome_load is not None:
+            STAR_call += ["--genomeLoad", genome_load]
         if include_annotation is True:
             STAR_call.append(
                 "--sjdbGTFfile", annotation_file)
-        call(STAR_call)
-        
+        check_call(STAR_call)
 
+    def _genome_load(self, index_folder, genome_load, output_prefix):
+        call([self._STAR_bin, "--genomeLoad", genome_load,
+              "--genomeDir", index_folder,
+              "--outFileNamePrefix", output_prefix])
 
+    def _read_files_command(self, read_file):
+        if read_file.endswith(".gz"):
+            return ["zcat"]
+        elif read_file.endswith(".zst"):
+            return ["zstd", "-dc"]
+        return None
 
 
-        
-       
+def _exit_on_signal(signal_number, frame):
+    # Raising an exception lets the with block of shared_genome clean up
+    raise SystemExit(128 + signal_number)
@@ -0,0 +1,124 @@
+import concurrent.futures
+import time
+from collections import OrderedDict
+
+
+class TaskScheduler(object):
+    """Run tasks as soon as their dependencies are finished.
+
+    Each task declares how many CPUs and how much memory (in bytes) it
+    needs. Tasks are started in the order they were added as long as
+    the sum of the CPUs and the memory of the running tasks does not
+    exceed the given limits. A task that needs more than the limits is
+    run when no other task is running. Later tasks do not overtake a
+    task that is ready but waits for free resources, so large tasks
+    cannot be starved by small ones.
+
+    Tasks run in separate processes. The results and the runtimes (in
+    seconds) of the tasks are stored by name in the dictionaries
+    results and runtimes.
+    """
+
+    def __init__(self, max_cpus, max_memory=None):
+        self._max_cpus = max(1, max_cpus)
+        self._max_memory = max_memory
+        self._tasks = OrderedDict()
+        self.results = {}
+        self.runtimes = {}
+
+    def add_task(self, name, function, args=(), dependencies=(), cpus=1,
+                 memory=0):
+        if name in self._tasks:
+            raise TaskSchedulingError("Task '%s' was added twice." % name)
+        for dependency in dependencies:
+            if dependency not in self._tasks:
+                raise TaskSchedulingError(
+                    "Task '%s' depends on unknown task '%s'." % (
+                        name, dependency))
+        self._tasks[name] = Task(
+            name, function, args, dependencies, min(cpus, self._max_cpus),
+            memory)
+
+    def run(self):
+        """Run all tasks and return their results."""
+        pending_tasks = OrderedDict(self._tasks)
+        running_tasks = {}
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._max_cpus) as executor:
+            while pending_tasks or running_tasks:
+                for task in self._tasks_to_start(
+                        pending_tasks, running_tasks.values()):
+                    del pending_tasks[task.name]
+                    running_tasks[executor.submit(
+                        _timed_call, task.function, task.args)] = task
+                finished_jobs, unfinished_jobs = concurrent.futures.wait(
+                    running_tasks,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                for job in finished_jobs:
+                    task = running_tasks.pop(job)
+                    if job.exception() is not None:
+                        for unfinished_job in unfinished_jobs:
+                            unfinished_job.cancel()
+                        raise job.exception()
+                    self.results[task.name], self.runtimes[task.name] = (
+                        job.result())
+        return self.results
+
+    def _tasks_to_start(self, pending_tasks, running_tasks):
+        used_cpus = sum(task.cpus for task in running_tasks)
+        used_memory = sum(task.memory for task in running_tasks)
+        no_of_running_tasks = len(running_tasks)
+        tasks_to_start = []
+        for task in pending_tasks.values():
+            if not all(dependency in self.results
+                       for dependency in task.dependencies):
+                continue
+            if no_of_running_tasks > 0 and (
+                    used_cpus + task.cpus > self._max_cpus or (
+                        self._max_memory is not None and
+                        used_memory + task.memory > self._max_memory)):
+                break
+            tasks_to_start.append(task)
+            used_cpus += task.cpus
+            used_memory += task.memory
+            no_of_running_tasks += 1
+        return tasks_to_start
+
+
+class Task(object):
+
+    def __init__(self, name, function, args, dependencies, cpus, memory):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.dependencies = dependencies
+        self.cpus = cpus
+        self.memory = memory
+
+
+def split_threads(job_sizes, threads, concurrent_jobs):
+    """Return the number of threads of each job.
+
+    The threads are split so that the given number of jobs of average
+    size use all threads together. Larger jobs get proportionally more
+    threads. Each job gets at least one and at most all threads.
+    """
+    if not job_sizes:
+        return []
+    threads_per_job = threads / min(concurrent_jobs, len(job_sizes))
+    mean_size = sum(job_sizes) / len(job_sizes)
+    if mean_size == 0:
+        return [max(1, int(threads_per_job))] * len(job_sizes)
+    return [min(threads, max(1, int(round(
+        threads_per_job * job_size / mean_size))))
+            for job_size in job_sizes]
+
+
+def _timed_call(function, args):
+    start_time = time.time()
+    result = function(*args)
+    return result, time.time() - start_time
+
+
+class TaskSchedulingError(Exception):
+    pass
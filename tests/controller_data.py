@@ -189,7 +189,24 @@ class ArgMockAlignment(object):
     crossalign_cleaning_str = None
     min_phred_score = None
     adapter = None
+    adapter_max_error_rate = 0.1
+    adapter_min_overlap = 3
     reverse_complement = False
+    stream_processed_reads = False
+    processed_reads_compression = "gzip"
+    processed_reads_compression_level = None
+    collapse_reads = False
+    subsample = None
+    subsample_fraction = None
+    subsample_mode = "reservoir"
+    subsample_seed = 1
+    per_lib_scheduling = False
+    concurrent_alignments = 1
+    stream_alignments = False
+    index_cache = None
+    star_shared_genome = False
+    stream_realigner_input = False
+    max_memory = None
 
 
 class ArgMockCoverage(object):
@@ -233,6 +250,7 @@ class ArgMockDESeq(object):
     color_sig = "red"
     color_non_sig = "black"
     glyph_size = 8
+    check_for_existing_files = False
     deseq_raw_folder = "{}/output/deseq/deseq_raw".format(project_path)
     deseq_extended_folder = "{}/output/deseq/deseq_with_annotations".format(
         project_path)
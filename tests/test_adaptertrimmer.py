@@ -0,0 +1,99 @@
+import random
+import sys
+sys.path.append("./tests")
+from reademptionlib.adaptertrimmer import AdapterTrimmer
+
+adapter = "AGATCGGAAGAGCACACGTCT"
+
+
+def test_exact_adapter():
+    adapter_trimmer = AdapterTrimmer([adapter])
+    assert adapter_trimmer.trim("ACGTACGTACGT" + adapter + "GGCC") == (
+        "ACGTACGTACGT", adapter)
+    assert adapter_trimmer.trim("ACGTACGTACGTAC") == ("ACGTACGTACGTAC", None)
+    assert adapter_trimmer.trim("") == ("", None)
+
+
+def test_adapter_with_mismatches_and_indels():
+    adapter_trimmer = AdapterTrimmer([adapter])
+    # One mismatch
+    assert adapter_trimmer.trim(
+        "ACGTACGTACGTAGATCGGTAGAGCACACGTCTGG") == ("ACGTACGTACGT", adapter)
+    # One deletion and one insertion
+    assert adapter_trimmer.trim(
+        "ACGTACGTACGTAGATCGAAGAGCACACGTTCTGG") == ("ACGTACGTACGT", adapter)
+    # Three errors are more than 10% of the adapter length
+    assert adapter_trimmer.trim(
+        "ACGTACGTACGTAGTTCGGTAGAGCTCACGTCT")[1] is None
+    # No errors are tolerated if the error rate is 0
+    assert AdapterTrimmer([adapter], max_error_rate=0).trim(
+        "ACGTACGTACGTAGATCGGTAGAGCACACGTCTGG")[1] is None
+
+
+def test_partial_adapter_at_3_prime_end():
+    adapter_trimmer = AdapterTrimmer([adapter])
+    assert adapter_trimmer.trim("ACGTACGTACGTAGATCGGA") == (
+        "ACGTACGTACGT", adapter)
+    assert adapter_trimmer.trim("ACGTACGTACGTAGA") == (
+        "ACGTACGTACGT", adapter)
+    # One mismatch in a long partial adapter
+    assert adapter_trimmer.trim("ACGTACGTACGTAGATCGGTAGAGC") == (
+        "ACGTACGTACGT", adapter)
+    # Overlaps shorter than the minimal overlap are kept
+    assert adapter_trimmer.trim("ACGTACGTACGTTAG") == (
+        "ACGTACGTACGTTAG", None)
+    assert AdapterTrimmer([adapter], min_overlap=2).trim(
+        "ACGTACGTACGTTAG") == ("ACGTACGTACGTT", adapter)
+
+
+def test_several_adapters():
+    adapter_2 = "TGGAATTCTCGGGTGCCAAGG"
+    adapter_trimmer = AdapterTrimmer([adapter, adapter_2])
+    assert adapter_trimmer.trim("ACGTACGTACGT" + adapter_2) == (
+        "ACGTACGTACGT", adapter_2)
+    # The most upstream adapter is trimmed
+    assert adapter_trimmer.trim("ACGTAC" + adapter + adapter_2) == (
+        "ACGTAC", adapter)
+    assert adapter_trimmer.trim("ACGTAC" + adapter_2 + adapter) == (
+        "ACGTAC", adapter_2)
+
+
+def test_wildcards_and_lowercase():
+    adapter_trimmer = AdapterTrimmer(["AGATCNNAAGAGCACACGTCT"])
+    assert adapter_trimmer.trim("acgtacgtacgtagatcggaagagcacacgtct") == (
+        "acgtacgtacgt", "AGATCNNAAGAGCACACGTCT")
+
+
+def test_approximate_search_finds_all_occurrences():
+    # Compare with a plain dynamic programming alignment
+    random.seed(1)
+    adapter_trimmer = AdapterTrimmer([adapter])
+    for _ in range(500):
+        seq = "".join(random.choice("ACGT") for _ in range(
+            random.randint(0, 40)))
+        adapter_with_errors = list(adapter)
+        for _ in range(random.randint(0, 2)):
+            pos = random.randrange(len(adapter_with_errors))
+            adapter_with_errors[pos] = random.choice("ACGT")
+        read = seq + "".join(adapter_with_errors) + "GGCC"
+        trimmed_read, found_adapter = adapter_trimmer.trim(read)
+        if min_edit_distance(adapter, read) <= 2:
+            assert found_adapter == adapter
+            assert len(trimmed_read) <= len(seq) + 2
+        else:
+            assert found_adapter is None
+
+
+def min_edit_distance(pattern, text):
+    """Return the minimal edit distance of the pattern to any substring
+    of the text.
+    """
+    previous_row = [0] * (len(text) + 1)
+    for pattern_pos, pattern_char in enumerate(pattern):
+        row = [pattern_pos + 1]
+        for text_pos, text_char in enumerate(text):
+            row.append(min(previous_row[text_pos + 1] + 1, row[-1] + 1,
+                           previous_row[text_pos] + (
+                               pattern_char != text_char)))
+        previous_row = row
+    return min(previous_row)
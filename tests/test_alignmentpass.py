@@ -0,0 +1,82 @@
+import sys
+sys.path.append("./tests")
+import pysam
+import pytest
+from reademptionlib.alignmentpass import AlignmentPass
+from reademptionlib.coveragecalculator import CoverageAccumulator
+from reademptionlib.coveragecalculator import CoverageCalculator
+from reademptionlib.genewisequanti import GeneWiseQuantification
+from reademptionlib.genewisequanti import GeneWiseQuantificationAccumulator
+
+# Replicon indices, start positions, CIGAR strings, numbers of hits and
+# reverse flags
+alignments = [
+    (0, 5, "20M", 1, False),
+    (0, 5, "20M", 2, True),
+    (0, 30, "10M20N10M", 1, False),
+    (0, 95, "30M", 2, False),
+    (0, 150, "25M", 1, True),
+    (1, 10, "15M", 1, False)]
+annotation = (
+    "chrom\tRefSeq\tgene\t1\t40\t.\t+\t.\tID=gene_1\n"
+    "chrom\tRefSeq\tgene\t20\t120\t.\t-\t.\tID=gene_2\n"
+    "plasmid\tRefSeq\tCDS\t1\t50\t.\t+\t.\tID=cds_1\n"
+    "chrom\tRefSeq\tgene\t100\t110\t.\t+\t.\tID=gene_3\n")
+
+
+def _write_bam(bam_path):
+    header = {"HD": {"VN": "1.0"},
+              "SQ": [{"SN": "chrom", "LN": 200},
+                     {"SN": "plasmid", "LN": 100}]}
+    with pysam.AlignmentFile(bam_path, "wb", header=header) as bam:
+        for read_index, (replicon_index, start, cigar, no_of_hits,
+                         reverse) in enumerate(alignments):
+            alignment = pysam.AlignedSegment()
+            alignment.query_name = "read_%s" % read_index
+            alignment.reference_id = replicon_index
+            alignment.reference_start = start
+            alignment.cigarstring = cigar
+            alignment.query_sequence = "A" * alignment.query_length
+            alignment.is_reverse = reverse
+            alignment.set_tag("NH", no_of_hits)
+            bam.write(alignment)
+    pysam.index(bam_path)
+
+
+@pytest.mark.parametrize("read_region", ["global", "centered"])
+def test_alignment_pass(tmpdir, monkeypatch, read_region):
+    bam_path = str(tmpdir.join("alignments.bam"))
+    _write_bam(bam_path)
+    annotation_path = str(tmpdir.join("annotation.gff"))
+    with open(annotation_path, "w") as annotation_fh:
+        annotation_fh.write(annotation)
+    gene_wise_quantification = GeneWiseQuantification(
+        read_region=read_region, clip_length=3)
+    gene_wise_quantification.calc_overlaps_per_alignment(
+        bam_path, [annotation_path])
+    gene_wise_quantification.quantify(
+        bam_path, annotation_path, str(tmpdir.join("quantify.csv")))
+    coverages = [
+        (ref_seq, dict((strand, list(coverage))
+                       for strand, coverage in strand_coverages.items()))
+        for ref_seq, strand_coverages in
+        CoverageCalculator().ref_seq_and_coverages(bam_path)]
+    # Chunks are passed one after the other
+    monkeypatch.setattr(AlignmentPass, "_chunk_size", 2)
+    gene_wise_quantification_accumulator = GeneWiseQuantificationAccumulator(
+        GeneWiseQuantification(read_region=read_region, clip_length=3),
+        [annotation_path])
+    accumulated_coverages = []
+    AlignmentPass([
+        gene_wise_quantification_accumulator,
+        CoverageAccumulator(
+            CoverageCalculator(),
+            lambda ref_seq, strand_coverages: accumulated_coverages.append(
+                (ref_seq, dict((strand, list(coverage)) for strand, coverage
+                               in strand_coverages.items()))))]).run(bam_path)
+    gene_wise_quantification_accumulator.write_countings(
+        [str(tmpdir.join("accumulated.csv"))])
+    assert accumulated_coverages == coverages
+    with open(str(tmpdir.join("quantify.csv"))) as quantify_fh:
+        with open(str(tmpdir.join("accumulated.csv"))) as accumulated_fh:
+            assert accumulated_fh.read() == quantify_fh.read()
@@ -0,0 +1,77 @@
+import gzip
+import os
+import random
+import sys
+sys.path.append("./tests")
+import pysam
+import pytest
+from reademptionlib.compression import OutputCodec, compress_bgzf_block
+
+
+def random_fasta_content(no_of_reads):
+    random.seed(1)
+    return "".join(
+        ">read_%s\n%s\n" % (read_no, "".join(
+            random.choice("ACGT") for _ in range(50)))
+        for read_no in range(no_of_reads)).encode()
+
+
+def write_with_codec(output_codec, output_path, content, piece_size=1000):
+    with output_codec.open(output_path) as output_fh:
+        for start in range(0, len(content), piece_size):
+            output_fh.write(content[start:start + piece_size])
+
+
+def test_suffixes():
+    assert OutputCodec("gzip").suffix() == ".gz"
+    assert OutputCodec("bgzf").suffix() == ".gz"
+    assert OutputCodec("zstd").suffix() == ".zst"
+    assert OutputCodec("none").suffix() == ""
+
+
+def test_gzip_and_uncompressed(tmp_path):
+    content = random_fasta_content(1000)
+    gzip_path = str(tmp_path / "reads.fa.gz")
+    write_with_codec(OutputCodec("gzip", level=1), gzip_path, content)
+    assert gzip.open(gzip_path).read() == content
+    plain_path = str(tmp_path / "reads.fa")
+    write_with_codec(OutputCodec("none"), plain_path, content)
+    assert open(plain_path, "rb").read() == content
+
+
+def test_bgzf_is_readable_by_gzip_and_htslib(tmp_path):
+    content = random_fasta_content(5000)
+    bgzf_path = str(tmp_path / "reads.fa.gz")
+    write_with_codec(OutputCodec("bgzf", threads=3), bgzf_path, content)
+    assert gzip.open(bgzf_path).read() == content
+    with pysam.BGZFile(bgzf_path, "rb") as bgzf_fh:
+        assert bgzf_fh.read() == content
+
+
+def test_bgzf_output_does_not_depend_on_threads(tmp_path):
+    content = random_fasta_content(5000)
+    bgzf_files = []
+    for threads in [1, 4]:
+        bgzf_path = str(tmp_path / ("reads_%s.fa.gz" % threads))
+        write_with_codec(OutputCodec("bgzf", threads=threads), bgzf_path,
+                         content, piece_size=7777)
+        bgzf_files.append(open(bgzf_path, "rb").read())
+    assert bgzf_files[0] == bgzf_files[1]
+
+
+def test_bgzf_block_size_field():
+    # BSIZE (bytes 16 and 17) is the total block size minus one
+    block = compress_bgzf_block(b"ACGT" * 1000, 6)
+    assert int.from_bytes(block[16:18], "little") == len(block) - 1
+    assert gzip.decompress(block) == b"ACGT" * 1000
+
+
+def test_zstd(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    content = random_fasta_content(1000)
+    zstd_path = str(tmp_path / "reads.fa.zst")
+    write_with_codec(OutputCodec("zstd", threads=2), zstd_path, content)
+    with open(zstd_path, "rb") as zstd_fh:
+        assert zstandard.ZstdDecompressor().stream_reader(
+            zstd_fh).read() == content
+    assert os.path.getsize(zstd_path) < len(content)
@@ -0,0 +1,59 @@
+import sys
+sys.path.append("./tests")
+import pysam
+import pytest
+from reademptionlib.crossalignfilter import CrossAlignFilter
+
+replicon_ids = ["chrom", "plasmid", "host_chrom", "other"]
+# Reads and the replicons they are aligned to
+reads_and_replicon_ids = [
+    ("read_1", ["chrom", "host_chrom"]),
+    ("read_2", ["chrom", "plasmid"]),
+    ("read_3", ["plasmid", "other"]),
+    ("read_4", ["host_chrom"]),
+    ("read_5", ["host_chrom", "plasmid", "chrom"])]
+orgs_and_replicon_ids = {"bacterium": ["chrom", "plasmid"],
+                         "host": ["host_chrom"]}
+
+
+def _write_bam(bam_path):
+    header = {"HD": {"VN": "1.0"},
+              "SQ": [{"SN": replicon_id, "LN": 1000}
+                     for replicon_id in replicon_ids]}
+    with pysam.AlignmentFile(bam_path, "wb", header=header) as bam:
+        for read_index, (read_name, read_replicon_ids) in enumerate(
+                reads_and_replicon_ids):
+            for replicon_id in read_replicon_ids:
+                alignment = pysam.AlignedSegment()
+                alignment.query_name = read_name
+                alignment.reference_id = replicon_ids.index(replicon_id)
+                alignment.reference_start = 10 * read_index
+                alignment.query_sequence = "ACGTACGTAC"
+                alignment.cigarstring = "10M"
+                alignment.set_tag("NH", len(read_replicon_ids))
+                bam.write(alignment)
+    pysam.sort("-o", bam_path + ".sorted", bam_path)
+    pysam.index(bam_path + ".sorted")
+    return bam_path + ".sorted"
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_crossalign_filter(tmpdir, processes):
+    input_bam = _write_bam(str(tmpdir.join("input.bam")))
+    output_bam = str(tmpdir.join("output.bam"))
+    crossmapped_reads_path = str(tmpdir.join("crossmapped_reads.txt"))
+    cross_align_filter = CrossAlignFilter(
+        input_bam, output_bam, crossmapped_reads_path, orgs_and_replicon_ids,
+        threads=2, processes=processes)
+    cross_align_filter.determine_crossmapped_reads()
+    cross_align_filter.write_crossmapping_free_bam()
+    assert cross_align_filter.no_of_crossmapped_reads == 2
+    with open(crossmapped_reads_path) as crossmapped_reads_fh:
+        assert sorted(crossmapped_reads_fh.read().split()) == [
+            "read_1", "read_5"]
+    with pysam.AlignmentFile(output_bam) as bam:
+        assert sorted((alignment.query_name, alignment.reference_name)
+                      for alignment in bam.fetch()) == [
+            ("read_2", "chrom"), ("read_2", "plasmid"),
+            ("read_3", "other"), ("read_3", "plasmid"),
+            ("read_4", "host_chrom")]
@@ -0,0 +1,95 @@
+import gzip
+import sys
+sys.path.append("./tests")
+from io import BytesIO
+import pytest
+from reademptionlib.fastx import FastqFormatError, FastxParser
+
+
+fasta_content = b""">read_1 a random sequence
+TTTAG
+AAATT
+ACACA
+>read_2 another random sequence
+ACGAG
+AAATT
+>read_3
+TAGAG
+"""
+
+fastq_content = b"""@read_1 a random sequence
+TTTAGAAATT
++
+IIIIIIII#!
+@read_2
+ACGAG
++read_2
+@@@@I
+@read_3
+TAGAGCC
++
+IIII###
+"""
+
+
+def test_fasta_entries():
+    fastx_parser = FastxParser()
+    assert list(fastx_parser.entries(BytesIO(fasta_content))) == [
+        ("read_1 a random sequence", "TTTAGAAATTACACA", None),
+        ("read_2 another random sequence", "ACGAGAAATT", None),
+        ("read_3", "TAGAG", None)]
+    assert fastx_parser.fastq is False
+
+
+def test_fastq_entries():
+    fastx_parser = FastxParser()
+    assert list(fastx_parser.entries(BytesIO(fastq_content))) == [
+        ("read_1 a random sequence", "TTTAGAAATT", b"IIIIIIII#!"),
+        ("read_2", "ACGAG", b"@@@@I"),
+        ("read_3", "TAGAGCC", b"IIII###")]
+    assert fastx_parser.fastq is True
+
+
+def test_small_chunks_are_cut_at_entry_boundaries():
+    # Chunk sizes smaller than an entry must give the same result as
+    # reading the whole file at once
+    for content in [fasta_content, fastq_content]:
+        expected = list(FastxParser().entries(BytesIO(content)))
+        for chunk_size in range(1, 20):
+            fastx_parser = FastxParser(chunk_size=chunk_size)
+            assert list(fastx_parser.entries(BytesIO(content))) == expected
+
+
+def test_windows_line_endings_and_missing_final_newline():
+    content = fastq_content.replace(b"\n", b"\r\n").rstrip()
+    assert list(FastxParser().entries(BytesIO(content))) == list(
+        FastxParser().entries(BytesIO(fastq_content)))
+
+
+def test_empty_file():
+    assert list(FastxParser().entries(BytesIO(b""))) == []
+
+
+def test_gzipped_input():
+    gzip_fh = BytesIO(gzip.compress(fastq_content))
+    assert [entry[0] for entry in FastxParser().entries(
+        gzip.open(gzip_fh, "rb"))] == ["read_1 a random sequence", "read_2",
+                                       "read_3"]
+
+
+@pytest.mark.parametrize("content", [
+    # Blank line between two entries
+    fastq_content.replace(b"#!\n@read_2", b"#!\n\n@read_2"),
+    # Sequence spanning two lines
+    fastq_content.replace(b"TTTAGAAATT\n", b"TTTAG\nAAATT\n"),
+    # Missing quality line of the last entry
+    fastq_content.rsplit(b"IIII###", 1)[0]])
+def test_malformed_fastq_entries(tmpdir, content):
+    fastq_path = str(tmpdir.join("reads.fq"))
+    with open(fastq_path, "wb") as fastq_fh:
+        fastq_fh.write(content)
+    for chunk_size in [7, 4194304]:
+        with open(fastq_path, "rb") as fastq_fh:
+            with pytest.raises(FastqFormatError) as error_info:
+                list(FastxParser(chunk_size=chunk_size).entries(fastq_fh))
+        assert fastq_path in str(error_info.value)
@@ -0,0 +1,77 @@
+import concurrent.futures
+import os
+import sys
+import time
+sys.path.append("./tests")
+import pytest
+from reademptionlib.indexcache import IncompleteIndex, IndexCache
+
+
+def _write_file(file_path, content):
+    with open(file_path, "w") as file_fh:
+        file_fh.write(content)
+
+
+def _build_index(index_folder):
+    # Give concurrent builds the chance to overlap
+    time.sleep(0.2)
+    _write_file("%s/index.idx" % index_folder, "index")
+    with open("%s/../builds.txt" % index_folder, "a") as builds_fh:
+        builds_fh.write("build\n")
+
+
+def _cached_index_folder(cache_folder, ref_seq_path):
+    return IndexCache(cache_folder).index_folder(
+        "segemehl", [ref_seq_path], [], _build_index)
+
+
+def _no_of_builds(cache_folder):
+    with open("%s/builds.txt" % cache_folder) as builds_fh:
+        return len(builds_fh.readlines())
+
+
+def test_index_folder(tmpdir):
+    cache_folder = str(tmpdir.join("cache"))
+    ref_seq_path = str(tmpdir.join("ref.fa"))
+    _write_file(ref_seq_path, ">chrom\nACGT\n")
+    index_folder = _cached_index_folder(cache_folder, ref_seq_path)
+    assert os.listdir(index_folder) == ["index.idx"]
+    assert _cached_index_folder(cache_folder, ref_seq_path) == index_folder
+    assert _no_of_builds(cache_folder) == 1
+    # Changed reference sequences need a new index
+    _write_file(ref_seq_path, ">chrom\nACGA\n")
+    assert _cached_index_folder(cache_folder, ref_seq_path) != index_folder
+    assert _no_of_builds(cache_folder) == 2
+
+
+def test_index_folder_concurrent_builds(tmpdir):
+    cache_folder = str(tmpdir.join("cache"))
+    ref_seq_path = str(tmpdir.join("ref.fa"))
+    _write_file(ref_seq_path, ">chrom\nACGT\n")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=3) as executor:
+        jobs = [executor.submit(
+            _cached_index_folder, cache_folder, ref_seq_path)
+                for job_index in range(3)]
+    assert len(set(job.result() for job in jobs)) == 1
+    assert _no_of_builds(cache_folder) == 1
+
+
+def test_index_folder_incomplete_build(tmpdir):
+    cache_folder = str(tmpdir.join("cache"))
+    ref_seq_path = str(tmpdir.join("ref.fa"))
+    _write_file(ref_seq_path, ">chrom\nACGT\n")
+    # The build did not write the index file
+    with pytest.raises(IncompleteIndex):
+        IndexCache(cache_folder).index_folder(
+            "segemehl", [ref_seq_path], [], lambda index_folder: None)
+    assert [path for path in os.listdir(cache_folder)
+            if not path.endswith(".lock")] == []
+    index_folder = _cached_index_folder(cache_folder, ref_seq_path)
+    assert os.listdir(index_folder) == ["index.idx"]
+
+
+def test_index_key():
+    index_cache = IndexCache("cache")
+    assert index_cache.index_key("STAR", [], [4]) != index_cache.index_key(
+        "STAR", [], [5])
+    assert index_cache.index_key("STAR", [], [4]).startswith("STAR_")
@@ -0,0 +1,76 @@
+import concurrent.futures
+import os
+import sys
+sys.path.append("./tests")
+import pytest
+from reademptionlib.manifest import Manifest, atomic_output_path
+
+
+def _write_file(file_path, content):
+    with open(file_path, "w") as file_fh:
+        file_fh.write(content)
+
+
+def _record(manifest_path, step, input_path, output_path):
+    _write_file(output_path, "output of %s" % step)
+    Manifest(manifest_path).record(
+        step, [input_path], {"option": 1}, [output_path])
+
+
+def test_is_up_to_date(tmpdir):
+    manifest = Manifest(str(tmpdir.join("manifest.json")))
+    input_path = str(tmpdir.join("input.txt"))
+    output_path = str(tmpdir.join("output.txt"))
+    _write_file(input_path, "input")
+    assert not manifest.is_up_to_date("step", [input_path], {"option": 1})
+    _write_file(output_path, "output")
+    manifest.record("step", [input_path], {"option": 1}, [output_path],
+                    result={"no_of_reads": 2})
+    assert manifest.is_up_to_date("step", [input_path], {"option": 1})
+    assert manifest.result("step") == {"no_of_reads": 2}
+    assert manifest.result("other_step") is None
+    # Changed parameters
+    assert not manifest.is_up_to_date("step", [input_path], {"option": 2})
+    # Changed input
+    _write_file(input_path, "changed input")
+    assert not manifest.is_up_to_date("step", [input_path], {"option": 1})
+    _write_file(input_path, "input")
+    assert manifest.is_up_to_date("step", [input_path], {"option": 1})
+    # Truncated output
+    _write_file(output_path, "outp")
+    assert not manifest.is_up_to_date("step", [input_path], {"option": 1})
+    os.remove(output_path)
+    assert not manifest.is_up_to_date("step", [input_path], {"option": 1})
+
+
+def test_record_concurrently(tmpdir):
+    manifest_path = str(tmpdir.join("manifest.json"))
+    input_path = str(tmpdir.join("input.txt"))
+    _write_file(input_path, "input")
+    steps = ["step_%s" % step_index for step_index in range(8)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
+        jobs = [executor.submit(
+            _record, manifest_path, step, input_path,
+            str(tmpdir.join("%s.txt" % step))) for step in steps]
+    for job in jobs:
+        job.result()
+    manifest = Manifest(manifest_path)
+    assert all(manifest.is_up_to_date(step, [input_path], {"option": 1})
+               for step in steps)
+
+
+def test_atomic_output_path(tmpdir):
+    output_path = str(tmpdir.join("output.txt"))
+    _write_file(output_path, "old")
+    with pytest.raises(ValueError):
+        with atomic_output_path(output_path) as tmp_path:
+            _write_file(tmp_path, "incomplete")
+            raise ValueError("Interrupted")
+    assert os.listdir(str(tmpdir)) == ["output.txt"]
+    with open(output_path) as output_fh:
+        assert output_fh.read() == "old"
+    with atomic_output_path(output_path) as tmp_path:
+        _write_file(tmp_path, "new")
+    assert os.listdir(str(tmpdir)) == ["output.txt"]
+    with open(output_path) as output_fh:
+        assert output_fh.read() == "new"
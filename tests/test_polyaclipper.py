@@ -31,11 +31,6 @@ def test_poly_a_clipper():
     result_seq = ""
     assert poly_a_clipper.clip_poly_a_stretch(test_seq) == result_seq
 
-    # Test: Sequence with an starting 'AAAA' substring
-    test_seq = "TTTAAAATTTTTTTTAAAACCCCCCCCCCAAAAC"
-    assert list(poly_a_clipper._aaaa_starting_substrings(
-        test_seq, 11)) == [['AAAATTTTTTT', 3], ['AAAACCCCCCC', 15]]
-
     # Test: If there is no terminal A stretch, there is no clipping
     test_seq = result_seq = "AAAAATTTTCCGCCCGGGAAATTTT"
     assert poly_a_clipper.remove_3_prime_a(test_seq) == result_seq
@@ -49,3 +44,26 @@ def test_poly_a_clipper():
     test_seq = "AAAAATTTTCCGCCCGGGAAATTTTAAAAAA"
     result_seq = "AAAAATTTTCCGCCCGGGAAATTTT"
     assert poly_a_clipper.remove_3_prime_a(test_seq) == result_seq
+
+
+def test_clip_poly_a_stretches():
+    poly_a_clipper = PolyAClipper()
+    sequences = [
+        "ATAGTAGGAGATTTAGACCAGATGACGATGACACAAAAAAAAAATTTAGACGACG",
+        "ATAGTAGGAGATTTAGACCAGATGACGATGACACAAAAAAAAATTTAGACGACGA",
+        "ATAGTAGGAGATTTAGACCAGATGACGATGACACAAAACAAAAAAAAAAAAA",
+        "AAAAAAAAAAAAAAA",
+        "",
+        "acgtacgtaaaaaaaaaaaa" + "A" * 5000]
+    assert poly_a_clipper.clip_poly_a_stretches(sequences) == [
+        "ATAGTAGGAGATTTAGACCAGATGACGATGACAC",
+        "ATAGTAGGAGATTTAGACCAGATGACGATGACACAAAAAAAAATTTAGACGACG",
+        "ATAGTAGGAGATTTAGACCAGATGACGATGACAC",
+        "",
+        "",
+        "ACGTACGT"]
+    # The batch version equals the clipping of the single sequences
+    for sequence, clipped_sequence in zip(
+            sequences, poly_a_clipper.clip_poly_a_stretches(sequences)):
+        assert poly_a_clipper.remove_3_prime_a(
+            poly_a_clipper.clip_poly_a_stretch(sequence)) == clipped_sequence
@@ -0,0 +1,120 @@
+import gzip
+import sys
+sys.path.append("./tests")
+import pysam
+import pytest
+from reademptionlib.readalignerstats import ReadAlignerStats
+
+# Read names, replicon ids, start positions, query lengths, number of
+# hits and number of splits
+alignments = [
+    ("read_1", 0, 10, 10, 1, None),
+    ("read_2", 0, 20, 12, 2, None),
+    ("read_2", 1, 30, 12, 2, None),
+    ("read_3", 0, 40, 10, 1, 2),
+    ("read_3", 0, 60, 8, 1, 2),
+    ("read_4", 1, 50, 10, 1, None)]
+
+
+def _write_bam(bam_path):
+    header = {"HD": {"VN": "1.0"},
+              "SQ": [{"SN": "chrom", "LN": 1000},
+                     {"SN": "plasmid", "LN": 1000},
+                     {"SN": "empty", "LN": 1000}]}
+    with pysam.AlignmentFile(bam_path, "wb", header=header) as bam:
+        for (read_name, replicon_index, start, query_length, no_of_hits,
+             no_of_splits) in sorted(alignments, key=lambda alignment: (
+                 alignment[1], alignment[2])):
+            alignment = pysam.AlignedSegment()
+            alignment.query_name = read_name
+            alignment.reference_id = replicon_index
+            alignment.reference_start = start
+            alignment.query_sequence = "A" * query_length
+            alignment.cigarstring = "%sM" % query_length
+            alignment.set_tag("NH", no_of_hits)
+            if no_of_splits is not None:
+                alignment.set_tag("XL", no_of_splits)
+            bam.write(alignment)
+    pysam.index(bam_path)
+
+
+def test_count(tmpdir, monkeypatch):
+    bam_path = str(tmpdir.join("alignments.bam"))
+    _write_bam(bam_path)
+    unaligned_reads_path = str(tmpdir.join("unaligned.fa"))
+    with open(unaligned_reads_path, "w") as unaligned_reads_fh:
+        unaligned_reads_fh.write(">read_5\nACGT\n>read_6\nACGT\n")
+    # Chunks are added one after the other
+    monkeypatch.setattr(ReadAlignerStats, "_chunk_size", 2)
+    stats = ReadAlignerStats().count(bam_path, unaligned_reads_path)
+    assert stats["stats_per_reference"]["chrom"] == {
+        "no_of_alignments": 3.0, "no_of_aligned_reads": 2.5,
+        "no_of_split_alignments": 1.0, "no_of_uniquely_aligned_reads": 2.0,
+        "alignment_length_and_freqs": {10: 2, 12: 1, 8: 1},
+        "no_of_hits_per_read_and_freqs": {1: 3.0, 2: 0.5}}
+    assert stats["stats_per_reference"]["empty"] == {
+        "no_of_alignments": 0.0, "no_of_aligned_reads": 0.0,
+        "no_of_split_alignments": 0.0, "no_of_uniquely_aligned_reads": 0.0,
+        "alignment_length_and_freqs": {},
+        "no_of_hits_per_read_and_freqs": {}}
+    # The alignment lengths are not summed up
+    assert stats["stats_total"] == {
+        "no_of_alignments": 5.0, "no_of_aligned_reads": 4.0,
+        "no_of_split_alignments": 1.0, "no_of_uniquely_aligned_reads": 3.0,
+        "no_of_hits_per_read_and_freqs": {1: 4.0, 2: 1.0},
+        "no_of_unaligned_reads": 2}
+    # Frequencies are listed in the order of the first occurrence
+    assert list(stats["stats_per_reference"]["chrom"][
+        "alignment_length_and_freqs"]) == [10, 12, 8]
+
+
+@pytest.mark.parametrize("open_function", [open, gzip.open])
+def test_count_fasta_entries(tmpdir, monkeypatch, open_function):
+    fasta_path = str(tmpdir.join("unaligned.fa"))
+    with open_function(fasta_path, "wt") as fasta_fh:
+        fasta_fh.write(
+            ">read_1_x3 description\nACGT\nACGT\n>read_2_x1\nAC>GT\n"
+            ">read_3_x10\nACGTACGT\n>read_4_x2")
+    # Headers are split over several blocks
+    monkeypatch.setattr(ReadAlignerStats, "_block_size", 3)
+    assert ReadAlignerStats()._count_fasta_entries(fasta_path) == 4
+    assert ReadAlignerStats(collapsed_reads=True)._count_fasta_entries(
+        fasta_path) == 16
+    open(fasta_path, "w").close()
+    assert ReadAlignerStats()._count_fasta_entries(fasta_path) == 0
+
+
+def test_count_with_several_processes(tmpdir):
+    bam_path = str(tmpdir.join("alignments.bam"))
+    _write_bam(bam_path)
+    assert ReadAlignerStats(processes=2).count(bam_path, "NA") == (
+        ReadAlignerStats().count(bam_path, "NA"))
+
+
+def test_estimate(tmpdir, monkeypatch):
+    bam_path = str(tmpdir.join("alignments.bam"))
+    _write_bam(bam_path)
+    counted_stats = ReadAlignerStats().count(bam_path, "NA")
+    # All alignments are sampled if there are fewer than the sample size
+    stats = ReadAlignerStats(sample_size=10).count(bam_path, "NA")
+    for ref_id, no_of_records in [("chrom", 4), ("plasmid", 2), ("empty", 0)]:
+        ref_stats = stats["stats_per_reference"][ref_id]
+        assert ref_stats.pop("no_of_mapped_records") == no_of_records
+        assert ref_stats.pop("no_of_unmapped_records") == 0
+        assert ref_stats == counted_stats["stats_per_reference"][ref_id]
+        assert stats["sampling"]["no_of_sampled_records"][
+            ref_id] == no_of_records
+    assert stats["stats_total"].pop("no_of_mapped_records") == 6
+    assert stats["stats_total"].pop("no_of_unmapped_records") == 0
+    assert stats["stats_total"] == counted_stats["stats_total"]
+    assert stats["sampling"]["confidence_intervals"]["stats_total"][
+        "no_of_aligned_reads"] == [4.0, 4.0]
+    # Sample of two of the four windows of "chrom"
+    monkeypatch.setattr(ReadAlignerStats, "_no_of_sampled_windows", 2)
+    stats = ReadAlignerStats(sample_size=2).count(bam_path, "NA")
+    assert stats["sampling"]["no_of_sampled_records"]["plasmid"] == 2
+    confidence_interval = stats["sampling"]["confidence_intervals"][
+        "stats_per_reference"]["chrom"]["no_of_alignments"]
+    assert confidence_interval[0] <= stats["stats_per_reference"]["chrom"][
+        "no_of_alignments"] <= confidence_interval[1]
+    assert stats["stats_per_reference"]["chrom"]["no_of_mapped_records"] == 4
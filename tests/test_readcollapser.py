@@ -0,0 +1,96 @@
+import sys
+sys.path.append("./tests")
+import pysam
+from reademptionlib.coveragecalculator import CoverageCalculator
+from reademptionlib.genewisequanti import GeneWiseQuantification
+from reademptionlib.readalignerstats import ReadAlignerStats
+from reademptionlib.readcollapser import ReadCollapser, read_multiplicity
+
+
+def test_collapse_reads():
+    read_collapser = ReadCollapser()
+    read_collapser.add_fasta(b">read_1 sample A\nACGT\n>read_2\nGGCC\n"
+                             b">read_3\nACGT\n")
+    read_collapser.add_fasta(b">read_4\nACGT\n>read_5\nTTTT\n")
+    assert read_collapser.no_of_unique_reads() == 3
+    assert b"".join(read_collapser.fasta_chunks(no_of_entries=2)) == (
+        b">read_1_x3\nACGT\n>read_2_x1\nGGCC\n>read_5_x1\nTTTT\n")
+
+
+def test_read_multiplicity():
+    assert read_multiplicity("read_1_x3") == 3
+    assert read_multiplicity("HWI-ST_x1:8:1101_x12") == 12
+
+
+# Alignments as (read name, start, is_reverse, no. of hits). The
+# collapsed alignments stand for the same reads.
+uncollapsed_alignments = [
+    ("read_1", 10, False, 1), ("read_2", 10, False, 1),
+    ("read_3", 10, False, 1), ("read_4", 30, True, 2),
+    ("read_4", 50, False, 2), ("read_5", 30, True, 2),
+    ("read_5", 50, False, 2), ("read_6", 70, False, 1)]
+collapsed_alignments = [
+    ("read_1_x3", 10, False, 1), ("read_4_x2", 30, True, 2),
+    ("read_4_x2", 50, False, 2), ("read_6_x1", 70, False, 1)]
+
+
+def write_bam(bam_path, alignments):
+    header = {"HD": {"VN": "1.0", "SO": "coordinate"},
+              "SQ": [{"SN": "chrom", "LN": 200}]}
+    with pysam.AlignmentFile(bam_path, "wb", header=header) as bam_fh:
+        for read_name, start, is_reverse, no_of_hits in sorted(
+                alignments, key=lambda alignment: alignment[1]):
+            alignment = pysam.AlignedSegment()
+            alignment.query_name = read_name
+            alignment.query_sequence = "A" * 20
+            alignment.flag = 16 if is_reverse else 0
+            alignment.reference_id = 0
+            alignment.reference_start = start
+            alignment.mapping_quality = 255
+            alignment.cigartuples = [(0, 20)]
+            alignment.set_tag("NH", no_of_hits)
+            bam_fh.write(alignment)
+    pysam.index(bam_path)
+
+
+def test_collapsed_alignments_count_like_uncollapsed(tmp_path):
+    uncollapsed_bam_path = str(tmp_path / "uncollapsed.bam")
+    collapsed_bam_path = str(tmp_path / "collapsed.bam")
+    write_bam(uncollapsed_bam_path, uncollapsed_alignments)
+    write_bam(collapsed_bam_path, collapsed_alignments)
+    assert ReadAlignerStats().count(uncollapsed_bam_path, "NA") == (
+        ReadAlignerStats(collapsed_reads=True).count(
+            collapsed_bam_path, "NA"))
+    coverages = []
+    for bam_path, collapsed_reads in [(uncollapsed_bam_path, False),
+                                      (collapsed_bam_path, True)]:
+        coverage_calculator = CoverageCalculator(
+            collapsed_reads=collapsed_reads)
+        coverages.append([
+            (ref_seq, strand, list(coverage))
+            for ref_seq, strand_coverages in
+            coverage_calculator.ref_seq_and_coverages(bam_path)
+            for strand, coverage in sorted(strand_coverages.items())])
+    assert coverages[0] == coverages[1]
+
+
+def test_collapsed_alignments_quantify_like_uncollapsed(tmp_path):
+    annotation_path = str(tmp_path / "annotation.gff")
+    with open(annotation_path, "w") as annotation_fh:
+        annotation_fh.write(
+            "chrom\tRefSeq\tgene\t1\t40\t.\t+\t.\tID=gene_1\n"
+            "chrom\tRefSeq\tgene\t41\t100\t.\t+\t.\tID=gene_2\n")
+    quantifications = []
+    for alignments, collapsed_reads in [(uncollapsed_alignments, False),
+                                        (collapsed_alignments, True)]:
+        bam_path = str(tmp_path / ("alignments_%s.bam" % collapsed_reads))
+        output_path = str(tmp_path / ("quanti_%s.csv" % collapsed_reads))
+        write_bam(bam_path, alignments)
+        gene_wise_quantification = GeneWiseQuantification(
+            collapsed_reads=collapsed_reads)
+        gene_wise_quantification.calc_overlaps_per_alignment(
+            bam_path, [annotation_path])
+        gene_wise_quantification.quantify(
+            bam_path, annotation_path, output_path)
+        quantifications.append(open(output_path).read())
+    assert quantifications[0] == quantifications[1]
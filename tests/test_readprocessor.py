@@ -0,0 +1,247 @@
+import gzip
+import os
+import random
+import sys
+import threading
+sys.path.append("./tests")
+from reademptionlib.readprocessor import ReadProcessor
+
+
+def write_random_reads(read_path, no_of_reads, fastq=True, seed=1):
+    random.seed(seed)
+    with open(read_path, "w") as read_fh:
+        for read_no in range(no_of_reads):
+            seq = "".join(random.choice("ACGT") for _ in range(
+                random.randint(10, 60)))
+            # Some reads get a poly-A tail
+            if read_no % 3 == 0:
+                seq += "A" * random.randint(1, 15)
+            if fastq:
+                qualities = "".join(random.choice("#5?I") for _ in seq)
+                read_fh.write("@read_%s\n%s\n+\n%s\n" % (
+                    read_no, seq, qualities))
+            else:
+                read_fh.write(">read_%s\n%s\n" % (read_no, seq))
+
+
+def read_gzip_file(path):
+    with gzip.open(path, "rb") as gzip_fh:
+        return gzip_fh.read()
+
+
+def test_process_single_end(tmp_path):
+    read_path = str(tmp_path / "reads.fa")
+    output_path = str(tmp_path / "reads_processed.fa.gz")
+    with open(read_path, "w") as read_fh:
+        read_fh.write(">read_1\nACGTACGTACGTACGTAAAAAAAAAAAAAAAA\n"
+                      ">read_2\nACGTACGTACGTACGTACGA\n"
+                      ">read_3\nACGTAC\n")
+    read_processor = ReadProcessor(poly_a_clipping=True, min_read_length=12)
+    stats = read_processor.process_single_end(read_path, output_path)
+    assert read_gzip_file(output_path) == (
+        b">read_1\nACGTACGTACGTACGT\n>read_2\nACGTACGTACGTACGTACG\n")
+    assert stats["total_no_of_reads"] == 3
+    assert stats["polya_removed"] == 1
+    assert stats["single_a_removed"] == 1
+    assert stats["unmodified"] == 1
+    assert stats["too_short"] == 1
+    assert stats["long_enough"] == 2
+
+
+def test_adapter_trimming_stats(tmp_path):
+    read_path = str(tmp_path / "reads.fa")
+    output_path = str(tmp_path / "reads_processed.fa.gz")
+    with open(read_path, "w") as read_fh:
+        read_fh.write(">read_1\nACGTACGTACGTACGTAGATCGGTAGAGCACACG\n"
+                      ">read_2\nACGTACGTACGTACGTTGGAATTCTCGGGTGCCAAGG\n"
+                      ">read_3\nACGTACGTACGTACGTAGATC\n"
+                      ">read_4\nACGTACGTACGTACGTACGT\n")
+    read_processor = ReadProcessor(
+        min_read_length=12,
+        adapter=["AGATCGGAAGAGCACACGTCT", "TGGAATTCTCGGGTGCCAAGG"])
+    stats = read_processor.process_single_end(read_path, output_path)
+    assert read_gzip_file(output_path) == (
+        b">read_1\nACGTACGTACGTACGT\n>read_2\nACGTACGTACGTACGT\n"
+        b">read_3\nACGTACGTACGTACGT\n>read_4\nACGTACGTACGTACGTACGT\n")
+    assert stats["adapter_trimmed"] == 3
+    assert stats["adapter_and_no_of_trimmed_reads"] == {
+        "AGATCGGAAGAGCACACGTCT": 2, "TGGAATTCTCGGGTGCCAAGG": 1}
+
+
+def test_collapse_reads(tmp_path):
+    read_path = str(tmp_path / "reads.fa")
+    with open(read_path, "w") as read_fh:
+        read_fh.write(">read_1\nACGTACGTACGTACGTAAAAAAAAAAAAAAAA\n"
+                      ">read_2\nACGTACGTACGTACGTACGA\n"
+                      ">read_3\nACGTACGTACGTACGTAAAAAAAAAAAA\n"
+                      ">read_4\nACGTAC\n")
+    stats = []
+    for collapse_reads in [False, True]:
+        output_path = str(tmp_path / ("processed_%s.fa.gz" % collapse_reads))
+        read_processor = ReadProcessor(
+            poly_a_clipping=True, min_read_length=12,
+            collapse_reads=collapse_reads)
+        stats.append(read_processor.process_single_end(
+            read_path, output_path))
+    assert read_gzip_file(output_path) == (
+        b">read_1_x2\nACGTACGTACGTACGT\n>read_2_x1\nACGTACGTACGTACGTACG\n")
+    # The processing statistics count all reads
+    assert stats[1].pop("no_of_unique_reads") == 2
+    assert stats[0] == stats[1]
+
+
+def test_reverse_complement(tmp_path):
+    read_path = str(tmp_path / "reads.fa")
+    output_path = str(tmp_path / "reads_processed.fa.gz")
+    with open(read_path, "w") as read_fh:
+        read_fh.write(">read_1\nAAACCCGGGTN\n>read_2\nACGTRYKM\n")
+    read_processor = ReadProcessor(min_read_length=1, reverse_complement=True)
+    read_processor.process_single_end(read_path, output_path)
+    assert read_gzip_file(output_path) == (
+        b">read_1\nNACCCGGGTTT\n>read_2\nKMRYACGT\n")
+
+
+def test_trim_by_quality():
+    read_processor = ReadProcessor(min_phred_score=20)
+    seqs = ["ACGTACGT", "ACGT", "", "ACGTAC", "ACG"]
+    qualities = [b"IIII#III", b"5III", b"", b"IIIIII", b"#II"]
+    assert read_processor._trim_by_quality(seqs, qualities) == [
+        "ACGT", "ACGT", "", "ACGTAC", ""]
+
+
+def test_bases_and_qualities_per_position(tmp_path):
+    read_path = str(tmp_path / "reads.fq")
+    output_path = str(tmp_path / "reads_processed.fa.gz")
+    with open(read_path, "w") as read_fh:
+        read_fh.write("@read_1\nACG\n+\nII#\n@read_2\nAT\n+\nI5\n")
+    stats = ReadProcessor(min_read_length=1).process_single_end(
+        read_path, output_path)
+    assert stats["position_and_base_and_freq"] == {
+        1: {"A": 2}, 2: {"C": 1, "T": 1}, 3: {"G": 1}}
+    assert stats["position_and_phred_score_and_freq"] == {
+        1: {40: 2}, 2: {40: 1, 20: 1}, 3: {2: 1}}
+
+
+def test_parallel_single_end_processing_equals_serial(tmp_path):
+    for fastq in [True, False]:
+        read_path = str(tmp_path / "reads.fq")
+        write_random_reads(read_path, 5000, fastq=fastq)
+        results = []
+        for processes in [1, 3]:
+            output_path = str(tmp_path / ("processed_%s.fa.gz" % processes))
+            # Small chunks are used to get many of them
+            read_processor = ReadProcessor(
+                poly_a_clipping=True, min_read_length=12, min_phred_score=5,
+                processes=processes, chunk_size=4096)
+            stats = read_processor.process_single_end(read_path, output_path)
+            results.append((read_gzip_file(output_path), stats))
+        assert results[0] == results[1]
+
+
+def test_parallel_paired_end_processing_equals_serial(tmp_path):
+    read_path_pair = [str(tmp_path / "reads_p1.fq"),
+                      str(tmp_path / "reads_p2.fq")]
+    write_random_reads(read_path_pair[0], 3000, seed=1)
+    write_random_reads(read_path_pair[1], 3000, seed=2)
+    results = []
+    for processes in [1, 3]:
+        output_path_pair = [
+            str(tmp_path / ("p1_processed_%s.fa.gz" % processes)),
+            str(tmp_path / ("p2_processed_%s.fa.gz" % processes))]
+        read_processor = ReadProcessor(
+            min_read_length=12, processes=processes,
+            paired_end_chunk_size=250)
+        stats = read_processor.process_paired_end(
+            read_path_pair, output_path_pair)
+        results.append((read_gzip_file(output_path_pair[0]),
+                        read_gzip_file(output_path_pair[1]), stats))
+    assert results[0] == results[1]
+
+
+def test_paired_end_processing_into_fifos(tmp_path):
+    # The reader consumes both FIFOs alternately like an aligner
+    # reading the mates of a pair. Writing the chunks of one mate
+    # must not block the writing of the other mate.
+    read_path_pair = [str(tmp_path / "reads_p1.fq"),
+                      str(tmp_path / "reads_p2.fq")]
+    write_random_reads(read_path_pair[0], 3000, seed=1)
+    write_random_reads(read_path_pair[1], 3000, seed=2)
+    fifo_path_pair = [str(tmp_path / "p1_processed_stream.fa"),
+                      str(tmp_path / "p2_processed_stream.fa")]
+    for fifo_path in fifo_path_pair:
+        os.mkfifo(fifo_path)
+    read_lines = {}
+
+    def read_fifos_alternately():
+        fifo_fhs = [open(fifo_path, "rb") for fifo_path in fifo_path_pair]
+        for fifo_path in fifo_path_pair:
+            read_lines[fifo_path] = []
+        while True:
+            lines = [fifo_fh.readline() for fifo_fh in fifo_fhs]
+            if not any(lines):
+                break
+            for fifo_path, line in zip(fifo_path_pair, lines):
+                read_lines[fifo_path].append(line)
+
+    reader = threading.Thread(target=read_fifos_alternately)
+    reader.start()
+    read_processor = ReadProcessor(min_read_length=12)
+    stats = read_processor.process_paired_end(read_path_pair, fifo_path_pair)
+    reader.join()
+    output_path_pair = [str(tmp_path / "p1_processed.fa.gz"),
+                        str(tmp_path / "p2_processed.fa.gz")]
+    assert stats == ReadProcessor(min_read_length=12).process_paired_end(
+        read_path_pair, output_path_pair)
+    for fifo_path, output_path in zip(fifo_path_pair, output_path_pair):
+        assert b"".join(read_lines[fifo_path]) == read_gzip_file(output_path)
+
+
+def read_names(fasta_content):
+    return [line[1:] for line in fasta_content.decode().splitlines()
+            if line.startswith(">")]
+
+
+def test_subsample_single_end(tmp_path):
+    read_path = str(tmp_path / "reads.fq")
+    write_random_reads(read_path, 1000)
+    sampled_read_names = {}
+    for name, subsample_kwargs in [
+            ("first", {"subsample_size": 10, "subsample_mode": "first"}),
+            ("reservoir", {"subsample_size": 100}),
+            ("reservoir_again", {"subsample_size": 100}),
+            ("fraction", {"subsample_fraction": 0.2})]:
+        output_path = str(tmp_path / ("%s.fa.gz" % name))
+        read_processor = ReadProcessor(
+            min_read_length=0, chunk_size=4096, **subsample_kwargs)
+        stats = read_processor.process_single_end(read_path, output_path)
+        sampled_read_names[name] = read_names(read_gzip_file(output_path))
+        assert stats["total_no_of_reads"] == len(sampled_read_names[name])
+    assert sampled_read_names["first"] == ["read_%s" % read_no
+                                           for read_no in range(10)]
+    # The reservoir sample is random but reproducible and in the
+    # order of the input file
+    assert len(sampled_read_names["reservoir"]) == 100
+    assert sampled_read_names["reservoir"] != [
+        "read_%s" % read_no for read_no in range(100)]
+    assert sampled_read_names["reservoir"] == sampled_read_names[
+        "reservoir_again"]
+    assert sampled_read_names["reservoir"] == sorted(
+        sampled_read_names["reservoir"],
+        key=lambda read_name: int(read_name.split("_")[1]))
+    assert 100 < len(sampled_read_names["fraction"]) < 300
+
+
+def test_subsample_paired_end(tmp_path):
+    read_path_pair = [str(tmp_path / "reads_p1.fq"),
+                      str(tmp_path / "reads_p2.fq")]
+    write_random_reads(read_path_pair[0], 1000, seed=1)
+    write_random_reads(read_path_pair[1], 1000, seed=2)
+    output_path_pair = [str(tmp_path / "p1_processed.fa.gz"),
+                        str(tmp_path / "p2_processed.fa.gz")]
+    read_processor = ReadProcessor(min_read_length=0, subsample_size=50)
+    read_processor.process_paired_end(read_path_pair, output_path_pair)
+    read_names_p1 = read_names(read_gzip_file(output_path_pair[0]))
+    read_names_p2 = read_names(read_gzip_file(output_path_pair[1]))
+    assert len(read_names_p1) == 50
+    # Mates are sampled together
+    assert read_names_p1 == read_names_p2
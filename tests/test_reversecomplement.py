@@ -0,0 +1,23 @@
+import sys
+sys.path.append("./tests")
+from Bio.Seq import Seq
+from reademptionlib.reversecomplement import (
+    reverse_complement, reverse_complements)
+
+
+def test_reverse_complement():
+    assert reverse_complement("AACGTTN") == "NAACGTT"
+    assert reverse_complement(b"AACGTTN") == b"NAACGTT"
+    assert reverse_complement("") == ""
+
+
+def test_reverse_complement_equals_biopython():
+    seq = "ACGTRYKMSWBDHVNacgtrykmswbdhvn"
+    assert reverse_complement(seq) == str(Seq(seq).reverse_complement())
+
+
+def test_reverse_complements():
+    seqs = ["AAAC", "", "GGT", "acgN"]
+    assert reverse_complements(seqs) == [
+        reverse_complement(seq) for seq in seqs]
+    assert reverse_complements([]) == []
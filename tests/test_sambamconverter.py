@@ -0,0 +1,89 @@
+import multiprocessing
+import os
+import sys
+sys.path.append("./tests")
+import pysam
+from reademptionlib.sambamconverter import SamToBamConverter
+
+sam_header = "@HD\tVN:1.0\n@SQ\tSN:chrom\tLN:100\n"
+sam_alignments = (
+    "read_1\t0\tchrom\t50\t255\t4M\t*\t0\t0\tACGT\t*\tNH:i:1\n"
+    "read_2\t0\tchrom\t10\t255\t4M\t*\t0\t0\tACGT\t*\tNH:i:1\n")
+
+
+def _bam_read_names_and_starts(bam_path):
+    with pysam.AlignmentFile(bam_path) as bam:
+        return [(alignment.query_name, alignment.reference_start)
+                for alignment in bam.fetch()]
+
+
+def _write_sam(sam_path):
+    with open(sam_path, "w") as sam_fh:
+        sam_fh.write(sam_header + sam_alignments)
+
+
+def test_sam_to_bam(tmpdir):
+    sam_path = str(tmpdir.join("alignments.sam"))
+    bam_path_prefix = str(tmpdir.join("alignments"))
+    _write_sam(sam_path)
+    SamToBamConverter().sam_to_bam(sam_path, bam_path_prefix)
+    assert _bam_read_names_and_starts(bam_path_prefix + ".bam") == [
+        ("read_2", 9), ("read_1", 49)]
+    assert sorted(os.listdir(str(tmpdir))) == [
+        "alignments.bam", "alignments.bam.bai"]
+
+
+def test_sam_to_bam_empty(tmpdir):
+    sam_path = str(tmpdir.join("alignments.sam"))
+    bam_path_prefix = str(tmpdir.join("alignments"))
+    with open(sam_path, "w") as sam_fh:
+        sam_fh.write(sam_header)
+    SamToBamConverter().sam_to_bam(sam_path, bam_path_prefix)
+    assert _bam_read_names_and_starts(bam_path_prefix + ".bam") == []
+
+
+def test_sort_sam_to_bam_from_fifo(tmpdir):
+    fifo_path = str(tmpdir.join("alignments.sam"))
+    bam_path_prefix = str(tmpdir.join("alignments"))
+    os.mkfifo(fifo_path)
+    # pysam keeps the GIL while reading, so the SAM file is written by
+    # another process
+    writer = multiprocessing.Process(target=_write_sam, args=(fifo_path,))
+    writer.start()
+    SamToBamConverter().sort_sam_to_bam(fifo_path, bam_path_prefix)
+    writer.join()
+    assert _bam_read_names_and_starts(bam_path_prefix + ".bam") == [
+        ("read_2", 9), ("read_1", 49)]
+
+
+def test_sam_to_bam_with_threads_and_memory(tmpdir):
+    sam_path = str(tmpdir.join("alignments.sam"))
+    bam_path_prefix = str(tmpdir.join("alignments"))
+    _write_sam(sam_path)
+    SamToBamConverter(threads=2, memory_per_thread=10000000).sam_to_bam(
+        sam_path, bam_path_prefix)
+    assert _bam_read_names_and_starts(bam_path_prefix + ".bam") == [
+        ("read_2", 9), ("read_1", 49)]
+
+
+def test_sam_file_is_empty(tmpdir):
+    sam_to_bam_converter = SamToBamConverter()
+    sam_path = str(tmpdir.join("alignments.sam"))
+    # A header longer than the block that is checked
+    large_header = sam_header + "".join(
+        "@SQ\tSN:chrom_%s\tLN:100\n" % index for index in range(10000))
+    with open(sam_path, "w") as sam_fh:
+        sam_fh.write(large_header)
+    assert sam_to_bam_converter._sam_file_is_empty(sam_path) is True
+    with open(sam_path, "w") as sam_fh:
+        sam_fh.write(large_header + sam_alignments)
+    assert sam_to_bam_converter._sam_file_is_empty(sam_path) is False
+    with open(sam_path, "w") as sam_fh:
+        sam_fh.write(sam_alignments.rstrip("\n"))
+    assert sam_to_bam_converter._sam_file_is_empty(sam_path) is False
+    # A last alignment longer than the block that is checked. The
+    # block starts within a tag consisting of "@"s.
+    with open(sam_path, "w") as sam_fh:
+        sam_fh.write(large_header + sam_alignments.rstrip("\n") +
+                     "\tXX:Z:" + "@" * 100000 + "\n")
+    assert sam_to_bam_converter._sam_file_is_empty(sam_path) is False
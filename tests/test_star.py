@@ -0,0 +1,50 @@
+import os
+import stat
+import subprocess
+import sys
+sys.path.append("./tests")
+import pytest
+from reademptionlib.star import STAR
+
+
+def _fake_star_bin(tmpdir, exit_status=0):
+    """Return a STAR executable that only records its arguments."""
+    star_bin = str(tmpdir.join("STAR"))
+    with open(star_bin, "w") as star_bin_fh:
+        star_bin_fh.write('#!/bin/sh\necho "$@" >> %s\nexit %s\n' % (
+            tmpdir.join("calls.txt"), exit_status))
+    os.chmod(star_bin, os.stat(star_bin).st_mode | stat.S_IEXEC)
+    return star_bin
+
+
+def _calls(tmpdir):
+    with open(str(tmpdir.join("calls.txt"))) as calls_fh:
+        return calls_fh.read().splitlines()
+
+
+def test_shared_genome(tmpdir):
+    star = STAR(_fake_star_bin(tmpdir))
+    with star.shared_genome("index", "log_"):
+        star.align_reads(2, "index", "reads.fa", "lib_", "annotation.gff",
+                         genome_load="LoadAndKeep")
+    calls = _calls(tmpdir)
+    assert calls[0] == (
+        "--genomeLoad LoadAndExit --genomeDir index --outFileNamePrefix log_")
+    assert calls[1].endswith("--genomeLoad LoadAndKeep")
+    assert calls[2] == (
+        "--genomeLoad Remove --genomeDir index --outFileNamePrefix log_")
+
+
+def test_shared_genome_is_removed_after_failure(tmpdir):
+    star = STAR(_fake_star_bin(tmpdir))
+    with pytest.raises(ValueError):
+        with star.shared_genome("index", "log_"):
+            raise ValueError("Alignment failed")
+    assert _calls(tmpdir)[-1] == (
+        "--genomeLoad Remove --genomeDir index --outFileNamePrefix log_")
+
+
+def test_failed_alignment(tmpdir):
+    star = STAR(_fake_star_bin(tmpdir, exit_status=137))
+    with pytest.raises(subprocess.CalledProcessError):
+        star.align_reads(2, "index", "reads.fa", "lib_", "annotation.gff")
@@ -0,0 +1,81 @@
+import sys
+import time
+sys.path.append("./tests")
+import pytest
+from reademptionlib.taskscheduler import (
+    TaskScheduler, TaskSchedulingError, split_threads)
+
+
+def _timestamps(duration):
+    start_time = time.time()
+    time.sleep(duration)
+    return start_time, time.time()
+
+
+def _add(first_summand, second_summand):
+    return first_summand + second_summand
+
+
+def _fail():
+    raise ValueError("Task failed")
+
+
+def test_dependencies_are_finished_first():
+    task_scheduler = TaskScheduler(max_cpus=4)
+    task_scheduler.add_task("first", _timestamps, args=(0.2,))
+    task_scheduler.add_task(
+        "second", _timestamps, args=(0.1,), dependencies=["first"])
+    results = task_scheduler.run()
+    assert results["first"][1] <= results["second"][0]
+    assert task_scheduler.runtimes["first"] >= 0.2
+
+
+def test_cpu_limit():
+    task_scheduler = TaskScheduler(max_cpus=2)
+    task_scheduler.add_task("large", _timestamps, args=(0.3,), cpus=2)
+    task_scheduler.add_task("small_1", _timestamps, args=(0.3,))
+    task_scheduler.add_task("small_2", _timestamps, args=(0.3,))
+    results = task_scheduler.run()
+    # The large task runs alone, the small ones run in parallel
+    assert results["large"][1] <= min(
+        results["small_1"][0], results["small_2"][0])
+    assert results["small_1"][0] < results["small_2"][1]
+    assert results["small_2"][0] < results["small_1"][1]
+
+
+def test_memory_limit():
+    task_scheduler = TaskScheduler(max_cpus=2, max_memory=100)
+    task_scheduler.add_task("first", _timestamps, args=(0.2,), memory=80)
+    task_scheduler.add_task("second", _timestamps, args=(0.2,), memory=80)
+    results = task_scheduler.run()
+    assert results["first"][1] <= results["second"][0]
+
+
+def test_results():
+    task_scheduler = TaskScheduler(max_cpus=2)
+    task_scheduler.add_task("sum", _add, args=(1, 2))
+    assert task_scheduler.run() == {"sum": 3}
+
+
+def test_failing_task():
+    task_scheduler = TaskScheduler(max_cpus=2)
+    task_scheduler.add_task("fail", _fail)
+    with pytest.raises(ValueError):
+        task_scheduler.run()
+
+
+def test_unknown_dependency():
+    task_scheduler = TaskScheduler(max_cpus=2)
+    with pytest.raises(TaskSchedulingError):
+        task_scheduler.add_task("task", _add, args=(1, 2),
+                                dependencies=["missing"])
+
+
+def test_split_threads():
+    assert split_threads([10, 10, 10, 10], 16, 2) == [8, 8, 8, 8]
+    assert split_threads([30, 10, 10, 10], 16, 2) == [16, 5, 5, 5]
+    assert split_threads([1, 1000], 16, 2) == [1, 16]
+    # Fewer jobs than may run concurrently
+    assert split_threads([10, 10], 16, 4) == [8, 8]
+    assert split_threads([0, 0], 4, 2) == [2, 2]
+    assert split_threads([], 4, 2) == []